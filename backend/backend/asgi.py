@@ -10,14 +10,21 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from django.urls import re_path
-from game.consumers import MatchStreamConsumer
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 
+# Set up Django before importing anything that touches models, so the app can
+# be served directly (daphne backend.asgi:application), not only via runserver
 django_app = get_asgi_application()
 
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from django.urls import re_path  # noqa: E402
+from game.consumers import MatchStreamConsumer  # noqa: E402
+from game.timers import turn_timers  # noqa: E402
+
+# Watch the matches that were in play before this process started
+turn_timers.start()
+
 websocket_urlpatterns = [
     re_path(r"^matches/(?P<match_id>[0-9a-f\-]+)/stream$", MatchStreamConsumer.as_asgi()),
 ]
@@ -48,6 +48,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "game.middleware.ring_epoch_middleware",
 ]
 
 ROOT_URLCONF = "backend.urls"
@@ -135,12 +136,28 @@ CORS_ALLOWED_ORIGINS = [
 ]
 CORS_ALLOW_CREDENTIALS = True
 
-# Channels in-memory layer for dev
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
+# Channels in-memory layer for dev. With CHANNEL_HUBS set (comma-separated
+# unix:/path or tcp:host:port, one per `manage.py run_channel_hub`), groups are
+# sharded across hubs so several worker processes can serve the same match.
+CHANNEL_HUBS = [h for h in env.str("CHANNEL_HUBS", default="").split(",") if h]
+if CHANNEL_HUBS:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "game.layers.ShardedChannelLayer",
+            "CONFIG": {"hosts": CHANNEL_HUBS},
+        }
     }
-}
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        }
+    }
+
+# Per-process cache by default. Several workers need a shared backend
+# (e.g. CACHE_URL=rediscache://... or dbcache://table) so that card catalog
+# changes (cards.catalog) reach all of them.
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
 
 # DRF Auth
 REST_FRAMEWORK = {
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 
 application = get_wsgi_application()
+
+from game.timers import turn_timers  # noqa: E402
+
+# Watch the matches that were in play before this process started
+turn_timers.start()
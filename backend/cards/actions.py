@@ -0,0 +1,96 @@
+"""Card effects applied to in-memory match state (see ``game.actions``).
+
+Each play claims the room version first, like a turn change, so a copy of the
+match that another worker has moved on cannot accept it.
+"""
+from game.actions import ActionError, check_play, claim_turn, claimed, player_of, record, require_active
+from game.broadcast import MatchBroadcast
+from game.engine import store
+from .decks import deal
+
+
+def draw(state, user_id, cards, claim: bool = True):
+    if claim:
+        claim_turn(state, *check_play(state, user_id))
+    with claimed(state):
+        require_active(state)
+        player = player_of(state, user_id)
+        card = deal(state, cards)
+        if card is None:
+            raise ActionError("no event cards", 404)
+        effect = int(card.effect_points or 0)
+        # Advanced rules: no movement, only points effects
+        if effect >= 0:
+            player.current_points += effect
+        else:
+            player.liabilities += abs(effect)
+        state.mark_player(player)
+        delta = state.publish()
+        record(state, player.user_id, "card_draw", {"cardId": str(card.id), "effect": effect}, delta)
+        current_points, liabilities = player.current_points, player.liabilities
+    store.mark_dirty(state)
+
+    card_data = {
+        "cardId": str(card.id),
+        "title": card.title,
+        "message": card.message,
+        "effect_points": effect,
+    }
+    out = MatchBroadcast(state.id)
+    out.add("card_draw", card_data)
+    # state update carries only what changed
+    if delta:
+        out.add("state_update", delta)
+    return {"ok": True, "card": card_data, "currentPoints": current_points, "liabilities": liabilities}, out
+
+
+def play_savings(state, user_id, card, amount: int, bonus_rule, claim: bool = True):
+    if claim:
+        claim_turn(state, *check_play(state, user_id))
+    with claimed(state):
+        require_active(state)
+        player = player_of(state, user_id)
+        # Deduct from on-hand points
+        if player.current_points < amount:
+            raise ActionError("insufficient points")
+        player.current_points -= amount
+        player.savings += amount
+
+        # Apply bonus if threshold met and condition satisfied (see ``cards.rules``)
+        bonus = 0
+        if amount >= int(card.save_threshold or 0):
+            bonus = bonus_rule(player)
+        if bonus > 0:
+            player.savings += bonus
+        state.mark_player(player)
+        delta = state.publish()
+        record(state, player.user_id, "savings_play", {"cardId": str(card.id), "amount": amount, "bonus": bonus}, delta)
+        savings, current_points = player.savings, player.current_points
+    store.mark_dirty(state)
+
+    out = MatchBroadcast(state.id)
+    out.add("savings_play", {"cardId": str(card.id), "amount": amount, "bonus": bonus})
+    if delta:
+        out.add("state_update", delta)
+    return {"ok": True, "savings": savings, "currentPoints": current_points}, out
+
+
+def play_spending(state, user_id, card, claim: bool = True):
+    if claim:
+        claim_turn(state, *check_play(state, user_id))
+    with claimed(state):
+        require_active(state)
+        player = player_of(state, user_id)
+        # Advanced rule: spending increases liabilities; does not move pieces
+        player.liabilities += int(card.total_cost or 0)
+        state.mark_player(player)
+        delta = state.publish()
+        record(state, player.user_id, "spending_play", {"cardId": str(card.id), "total": int(card.total_cost or 0)}, delta)
+        liabilities = player.liabilities
+    store.mark_dirty(state)
+
+    out = MatchBroadcast(state.id)
+    out.add("spending_play", {"cardId": str(card.id), "total": int(card.total_cost or 0)})
+    if delta:
+        out.add("state_update", delta)
+    return {"ok": True, "liabilities": liabilities}, out
@@ -0,0 +1,155 @@
+"""Process-wide, versioned copy of the card tables.
+
+Card rows change only through the admin endpoints, but are read on every
+card play and list request. ``catalog.current()`` returns an immutable
+``Catalog`` snapshot of all four tables. The public list responses in the
+snapshot are serialized once, ETag included, and every savings card's
+bonus condition is compiled (``cards.rules``).
+
+The admin endpoints call ``catalog.bump()``, which stores a new version
+token in the Django cache (``CACHE_URL``). When that cache is shared, every
+worker sees the new token. A worker compares its snapshot with the cache at
+most every ``CARD_CATALOG_CHECK`` seconds and reloads lazily when the
+versions differ.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import AssetCards, EventCards, SavingsCards, SpendingCards
+from .rules import RuleError, compile_bonus, no_bonus
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "cards:catalog:version"
+CHECK_INTERVAL = getattr(settings, "CARD_CATALOG_CHECK", 1.0)  # seconds between version checks
+LIST_LIMIT = 200  # cards per public list response
+
+
+def card_key(card_id) -> str | None:
+    """Canonical catalog key for a client-supplied card id; None if malformed."""
+    try:
+        return str(uuid.UUID(str(card_id)))
+    except ValueError:
+        return None
+
+
+def _serialized(items: list) -> tuple[bytes, str]:
+    body = json.dumps(items, separators=(",", ":"), ensure_ascii=False).encode()
+    return body, '"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest()
+
+
+def _bonus_rule(card: SavingsCards):
+    try:
+        return compile_bonus(card.bonus_condition)
+    except RuleError as e:
+        # Rows written before validation existed; such cards pay no bonus
+        logger.warning("savings card %s has an invalid bonus_condition (%s)", card.id, e)
+        return no_bonus
+
+
+class Catalog:
+    """One version of every card table, keyed by card id. Do not mutate."""
+
+    def __init__(self, version, assets, events, savings, spending):
+        self.version = version
+        self.assets = {str(c.id): c for c in assets}
+        self.events = {str(c.id): c for c in events}
+        self.savings = {str(c.id): c for c in savings}
+        self.spending = {str(c.id): c for c in spending}
+        self.bonus_rules = {key: _bonus_rule(card) for key, card in self.savings.items()}
+        self.savings_list = _serialized([
+            {"id": str(x.id), "name": x.name, "save_threshold": int(x.save_threshold or 0), "bonus_condition": x.bonus_condition}
+            for x in savings[:LIST_LIMIT]
+        ])
+        self.spending_list = _serialized([
+            {"id": str(x.id), "name": x.name, "total_cost": int(x.total_cost or 0)}
+            for x in spending[:LIST_LIMIT]
+        ])
+
+    @classmethod
+    def load(cls, version) -> "Catalog":
+        return cls(
+            version,
+            list(AssetCards.objects.all()),
+            list(EventCards.objects.all()),
+            list(SavingsCards.objects.all()),
+            list(SpendingCards.objects.all()),
+        )
+
+    @classmethod
+    async def aload(cls, version) -> "Catalog":
+        return cls(
+            version,
+            [c async for c in AssetCards.objects.all()],
+            [c async for c in EventCards.objects.all()],
+            [c async for c in SavingsCards.objects.all()],
+            [c async for c in SpendingCards.objects.all()],
+        )
+
+    def savings_card(self, card_id) -> SavingsCards | None:
+        return self.savings.get(card_key(card_id))
+
+    def bonus_rule(self, card: SavingsCards):
+        return self.bonus_rules[str(card.id)]
+
+    def spending_card(self, card_id) -> SpendingCards | None:
+        return self.spending.get(card_key(card_id))
+
+
+class CardCatalog:
+    def __init__(self, check_interval=CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._snapshot: Catalog | None = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _fresh(self) -> Catalog | None:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked < self.check_interval:
+            return snapshot
+        return None
+
+    def current(self) -> Catalog:
+        snapshot = self._fresh()
+        if snapshot is not None:
+            return snapshot
+        # Read the version before loading: a bump during the load is seen next time
+        version = cache.get(VERSION_KEY)
+        self._checked = time.monotonic()
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = Catalog.load(version)
+            return self._snapshot
+
+    async def acurrent(self) -> Catalog:
+        """``current`` for async callers; reloads with the async ORM."""
+        snapshot = self._fresh()
+        if snapshot is not None:
+            return snapshot
+        version = await cache.aget(VERSION_KEY)
+        self._checked = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != version:
+            snapshot = await Catalog.aload(version)
+            with self._lock:
+                self._snapshot = snapshot
+        return snapshot
+
+    def bump(self):
+        """Publish a new catalog version; call after changing a card table."""
+        cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = None
+
+
+catalog = CardCatalog()
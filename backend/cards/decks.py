@@ -0,0 +1,36 @@
+"""Shuffled event-card decks, one per match.
+
+A match's deck order (event card ids) is dealt at start and kept on its
+``MatchState``. The order is written back with the room, along with how far
+into the deck the match has drawn. A draw takes the next id, so picking the card
+costs no query. When the deck runs out it is reshuffled, as in the physical game.
+Card rows come from the card catalog (``cards.catalog``).
+"""
+import random
+
+from .catalog import Catalog
+from .models import EventCards
+
+
+def shuffled(cards: Catalog) -> list[str]:
+    deck = list(cards.events)
+    random.shuffle(deck)
+    return deck
+
+
+def deal(state, cards: Catalog) -> EventCards | None:
+    """Draw the next card of ``state``'s deck, reshuffling when it runs out.
+
+    Call while holding ``state.lock``. Returns None if there are no event cards.
+    """
+    for _ in range(2):
+        while state.deck_pos < len(state.event_deck):
+            card = cards.events.get(state.event_deck[state.deck_pos])
+            state.deck_pos += 1
+            state.room_dirty = True
+            # Cards deleted since the deal are skipped
+            if card is not None:
+                return card
+        state.event_deck, state.deck_pos = shuffled(cards), 0
+        state.room_dirty = True
+    return None
@@ -0,0 +1,127 @@
+"""Compiled savings-card bonus rules.
+
+A savings card's ``bonus_condition`` JSON is compiled once, when the card
+catalog loads, into a function ``rule(player) -> bonus``. Playing the card
+then needs one call and no JSON handling. The admin endpoint compiles the
+JSON before saving the card, so an invalid condition is rejected there.
+
+A condition is an object with a ``type``. The top-level condition also
+carries the ``bonus`` it pays::
+
+    {"type": "flat_bonus", "bonus": 10}
+    {"type": "if_owns_asset", "bonus": 20}                 # any asset
+    {"type": "if_owns_specific_asset", "assetId": "a1", "bonus": 20}
+    {"type": "min_assets", "count": 2, "bonus": 30}
+    {"type": "savings_at_least", "amount": 300, "bonus": 25}
+    {"type": "points_at_least", "amount": 100, "bonus": 5}
+    {"type": "max_liabilities", "amount": 0, "bonus": 15}
+    {"type": "phase", "min": 3, "max": 5, "bonus": 10}     # furthest token's phase
+    {"type": "all", "rules": [{...}, {...}], "bonus": 40}  # or "any"
+
+Savings are checked after the deposit. The top-level ``bonus`` must be a
+positive integer; conditions nested under ``all``/``any`` need none. An
+empty condition pays nothing.
+"""
+from game import board
+
+
+class RuleError(ValueError):
+    pass
+
+
+def no_bonus(player) -> int:
+    return 0
+
+
+def _int(cond: dict, key: str, default=None) -> int:
+    value = cond.get(key, default)
+    if value is None:
+        raise RuleError(f"{cond.get('type')}: '{key}' is required")
+    # int() would quietly turn true into 1 and 2.5 into 2
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise RuleError(f"{cond.get('type')}: '{key}' must be an integer")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise RuleError(f"{cond.get('type')}: '{key}' must be an integer")
+
+
+def _owns_specific_asset(cond):
+    asset_id = cond.get("assetId")
+    if not asset_id:
+        raise RuleError("if_owns_specific_asset: 'assetId' is required")
+    return lambda p: any((a.get("assetId") if isinstance(a, dict) else a) == asset_id for a in p.assets)
+
+
+def _min_assets(cond):
+    count = _int(cond, "count")
+    return lambda p: len(p.assets) >= count
+
+
+def _savings_at_least(cond):
+    amount = _int(cond, "amount")
+    return lambda p: p.savings >= amount
+
+
+def _points_at_least(cond):
+    amount = _int(cond, "amount")
+    return lambda p: p.current_points >= amount
+
+
+def _max_liabilities(cond):
+    amount = _int(cond, "amount")
+    return lambda p: p.liabilities <= amount
+
+
+def _phase(cond):
+    low, high = _int(cond, "min", 1), _int(cond, "max", board.BOARD_SIZE // board.SPOTS_PER_PHASE)
+    if low > high:
+        raise RuleError("phase: 'min' is above 'max'")
+    return lambda p: low <= board.phase_of(board.furthest_token(p.tokens)) <= high
+
+
+def _combined(cond):
+    parts = cond.get("rules")
+    if not isinstance(parts, list) or not parts:
+        raise RuleError(f"{cond['type']}: 'rules' must be a non-empty list")
+    checks = tuple(_predicate(part) for part in parts)
+    if cond["type"] == "all":
+        return lambda p: all(check(p) for check in checks)
+    return lambda p: any(check(p) for check in checks)
+
+
+PREDICATES = {
+    "flat_bonus": lambda cond: lambda p: True,
+    "if_owns_asset": lambda cond: lambda p: bool(p.assets),
+    "if_owns_specific_asset": _owns_specific_asset,
+    "min_assets": _min_assets,
+    "savings_at_least": _savings_at_least,
+    "points_at_least": _points_at_least,
+    "max_liabilities": _max_liabilities,
+    "phase": _phase,
+    "all": _combined,
+    "any": _combined,
+}
+
+
+def _predicate(cond):
+    if not isinstance(cond, dict):
+        raise RuleError("a condition must be an object")
+    build = PREDICATES.get(cond.get("type"))
+    if build is None:
+        raise RuleError(f"unknown condition type {cond.get('type')!r}")
+    return build(cond)
+
+
+def compile_bonus(cond):
+    """Compile a ``bonus_condition`` into ``rule(player) -> bonus``; raises RuleError."""
+    if not cond:
+        return no_bonus
+    check = _predicate(cond)
+    bonus = _int(cond, "bonus")
+    if bonus <= 0:
+        raise RuleError(f"{cond.get('type')}: 'bonus' must be positive")
+
+    def rule(player) -> int:
+        return bonus if check(player) else 0
+    return rule
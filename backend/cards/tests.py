@@ -1,3 +1,134 @@
+import json
+import uuid
+from unittest import mock
+
+from django.core.cache import cache
+from django.db.models import F
 from django.test import TestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from game.engine import PlayerState, store
+from game.models import GameRooms
+from game.tests import MatchTestCase
+from . import views as card_views
+from .catalog import VERSION_KEY, catalog
+from .models import EventCards, SavingsCards
+from .rules import RuleError, compile_bonus
+
+
+class EventDeckTest(MatchTestCase):
+    def test_draws_walk_the_shuffled_deck_then_reshuffle(self):
+        for i in range(3):
+            EventCards.objects.create(id=uuid.uuid4(), title=f"Card {i}", effect_points=10, message="")
+        match_id = self.start_match()
+        state = store.get(match_id)
+        deck = list(state.event_deck)
+        self.assertEqual(len(deck), 3)
+
+        drawn = []
+        # One version claim per draw; the card itself comes from the deck
+        with self.assertNumQueries(3):
+            for _ in range(3):
+                res = self.client.post(f"/matches/{match_id}/cards/draw", {"userId": str(self.alice.id)}, format="json")
+                drawn.append(res.data["card"]["cardId"])
+        self.assertEqual(drawn, deck)
+
+        store.flush()
+        store.clear()
+        self.assertEqual((store.get(match_id).event_deck, store.get(match_id).deck_pos), (deck, 3))
+        res = self.client.post(f"/matches/{match_id}/cards/draw", {"userId": str(self.alice.id)}, format="json")
+        self.assertIn(res.data["card"]["cardId"], deck)
+        self.assertEqual(store.get(match_id).deck_pos, 1)
+
+
+class CardCatalogTest(MatchTestCase):
+    def test_lists_are_cached_until_the_catalog_version_moves(self):
+        SavingsCards.objects.create(id=uuid.uuid4(), name="Rainy day", save_threshold=50, bonus_condition={"type": "flat_bonus", "bonus": 5})
+        res = self.client.get("/cards/savings")
+        etag = res.headers["ETag"]
+        self.assertEqual([c["name"] for c in json.loads(res.content)], ["Rainy day"])
+        with self.assertNumQueries(0):
+            res = self.client.get("/cards/savings", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+
+        staff = mock.Mock(is_authenticated=True, is_staff=True)
+        # Called directly: Django's own admin site shadows the /admin/cards/ routes
+        request = APIRequestFactory().post("/admin/cards/savings/", {"id": str(uuid.uuid4()), "name": "Holiday", "save_threshold": 80}, format="json")
+        force_authenticate(request, staff)
+        self.assertEqual(card_views.admin_create_savings(request).status_code, 201)
+        res = self.client.get("/cards/savings", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(json.loads(res.content)), 2)
+
+    def test_savings_bonus_rule_applies_and_admin_rejects_invalid_ones(self):
+        card = SavingsCards.objects.create(id=uuid.uuid4(), name="Debt free", save_threshold=50, bonus_condition={
+            "type": "all", "bonus": 15, "rules": [{"type": "max_liabilities", "amount": 0}, {"type": "min_assets", "count": 1}],
+        })
+        match_id = self.start_match()
+        with store.get(match_id).lock:
+            store.get(match_id).player_for_user(self.alice.id).assets = [{"assetId": "a1"}]
+        with self.assertNumQueries(1):  # the version claim
+            res = self.client.post(f"/matches/{match_id}/cards/savings", {"userId": str(self.alice.id), "cardId": str(card.id), "amount": 50}, format="json")
+        self.assertEqual(res.data["savings"], 65)
+
+        request = APIRequestFactory().post("/admin/cards/savings/", {"name": "Bad", "save_threshold": 1, "bonus_condition": {"type": "lottery"}}, format="json")
+        force_authenticate(request, mock.Mock(is_authenticated=True, is_staff=True))
+        res = card_views.admin_create_savings(request)
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("lottery", res.data["detail"])
+
+        request = APIRequestFactory().post("/admin/cards/savings/", {"name": "Free", "save_threshold": 1, "bonus_condition": {"type": "flat_bonus"}}, format="json")
+        force_authenticate(request, mock.Mock(is_authenticated=True, is_staff=True))
+        res = card_views.admin_create_savings(request)
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("bonus", res.data["detail"])
+        self.assertFalse(SavingsCards.objects.filter(name="Free").exists())
+
+    def test_play_on_a_stale_match_is_rejected_not_lost(self):
+        card = SavingsCards.objects.create(id=uuid.uuid4(), name="Rainy day", save_threshold=50)
+        match_id = self.start_match()
+        store.flush()
+        # Another worker moves the room on behind this worker's cache
+        GameRooms.objects.filter(id=match_id).update(version=F("version") + 1)
+        body = {"userId": str(self.alice.id), "cardId": str(card.id), "amount": 300}
+        res = self.client.post(f"/matches/{match_id}/cards/savings", body, format="json")
+        self.assertEqual(res.status_code, 409)
+        self.assertTrue(res.data["retryable"])
+
+        res = self.client.post(f"/matches/{match_id}/cards/savings", body, format="json")
+        self.assertEqual((res.status_code, res.data["savings"]), (200, 300))
+        store.flush()
+        store.clear()
+        self.assertEqual(store.get(match_id).player_for_user(self.alice.id).savings, 300)
+
+    def test_worker_reloads_when_another_bumps_the_version(self):
+        before = catalog.current()
+        self.assertIs(catalog.current(), before)
+        SavingsCards.objects.create(id=uuid.uuid4(), name="Rainy day", save_threshold=50)
+        cache.set(VERSION_KEY, "from-another-worker", None)
+        with mock.patch.object(catalog, "check_interval", 0):
+            self.assertEqual(len(catalog.current().savings), 1)
+
 
-# Create your tests here.
+class BonusRuleTest(TestCase):
+    def test_conditions(self):
+        player = PlayerState(id=1, tokens=[25, 3, 0, 0], savings=300, liabilities=40, assets=[{"assetId": "a2"}])
+        cases = [
+            ({"type": "flat_bonus", "bonus": 10}, 10),
+            ({"type": "if_owns_asset", "bonus": 10}, 10),
+            ({"type": "if_owns_asset", "assetId": "a1", "bonus": 10}, 10),  # still any asset
+            ({"type": "if_owns_specific_asset", "assetId": "a1", "bonus": 10}, 0),
+            ({"type": "if_owns_specific_asset", "assetId": "a2", "bonus": 10}, 10),
+            ({"type": "savings_at_least", "amount": 300, "bonus": "7"}, 7),
+            ({"type": "max_liabilities", "amount": 0, "bonus": 10}, 0),
+            ({"type": "phase", "min": 3, "max": 3, "bonus": 4}, 4),
+            ({"type": "any", "bonus": 9, "rules": [{"type": "min_assets", "count": 2}, {"type": "phase", "max": 2}]}, 0),
+            (None, 0),
+        ]
+        for cond, bonus in cases:
+            self.assertEqual(compile_bonus(cond)(player), bonus, cond)
+        for bad in ({"type": "min_assets", "bonus": 5}, {"type": "all", "rules": []}, ["flat_bonus"], {"type": "phase", "min": 4, "max": 2}, {"type": "if_owns_specific_asset", "bonus": 5},
+                    {"type": "flat_bonus"}, {"type": "flat_bonus", "bonus": 0}, {"type": "flat_bonus", "bonus": -5},
+                    {"type": "flat_bonus", "bonus": 2.5}, {"type": "flat_bonus", "bonus": "ten"}, {"type": "flat_bonus", "bonus": True}):
+            with self.assertRaises(RuleError):
+                compile_bonus(bad)
@@ -0,0 +1,67 @@
+"""Dream purchase applied to in-memory match state (see ``game.actions``)."""
+from django.utils import timezone
+
+from game.actions import ActionError, claim_turn, claimed, player_of, record, require_active
+from game.broadcast import MatchBroadcast
+from game.engine import store
+
+
+def _check(state, user_id, dream):
+    # Called with state.lock held
+    require_active(state)
+    player = player_of(state, user_id)
+    # Win condition checks (as per docs)
+    has_two_assets = len(player.assets) >= 2
+    liabilities_cleared = player.liabilities == 0
+    savings_ok = player.savings >= 500
+
+    if not has_two_assets:
+        raise ActionError("must have purchased 2 assets")
+    if not liabilities_cleared:
+        raise ActionError("liabilities must be cleared")
+    if not savings_ok:
+        raise ActionError("savings must be at least 500")
+
+    # Enforce dream purchase using on-hand points (asset profits), not from savings
+    if int(player.current_points) < int(dream.cost or 0):
+        raise ActionError("insufficient on-hand points for dream")
+    return player
+
+
+def check_purchase(state, user_id, dream):
+    """Validate a purchase; returns the ``(version, turn)`` to claim.
+
+    The caller records the unlock first so that a failed write leaves the
+    match playable; ``purchase`` checks again under the lock before ending it.
+    """
+    with state.lock:
+        _check(state, user_id, dream)
+        return state.row_version, state.current_turn
+
+
+def purchase(state, user_id, dream, claim: bool = True):
+    if claim:
+        claim_turn(state, *check_purchase(state, user_id, dream))
+    with claimed(state):
+        player = _check(state, user_id, dream)
+        # Deduct points; the caller has recorded the unlock
+        player.current_points = int(player.current_points) - int(dream.cost)
+        state.mark_player(player)
+        # The purchase ends the match; the flusher persists the result
+        state.status = "ended"
+        state.ended_at = timezone.now()
+        state.winner_id = player.user_id
+        state.dream_id = dream.id
+        state.room_dirty = True
+        delta = state.publish()
+        record(state, player.user_id, "dream_purchase", {"dreamId": str(dream.id), "cost": int(dream.cost)}, delta)
+    store.mark_dirty(state)
+
+    # Broadcast dream purchase + game_end
+    out = MatchBroadcast(state.id)
+    out.add("dream_purchase", {"userId": user_id, "dreamId": str(dream.id), "cost": int(dream.cost)})
+    out.add("game_end", {"winnerId": user_id, "dreamId": str(dream.id)})
+    # state update carries only what changed
+    if delta:
+        out.add("state_update", delta)
+    return {"ok": True, "winnerId": user_id, "dreamId": str(dream.id)}, out
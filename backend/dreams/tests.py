@@ -1,3 +1,45 @@
-from django.test import TestCase
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from django.db import DatabaseError
+
+from game.engine import store
+from game.models import GameRooms
+from game.tests import MatchTestCase
+from .models import Dreams, UserDreams
+
+
+class PurchaseTest(MatchTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dream = Dreams.objects.create(id=uuid.uuid4(), name="House", slug="house", cost=100, order_index=1, image_url="")
+        self.match_id = self.start_match()
+        self.state = store.get(self.match_id)
+        with self.state.lock:
+            alice = self.state.player_for_user(self.alice.id)
+            alice.assets = [{"assetId": "a1"}, {"assetId": "a2"}]
+            alice.savings = 500
+
+    def purchase(self):
+        return self.client.post(f"/matches/{self.match_id}/dreams/purchase", {"userId": str(self.alice.id), "dreamId": str(self.dream.id)}, format="json")
+
+    def test_purchase_ends_match(self):
+        self.assertEqual(self.purchase().status_code, 200)
+        self.assertEqual(self.purchase().status_code, 409)
+        # Nothing else can be played once the match is over
+        res = self.client.post(f"/matches/{self.match_id}/roll", {"userId": str(self.alice.id)}, format="json")
+        self.assertEqual((res.status_code, res.data["detail"]), (409, "match is not active"))
+        res = self.client.post(f"/matches/{self.match_id}/cards/draw", {"userId": str(self.alice.id)}, format="json")
+        self.assertEqual(res.status_code, 409)
+        store.flush()
+        room = GameRooms.objects.get(id=self.match_id)
+        self.assertEqual((room.status, room.winner_id, room.dream_id), ("ended", self.alice.id, self.dream.id))
+        self.assertIsNotNone(room.ended_at)
+
+    def test_failed_unlock_write_leaves_match_playable(self):
+        with mock.patch.object(UserDreams.objects, "get_or_create", side_effect=DatabaseError("down")):
+            with self.assertRaises(DatabaseError):
+                self.purchase()
+        self.assertEqual((self.state.status, self.state.winner_id), ("active", None))
+        self.assertEqual(self.purchase().status_code, 200)
+        self.assertTrue(UserDreams.objects.filter(user=self.alice, dream=self.dream).exists())
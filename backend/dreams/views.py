@@ -1,33 +1,17 @@
+import uuid
+
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
+from django.core.exceptions import ValidationError
 from django.utils import timezone
-from django.db import transaction
 
 from .models import Dreams, UserDreams
-from game.models import GameRooms, GamePlayers
+from game.engine import store
+from game.actions import ActionError
+from game.idempotency import idempotent
 from accounts.models import Users
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-
-
-def _broadcast(match_id: str, payload: dict):
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"match_{match_id}", {"type": "game_event", "payload": payload}
-    )
-
-
-def _state_snapshot(room: GameRooms):
-    from game.models import GamePlayers  # local import to avoid cycles
-    players = GamePlayers.objects.filter(room=room).values(
-        'user_id', 'seat', 'current_points', 'savings', 'liabilities', 'assets', 'tokens'
-    )
-    return {
-        "matchId": str(room.id),
-        "currentTurn": room.current_turn,
-        "players": list(players),
-    }
+from . import actions
 
 
 @api_view(["GET"])  # GET /dreams
@@ -40,6 +24,7 @@ def list_dreams(request):
 
 
 @api_view(["POST"])  # POST /matches/<matchId>/dreams/purchase
+@idempotent
 def purchase_dream(request, match_id: str):
     data = request.data or {}
     user_id = data.get("userId")
@@ -47,66 +32,33 @@ def purchase_dream(request, match_id: str):
     if not user_id or not dream_id:
         return Response({"detail": "userId and dreamId required"}, status=400)
 
-    try:
-        room = GameRooms.objects.get(id=match_id)
-    except GameRooms.DoesNotExist:
+    state = store.get(match_id)
+    if state is None:
         return Response({"detail": "match not found"}, status=404)
-    try:
-        player = GamePlayers.objects.select_for_update().get(room=room, user_id=user_id)
-    except GamePlayers.DoesNotExist:
-        return Response({"detail": "player not found"}, status=404)
     try:
         dream = Dreams.objects.get(id=dream_id)
     except Dreams.DoesNotExist:
         return Response({"detail": "dream not found"}, status=404)
 
-    with transaction.atomic():
-        # Win condition checks (as per docs)
-        has_two_assets = len(player.assets or []) >= 2
-        liabilities_cleared = (player.liabilities or 0) == 0
-        savings_ok = (player.savings or 0) >= 500
-
-        if not has_two_assets:
-            return Response({"detail": "must have purchased 2 assets"}, status=400)
-        if not liabilities_cleared:
-            return Response({"detail": "liabilities must be cleared"}, status=400)
-        if not savings_ok:
-            return Response({"detail": "savings must be at least 500"}, status=400)
-
-        # Enforce dream purchase using on-hand points (asset profits), not from savings
-        on_hand = int(player.current_points or 0)
-        if on_hand < int(dream.cost or 0):
-            return Response({"detail": "insufficient on-hand points for dream"}, status=400)
-
-        # Deduct and record unlock
-        player.current_points = on_hand - int(dream.cost)
-        player.save(update_fields=["current_points"])
-
+    try:
+        actions.check_purchase(state, user_id, dream)
+    except ActionError as e:
+        return Response(e.body(), status=e.status)
+    try:
         user = Users.objects.get(id=user_id)
-        UserDreams.objects.get_or_create(user=user, dream=dream, defaults={"unlocked_at": timezone.now()})
-
-    # Broadcast dream purchase + game_end
-    payload_purchase = {
-        "type": "dream_purchase",
-        "matchId": match_id,
-        "data": {"userId": user_id, "dreamId": str(dream.id), "cost": int(dream.cost)},
-        "timestamp": int(timezone.now().timestamp() * 1000),
-    }
-    _broadcast(match_id, payload_purchase)
-
-    payload_end = {
-        "type": "game_end",
-        "matchId": match_id,
-        "data": {"winnerId": user_id, "dreamId": str(dream.id)},
-        "timestamp": int(timezone.now().timestamp() * 1000),
-    }
-    _broadcast(match_id, payload_end)
-
-    # consolidated state update snapshot
-    snapshot = _state_snapshot(room)
-    _broadcast(match_id, {"type": "state_update", "matchId": match_id, "data": snapshot, "timestamp": payload_purchase["timestamp"]})
-
-    return Response({"ok": True, "winnerId": user_id, "dreamId": str(dream.id)})
+    except (Users.DoesNotExist, ValidationError):
+        return Response({"detail": "user not found"}, status=404)
+
+    unlock, created = UserDreams.objects.get_or_create(user=user, dream=dream, defaults={"id": uuid.uuid4(), "unlocked_at": timezone.now()})
+    try:
+        body, out = actions.purchase(state, user_id, dream)
+    except ActionError as e:
+        # Lost a race for the win after the unlock was written
+        if created:
+            unlock.delete()
+        return Response(e.body(), status=e.status)
+    out.send()
+    return Response(body)
 
 
 # --- Admin Dreams Management ---
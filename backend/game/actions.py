@@ -0,0 +1,377 @@
+"""Match actions applied to in-memory state.
+
+Each action validates and mutates a ``MatchState`` and returns the response
+body together with the (unsent) broadcast for that action. The sync DRF views
+and the async views both call these, and only differ in how they load state
+and send the broadcast.
+"""
+import random
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.utils import timezone
+
+from cards.catalog import catalog
+from cards.decks import shuffled
+from . import board
+from .board import ASSET_PROFIT
+from .broadcast import MatchBroadcast
+from .engine import store, MatchState, PlayerState
+from .gamelog import game_log
+from .models import GameRooms, GamePlayers
+
+
+class ActionError(Exception):
+    def __init__(self, detail: str, status: int = 400, retryable: bool = False):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+        self.retryable = retryable
+
+    def body(self) -> dict:
+        if self.retryable:
+            return {"detail": self.detail, "retryable": True}
+        return {"detail": self.detail}
+
+
+def player_of(state: MatchState, user_id) -> PlayerState:
+    player = state.player_for_user(user_id)
+    if player is None:
+        raise ActionError("player not found", 404)
+    return player
+
+
+def record(state: MatchState, user_id, action: str, payload: dict, delta: dict | None = None):
+    """Queue an audit entry for ``action``; ``turn`` is the state version it produced.
+
+    Call while holding ``state.lock`` so the version matches the delta.
+    """
+    if delta:
+        payload = dict(payload, delta=delta)
+    game_log.append(state.id, state.version, user_id, action, payload)
+
+
+def require_active(state: MatchState):
+    """Reject play on a match that has not started or is over."""
+    if state.status != "active":
+        raise ActionError("match is not active", 409)
+
+
+def _require_turn(state: MatchState, player: PlayerState):
+    if player.seat != state.current_turn:
+        raise ActionError("not your turn", 403)
+
+
+# --- Turn claims (optimistic concurrency on GameRooms.version) ---
+
+def _begin_claim(state: MatchState):
+    with state.lock:
+        state.claims_pending += 1
+
+
+def _end_claim(state: MatchState, expected: int, updated: int):
+    with state.lock:
+        if updated:
+            # Stays pending until ``claimed`` applies it in memory
+            state.row_version = expected + 1
+            return
+        state.claims_pending -= 1
+        # Lost the race. If nothing local moved the version, another worker did
+        # and our cached copy is stale; reload it on the retry.
+        stale = state.row_version == expected and not state.claims_pending
+    if stale:
+        store.discard(state.id)
+    raise ActionError("match changed, retry", 409, retryable=True)
+
+
+@contextmanager
+def claimed(state: MatchState):
+    """Hold ``state.lock`` while applying a won claim; the claim is settled either way."""
+    try:
+        with state.lock:
+            try:
+                yield
+            finally:
+                state.claims_pending -= 1
+    except BaseException:
+        # The row already carries the claimed turn; write the in-memory one back
+        with state.lock:
+            state.room_dirty = True
+        store.mark_dirty(state)
+        raise
+
+
+def claim_turn(state: MatchState, expected: int, next_turn: int):
+    """Compare-and-swap a turn change onto the room version we validated against.
+
+    Card plays and dream purchases claim with the current turn as ``next_turn``.
+
+    Call without ``state.lock``; the action re-checks under ``claimed``.
+    """
+    _begin_claim(state)
+    updated = GameRooms.objects.filter(id=state.id, version=expected).update(current_turn=next_turn, version=expected + 1)
+    _end_claim(state, expected, updated)
+
+
+async def aclaim_turn(state: MatchState, expected: int, next_turn: int):
+    _begin_claim(state)
+    updated = await GameRooms.objects.filter(id=state.id, version=expected).aupdate(current_turn=next_turn, version=expected + 1)
+    _end_claim(state, expected, updated)
+
+
+def _next_turn(state: MatchState) -> int:
+    return (state.current_turn + 1) % (state.player_count or 1)
+
+
+def check_start(state: MatchState):
+    """Validate a start; returns the ``(version, next_turn)`` to claim."""
+    return state.row_version, 0
+
+
+def check_move(state: MatchState, user_id, token_index: int):
+    with state.lock:
+        require_active(state)
+        player = player_of(state, user_id)
+        _require_turn(state, player)
+        if token_index < 0 or token_index >= len(player.tokens):
+            raise ActionError("invalid token index")
+        return state.row_version, _next_turn(state)
+
+
+def check_play(state: MatchState, user_id):
+    """Validate a card play or dream purchase; returns the ``(version, turn)`` to claim.
+
+    These do not pass the turn, but they still claim the room version so that a
+    stale copy of the match cannot accept them.
+    """
+    with state.lock:
+        require_active(state)
+        player_of(state, user_id)
+        return state.row_version, state.current_turn
+
+
+def check_select_asset(state: MatchState, user_id):
+    with state.lock:
+        require_active(state)
+        player_of(state, user_id)
+        return state.row_version, _next_turn(state)
+
+
+# --- Actions ---
+
+def start(state: MatchState, claim: bool = True, deck: list[str] | None = None):
+    if deck is None:
+        deck = shuffled(catalog.current())
+    if claim:
+        claim_turn(state, *check_start(state))
+    with claimed(state):
+        state.status = "active"
+        state.started_at = timezone.now()
+        state.current_turn = 0
+        state.turn_started = time.monotonic()
+        state.event_deck, state.deck_pos = deck, 0
+        state.room_dirty = True
+        delta = state.publish()
+        # A state loaded after the joins publishes only what changed, so the
+        # log gets the full players for replay
+        record(state, None, "start", {}, state.baseline())
+    store.mark_dirty(state)
+    # Broadcast state_update and turn_change
+    out = MatchBroadcast(state.id)
+    if delta:
+        out.add("state_update", delta)
+    out.add("turn_change", {"nextPlayerSeat": 0})
+    return {"ok": True}, out
+
+
+def roll(state: MatchState, user_id):
+    # Validate turn by user seat
+    with state.lock:
+        require_active(state)
+        player = player_of(state, user_id)
+        _require_turn(state, player)
+
+    d1 = random.randint(1, 6)
+    d2 = random.randint(1, 6)
+    with state.lock:
+        record(state, player.user_id, "roll", {"dice": [d1, d2]})
+    # Broadcast dice_result
+    out = MatchBroadcast(state.id)
+    out.add("dice_result", {"die1": d1, "die2": d2, "sum": d1 + d2})
+    return {"dice": [d1, d2], "sum": d1 + d2}, out
+
+
+def move(state: MatchState, user_id, token_index: int, steps: int, claim: bool = True):
+    """Move a token. With ``claim=False`` the caller has already claimed the turn."""
+    if claim:
+        # The CAS round trip runs outside the lock; the checks below run again under it
+        claim_turn(state, *check_move(state, user_id, token_index))
+    with claimed(state):
+        require_active(state)
+        player = player_of(state, user_id)
+        _require_turn(state, player)
+
+        tokens = player.tokens
+        if token_index < 0 or token_index >= len(tokens):
+            raise ActionError("invalid token index")
+
+        # Yellow-strip priority: moving past a reachable yellow spot costs a penalty
+        skipped_yellow = board.skips_yellow(tokens, token_index, steps)
+        target_pos = board.target_of(tokens[token_index], steps)
+
+        # Apply move
+        tokens[token_index] = target_pos
+
+        # Apply -20 penalty to liabilities if skipped yellow when a yellow move existed
+        if skipped_yellow:
+            player.liabilities += board.SKIP_PENALTY
+
+        # Resolve asset returns: for any owned asset whose return window contains the landing tile, up to 5 returns
+        # Expect player.assets to be list of objects {assetId, purchaseSpot, returnsCollected}
+        new_assets = []
+        returns_events = []
+        for a in player.assets:
+            if not isinstance(a, dict):
+                # legacy: store as id only; keep as-is
+                new_assets.append(a)
+                continue
+            asset_id = a.get("assetId")
+            purchase_spot = int(a.get("purchaseSpot", 0))
+            collected = int(a.get("returnsCollected", 0))
+            if collected < board.MAX_RETURNS and board.is_return_tile(purchase_spot, target_pos):
+                amount = ASSET_PROFIT.get(asset_id, 0)
+                player.current_points += amount
+                collected += 1
+                returns_events.append({"assetId": asset_id, "amount": amount, "returnsCollected": collected})
+            new_assets.append({"assetId": asset_id, "purchaseSpot": purchase_spot, "returnsCollected": collected})
+
+        player.assets = new_assets
+        state.mark_player(player)
+
+        # Advance turn
+        next_turn = state.advance_turn()
+        delta = state.publish()
+        record(state, player.user_id, "move", {"tokenIndex": token_index, "steps": steps, "position": target_pos, "skippedYellow": skipped_yellow, "returns": returns_events}, delta)
+    store.mark_dirty(state)
+
+    # Broadcast move_event, any asset_return, state_update and turn_change
+    out = MatchBroadcast(state.id)
+    out.add("move_event", {"userId": user_id, "tokenIndex": token_index, "steps": steps, "position": target_pos})
+    for ev in returns_events:
+        out.add("asset_return", ev)
+    if delta:
+        out.add("state_update", delta)
+    out.add("turn_change", {"nextPlayerSeat": next_turn})
+    body = {"ok": True, "position": target_pos, "skippedYellow": skipped_yellow, "returns": returns_events, "currentTurn": next_turn}
+    return body, out
+
+
+def select_asset(state: MatchState, user_id, asset_id, claim: bool = True):
+    if claim:
+        claim_turn(state, *check_select_asset(state, user_id))
+    with claimed(state):
+        require_active(state)
+        player = player_of(state, user_id)
+
+        purchase_spot = board.furthest_token(player.tokens)
+        assets = player.assets
+        # Store structured asset instance with purchaseSpot and returnsCollected
+        if asset_id and all((getattr(a, "get", None) and a.get("assetId") != asset_id) or (not isinstance(a, dict) and a != asset_id) for a in assets):
+            assets.append({"assetId": asset_id, "purchaseSpot": purchase_spot, "returnsCollected": 0})
+        state.mark_player(player)
+
+        # Buying an asset counts as playing your turn -> advance turn
+        next_turn = state.advance_turn()
+        delta = state.publish()
+        record(state, player.user_id, "asset_purchase", {"assetId": asset_id, "purchaseSpot": purchase_spot}, delta)
+        assets = list(player.assets)
+    store.mark_dirty(state)
+
+    # Broadcast asset_purchase, state_update, and turn_change
+    out = MatchBroadcast(state.id)
+    out.add("asset_purchase", {"userId": user_id, "assetId": asset_id, "purchaseSpot": purchase_spot})
+    if delta:
+        out.add("state_update", delta)
+    out.add("turn_change", {"nextPlayerSeat": next_turn})
+    return {"ok": True, "assets": assets, "currentTurn": next_turn}, out
+
+
+def skip_turn(state: MatchState):
+    """Pass the turn of a seat whose deadline expired (see ``game.timers``)."""
+    with state.lock:
+        require_active(state)
+        seat = state.current_turn
+        expected, next_turn = state.row_version, _next_turn(state)
+    claim_turn(state, expected, next_turn)
+    with claimed(state):
+        require_active(state)
+        if state.current_turn != seat:
+            raise ActionError("turn already moved", 409, retryable=True)
+        player = state.player_at_seat(seat)
+        next_turn = state.advance_turn()
+        delta = state.publish()
+        record(state, player.user_id if player else None, "turn_timeout", {"seat": seat}, delta)
+    store.mark_dirty(state)
+
+    out = MatchBroadcast(state.id)
+    if delta:
+        out.add("state_update", delta)
+    out.add("turn_change", {"nextPlayerSeat": next_turn})
+    return {"ok": True, "currentTurn": next_turn}, out
+
+
+def abandon(state: MatchState):
+    """Close a match nobody is playing any more; it ends without a winner."""
+    with state.lock:
+        state.status = "abandoned"
+        state.ended_at = timezone.now()
+        state.room_dirty = True
+        delta = state.publish()
+        record(state, None, "abandon", {"idleTurns": state.idle_turns}, delta)
+    store.mark_dirty(state)
+
+    out = MatchBroadcast(state.id)
+    if delta:
+        out.add("state_update", delta)
+    out.add("game_end", {"winnerId": None, "dreamId": None})
+    return {"ok": True}, out
+
+
+def new_room(player_count: int) -> GameRooms:
+    return GameRooms(
+        id=uuid.uuid4(),
+        status="waiting",
+        created_at=timezone.now(),
+        player_count=player_count,
+    )
+
+
+def new_player(room_id, user, seat: int, is_ai: bool) -> GamePlayers:
+    return GamePlayers(
+        id=uuid.uuid4(),
+        room_id=room_id,
+        user=user,
+        seat=seat,
+        starting_points=1200,
+        current_points=1200,
+        savings=0,
+        liabilities=0,
+        assets=[],
+        spending_cards=[],
+        savings_cards=[],
+        tokens=[0, 0, 0, 0],
+        color=None,
+        is_cpu=is_ai,
+        ready=True,
+    )
+
+
+def room_created(room: GameRooms) -> MatchState:
+    # Seed the cache so the first turn never has to reload the room
+    return store.put(MatchState(id=room.id, status=room.status, player_count=room.player_count, current_turn=0, row_version=room.version))
+
+
+def player_joined(state: MatchState, player: GamePlayers):
+    with state.lock:
+        state.add_player(PlayerState.from_model(player))
@@ -0,0 +1,102 @@
+"""Per-match command actors for the async views.
+
+Every match with commands in flight is owned by one actor: an asyncio task
+draining a bounded mailbox on the worker's event loop. Commands for a match
+run strictly one after another, so the turn check, the awaited turn claim and
+the in-memory action can no longer interleave with another request for the
+same match. Different matches have different actors and run concurrently. An
+actor whose mailbox stays empty for ``MATCH_ACTOR_IDLE`` seconds exits, so only
+matches with recent commands hold one.
+"""
+import asyncio
+from functools import wraps
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from .actions import ActionError
+
+MAILBOX_SIZE = getattr(settings, "MATCH_ACTOR_MAILBOX", 64)  # queued commands per match
+IDLE_TIMEOUT = getattr(settings, "MATCH_ACTOR_IDLE", 30.0)  # seconds before an idle actor exits
+
+
+class MatchActor:
+    __slots__ = ("match_id", "loop", "mailbox", "task")
+
+    def __init__(self, match_id: str, loop, size: int):
+        self.match_id = match_id
+        self.loop = loop
+        self.mailbox: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self.task = None
+
+
+class MatchActors:
+    def __init__(self, mailbox_size=MAILBOX_SIZE, idle_timeout=IDLE_TIMEOUT):
+        self.mailbox_size = mailbox_size
+        self.idle_timeout = idle_timeout
+        self._actors: dict[str, MatchActor] = {}
+
+    def __len__(self):
+        return len(self._actors)
+
+    async def call(self, match_id, command, *args, **kwargs):
+        """Run ``await command(*args, **kwargs)`` in ``match_id``'s actor."""
+        match_id = str(match_id)
+        loop = asyncio.get_running_loop()
+        actor = self._actors.get(match_id)
+        if actor is None or actor.loop is not loop or actor.task.done():
+            # No actor yet, or one left behind by another loop
+            actor = self._actors[match_id] = MatchActor(match_id, loop, self.mailbox_size)
+            actor.task = loop.create_task(self._run(actor))
+        done = loop.create_future()
+        try:
+            actor.mailbox.put_nowait((done, command, args, kwargs))
+        except asyncio.QueueFull:
+            raise ActionError("match busy, retry", 503, retryable=True)
+        return await done
+
+    async def _run(self, actor: MatchActor):
+        try:
+            while True:
+                try:
+                    done, command, args, kwargs = await asyncio.wait_for(actor.mailbox.get(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    # Nothing can be enqueued between this check and the
+                    # removal below, as neither awaits
+                    if actor.mailbox.empty():
+                        return
+                    continue
+                if done.cancelled():
+                    # The request went away before its turn came
+                    continue
+                try:
+                    result = await command(*args, **kwargs)
+                except Exception as e:
+                    if not done.cancelled():
+                        done.set_exception(e)
+                else:
+                    if not done.cancelled():
+                        done.set_result(result)
+        finally:
+            if self._actors.get(actor.match_id) is actor:
+                del self._actors[actor.match_id]
+
+    def clear(self):
+        for actor in self._actors.values():
+            if actor.task is not None and not actor.loop.is_closed():
+                actor.loop.call_soon_threadsafe(actor.task.cancel)
+        self._actors.clear()
+
+
+actors = MatchActors()
+
+
+def serialized(view):
+    """Run an async match view inside its match's actor."""
+    @wraps(view)
+    async def wrapper(request, match_id, *args, **kwargs):
+        try:
+            return await actors.call(match_id, view, request, match_id, *args, **kwargs)
+        except ActionError as e:
+            return JsonResponse(e.body(), status=e.status)
+    return wrapper
@@ -0,0 +1,217 @@
+"""Match-affinity routing in front of several ASGI worker processes.
+
+``MatchRouter`` is a TCP front end (``manage.py run_match_router``). It reads
+the head of each incoming HTTP request, takes the match id from
+``/matches/<id>/...`` (or ``/async/matches/<id>/...``), and forwards the
+connection to the worker that owns that id on a consistent-hash ring. Every
+request and websocket for one match therefore reaches the same process, and
+its ``MatchStore`` cache stays warm. Requests without a match id go to the
+workers in turn.
+
+Websocket upgrades are tunnelled for the life of the socket. Other requests
+are sent upstream with ``Connection: close`` so that every request is routed
+on its own.
+
+Workers are health-checked every ``MATCH_ROUTER_HEALTH_INTERVAL`` seconds. A
+worker that stops accepting connections leaves the ring and one that comes
+back rejoins it. Only the matches hashed to that worker move, and their new
+owner reloads them from the database (and replays any unflushed log).
+
+Every forwarded request carries the ring's epoch in ``X-Match-Ring-Epoch``,
+which changes whenever a worker leaves or joins. A worker that sees a new
+epoch rechecks each cached match against its room row before serving it
+again (``MatchStore.observe_ring``), because a match it held before the
+change may have been played on another worker in the meantime.
+"""
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import re
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+REPLICAS = 160  # virtual nodes per worker
+HEALTH_INTERVAL = getattr(settings, "MATCH_ROUTER_HEALTH_INTERVAL", 1.0)  # seconds
+CONNECT_TIMEOUT = 1.0
+MAX_HEAD = 64 * 1024
+
+EPOCH_HEADER = "X-Match-Ring-Epoch"
+
+MATCH_PATH = re.compile(rb"^(?:/async)?/matches/([0-9a-fA-F-]{32,36})(?:[/?]|$)")
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, nodes=(), replicas=REPLICAS):
+        self.replicas = replicas
+        self.nodes: set = set()
+        self._points: list[int] = []
+        self._owners: list[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        self._rebuild()
+
+    def remove(self, node: str):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self._rebuild()
+
+    def _rebuild(self):
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(self.replicas))
+        self._points = [p for p, _ in points]
+        self._owners = [n for _, n in points]
+
+    def owner(self, key: str) -> str | None:
+        if not self._points:
+            return None
+        i = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[i]
+
+
+def match_id_of(path: bytes) -> str | None:
+    m = MATCH_PATH.match(path)
+    return m.group(1).decode().lower() if m else None
+
+
+def _upstream_head(head: bytes, epoch: int, close: bool) -> bytes:
+    # Stamp the ring epoch (replacing any the client sent). Unless the request
+    # is an upgrade, drop hop-by-hop connection headers and ask upstream to
+    # close when done.
+    dropped = {EPOCH_HEADER.lower().encode()}
+    if close:
+        dropped |= {b"connection", b"keep-alive"}
+    lines = head.rstrip(b"\r\n").split(b"\r\n")
+    kept = [lines[0]] + [line for line in lines[1:] if line.split(b":", 1)[0].strip().lower() not in dropped]
+    kept.append(b"%s: %d" % (EPOCH_HEADER.encode(), epoch))
+    if close:
+        kept.append(b"Connection: close")
+    return b"\r\n".join(kept) + b"\r\n\r\n"
+
+
+async def _pipe(reader, writer):
+    try:
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+
+
+class MatchRouter:
+    """Routes HTTP and websocket connections to workers (``host:port``)."""
+
+    def __init__(self, workers, health_interval=HEALTH_INTERVAL):
+        self.workers = list(workers)
+        self.health_interval = health_interval
+        self.ring = HashRing(self.workers)
+        self.routed = dict.fromkeys(self.workers, 0)
+        self.epoch = 0  # bumped on every ring change
+        self._turns = itertools.count()
+        self._watcher = None
+
+    def add_worker(self, worker: str):
+        if worker not in self.workers:
+            self.workers.append(worker)
+            self.routed.setdefault(worker, 0)
+        if worker not in self.ring.nodes:
+            logger.info("worker %s joined; rebalancing", worker)
+            self.ring.add(worker)
+            self.epoch += 1
+
+    def remove_worker(self, worker: str, forget: bool = False):
+        if worker in self.ring.nodes:
+            logger.warning("worker %s left; rebalancing", worker)
+            self.ring.remove(worker)
+            self.epoch += 1
+        if forget and worker in self.workers:
+            self.workers.remove(worker)
+
+    def route(self, path: bytes) -> str | None:
+        match_id = match_id_of(path)
+        if match_id is not None:
+            return self.ring.owner(match_id)
+        live = sorted(self.ring.nodes)
+        return live[next(self._turns) % len(live)] if live else None
+
+    async def serve(self, host: str, port: int):
+        self._watcher = asyncio.ensure_future(self._watch())
+        return await asyncio.start_server(self._handle, host, port, limit=MAX_HEAD)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for worker in list(self.workers):
+                if await self._alive(worker):
+                    self.add_worker(worker)
+                else:
+                    self.remove_worker(worker)
+
+    async def _alive(self, worker: str) -> bool:
+        try:
+            _, writer = await asyncio.wait_for(_open(worker), CONNECT_TIMEOUT)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
+
+    async def _handle(self, reader, writer):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        request_line = head.split(b"\r\n", 1)[0].split(b" ")
+        path = request_line[1] if len(request_line) > 1 else b"/"
+        upgrade = b"\r\nupgrade:" in head.lower()
+
+        upstream = None
+        # A worker that refuses the connection leaves the ring; try the next owner
+        for _ in range(len(self.workers) or 1):
+            worker = self.route(path)
+            if worker is None:
+                break
+            try:
+                upstream = await asyncio.wait_for(_open(worker), CONNECT_TIMEOUT)
+                break
+            except (OSError, asyncio.TimeoutError):
+                self.remove_worker(worker)
+        if upstream is None:
+            writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            writer.close()
+            return
+
+        self.routed[worker] += 1
+        up_reader, up_writer = upstream
+        # Stamped after routing, so a worker dropped above already counts
+        up_writer.write(_upstream_head(head, self.epoch, close=not upgrade))
+        forward = asyncio.ensure_future(_pipe(reader, up_writer))
+        try:
+            # The exchange is over once the worker closes its side
+            await _pipe(up_reader, writer)
+        finally:
+            forward.cancel()
+            up_writer.close()
+            writer.close()
+
+    def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+
+
+async def _open(worker: str):
+    host, port = worker.rsplit(":", 1)
+    return await asyncio.open_connection(host, int(port))
@@ -0,0 +1,97 @@
+"""Moves finished matches out of the live tables.
+
+A match ends when a dream purchase stamps ``ended_at`` and ``winner`` on its
+room, or when turn timers close it as abandoned. Once it is older than the
+cutoff, ``archive_ended`` writes it as one
+``ArchivedMatches`` row, with its players and action log packed into JSON.
+The room, player, log and snapshot rows are then deleted in the same
+transaction. Work is done ``chunk_size`` matches per transaction, so the live
+tables stay small without long-held locks.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .engine import store
+from .models import ArchivedMatches, GameLogs, GamePlayers, GameRooms, MatchSnapshots
+
+ARCHIVE_CHUNK_SIZE = 500
+ENDED = ("ended", "abandoned")
+
+
+def _player(p: GamePlayers) -> dict:
+    return {
+        "id": str(p.id),
+        "userId": str(p.user_id) if p.user_id else None,
+        "seat": p.seat,
+        "isAi": bool(p.is_cpu),
+        "color": p.color,
+        "startingPoints": p.starting_points,
+        "currentPoints": p.current_points,
+        "savings": p.savings,
+        "liabilities": p.liabilities,
+        "tokens": p.tokens,
+        "assets": p.assets,
+        "spendingCards": p.spending_cards,
+        "savingsCards": p.savings_cards,
+    }
+
+
+def _log_entry(log: GameLogs) -> dict:
+    return {
+        "turn": log.turn,
+        "userId": str(log.user_id) if log.user_id else None,
+        "action": log.action,
+        "payload": log.payload,
+        "timestamp": log.timestamp.isoformat() if log.timestamp else None,
+    }
+
+
+def archive_chunk(ids) -> int:
+    """Archive the ended rooms in ``ids`` in one transaction."""
+    now = timezone.now()
+    with transaction.atomic():
+        rooms = list(GameRooms.objects.filter(id__in=ids, status__in=ENDED))
+        ids = [room.id for room in rooms]
+        players, logs = {}, {}
+        for p in GamePlayers.objects.filter(room_id__in=ids).order_by("seat"):
+            players.setdefault(p.room_id, []).append(_player(p))
+        for log in GameLogs.objects.filter(room_id__in=ids).order_by("turn", "timestamp"):
+            logs.setdefault(log.room_id, []).append(_log_entry(log))
+        ArchivedMatches.objects.bulk_create([
+            ArchivedMatches(
+                id=room.id,
+                status=room.status,
+                dream_id=room.dream_id,
+                winner_id=room.winner_id,
+                player_count=room.player_count,
+                created_at=room.created_at,
+                started_at=room.started_at,
+                ended_at=room.ended_at,
+                state_version=room.state_version,
+                players=players.get(room.id, []),
+                log=logs.get(room.id, []),
+                archived_at=now,
+            )
+            for room in rooms
+        ])
+        # Children first: they reference the room without cascading
+        GameLogs.objects.filter(room_id__in=ids).delete()
+        MatchSnapshots.objects.filter(room_id__in=ids).delete()
+        GamePlayers.objects.filter(room_id__in=ids).delete()
+        GameRooms.objects.filter(id__in=ids).delete()
+    for room_id in ids:
+        store.discard(room_id)
+    return len(ids)
+
+
+def archive_ended(cutoff, chunk_size=ARCHIVE_CHUNK_SIZE) -> int:
+    """Archive every match that ended before ``cutoff``; returns how many."""
+    total = 0
+    while True:
+        ids = list(
+            GameRooms.objects.filter(status__in=ENDED, ended_at__lt=cutoff)
+            .order_by("ended_at").values_list("id", flat=True)[:chunk_size]
+        )
+        if not ids:
+            return total
+        total += archive_chunk(ids)
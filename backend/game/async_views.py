@@ -0,0 +1,310 @@
+"""Async-native match API.
+
+Same contract as the sync DRF views (``game``, ``cards`` and ``dreams``), but
+state misses use the async ORM and broadcasts await the channel layer
+directly, so under ASGI no request needs a thread hop. Mounted under
+``/async/``.
+"""
+import json
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.http import HttpResponseNotModified, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST, require_http_methods
+from django.utils import timezone
+
+from accounts.models import Users
+from cards import actions as card_actions
+from cards.catalog import catalog
+from cards.decks import shuffled
+from dreams import actions as dream_actions
+from dreams.models import Dreams, UserDreams
+from . import actions
+from .actions import ActionError
+from .actors import serialized
+from .cpu import cpu_players
+from .idempotency import idempotent
+from .matchmaking import matchmaker
+from .engine import store
+from .timers import turn_timers
+
+
+def _data(request) -> dict:
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _detail(detail: str, status: int) -> JsonResponse:
+    return JsonResponse({"detail": detail}, status=status)
+
+
+async def _run(action, state, *args, **kwargs) -> JsonResponse:
+    try:
+        body, out = action(state, *args, **kwargs)
+    except ActionError as e:
+        return JsonResponse(e.body(), status=e.status)
+    await out.asend()
+    cpu_players.schedule(state)
+    turn_timers.watch(state)
+    return JsonResponse(body)
+
+
+async def _claim(state, check) -> JsonResponse | None:
+    # Turn changes are claimed with an awaited compare-and-swap before the
+    # in-memory action runs; the sync views claim inside the action itself.
+    try:
+        await actions.aclaim_turn(state, *check())
+    except ActionError as e:
+        return JsonResponse(e.body(), status=e.status)
+    return None
+
+
+@csrf_exempt
+@require_POST
+async def create_match(request):
+    data = _data(request)
+    room = actions.new_room(int(data.get("numPlayers", 2)))
+    await room.asave(force_insert=True)
+    actions.room_created(room)
+    return JsonResponse({"matchId": str(room.id)}, status=201)
+
+
+@csrf_exempt
+@require_POST
+@idempotent
+@serialized
+async def join_match(request, match_id: str):
+    data = _data(request)
+    is_ai = bool(data.get("isAi", False))
+    state = await store.aget(match_id)
+    if state is None:
+        return _detail("match not found", 404)
+
+    user = None
+    if not is_ai:
+        try:
+            user = await Users.objects.aget(id=data.get("userId"))
+        except Users.DoesNotExist:
+            return _detail("user not found", 404)
+
+    player = actions.new_player(state.id, user, int(data.get("seatPosition", 0)), is_ai)
+    await player.asave(force_insert=True)
+    actions.player_joined(state, player)
+    return JsonResponse({"ok": True})
+
+
+@csrf_exempt
+@require_POST
+@idempotent
+@serialized
+async def start_match(request, match_id: str):
+    state = await store.aget(match_id)
+    if state is None:
+        return _detail("match not found", 404)
+    # Nothing may await between a won claim and the action that applies it
+    deck = shuffled(await catalog.acurrent())
+    conflict = await _claim(state, lambda: actions.check_start(state))
+    if conflict:
+        return conflict
+    return await _run(actions.start, state, claim=False, deck=deck)
+
+
+@require_GET
+async def get_state(request, match_id: str):
+    state = await store.aget(match_id)
+    if state is None:
+        return _detail("match not found", 404)
+    wait_for = request.GET.get("waitFor")
+    if wait_for is not None:
+        try:
+            wait_for = int(wait_for)
+        except ValueError:
+            return _detail("waitFor must be an integer", 400)
+        await state.await_version(wait_for)
+    with state.lock:
+        etag = state.etag
+        if request.headers.get("If-None-Match") == etag:
+            return HttpResponseNotModified(headers={"ETag": etag})
+        payload = state.to_payload()
+    return JsonResponse(payload, headers={"ETag": etag})
+
+
+@csrf_exempt
+@require_POST
+@idempotent
+@serialized
+async def roll_dice(request, match_id: str):
+    data = _data(request)
+    state = await store.aget(match_id)
+    if state is None:
+        return _detail("match not found", 404)
+    return await _run(actions.roll, state, data.get("userId"))
+
+
+@csrf_exempt
+@require_POST
+@idempotent
+@serialized
+async def move_token(request, match_id: str):
+    data = _data(request)
+    state = await store.aget(match_id)
+    if state is None:
+        return _detail("match not found", 404)
+    user_id = data.get("userId")
+    token_index = int(data.get("tokenIndex", 0))
+    steps = int(data.get("steps", 0))
+    conflict = await _claim(state, lambda: actions.check_move(state, user_id, token_index))
+    if conflict:
+        return conflict
+    return await _run(actions.move, state, user_id, token_index, steps, claim=False)
+
+
+@csrf_exempt
+@require_POST
+@idempotent
+@serialized
+async def select_asset(request, match_id: str):
+    data = _data(request)
+    state = await store.aget(match_id)
+    if state is None:
+        return _detail("match not found", 404)
+    user_id = data.get("userId")
+    conflict = await _claim(state, lambda: actions.check_select_asset(state, user_id))
+    if conflict:
+        return conflict
+    return await _run(actions.select_asset, state, user_id, data.get("assetId"), claim=False)
+
+
+# --- Matchmaking ---
+
+@csrf_exempt
+@require_POST
+async def join_queue(request):
+    data = _data(request)
+    try:
+        ticket = matchmaker.join(data.get("userId"), int(data.get("numPlayers", 2)))
+    except ActionError as e:
+        return JsonResponse(e.body(), status=e.status)
+    return JsonResponse(ticket.to_payload(), status=202)
+
+
+@csrf_exempt
+@require_http_methods(["GET", "DELETE"])
+async def queue_ticket(request, ticket_id: str):
+    if request.method == "DELETE":
+        ticket = matchmaker.cancel(ticket_id)
+    else:
+        ticket = matchmaker.get(ticket_id)
+    if ticket is None:
+        return _detail("ticket not found", 404)
+    return JsonResponse(ticket.to_payload())
+
+
+# --- Cards ---
+
+@csrf_exempt
+@require_POST
+@idempotent
+@serialized
+async def draw_playing_card(request, match_id: str):
+    data = _data(request)
+    state = await store.aget(match_id)
+    if state is None:
+        return _detail("match not found", 404)
+    cards = await catalog.acurrent()
+    user_id = data.get("userId")
+    conflict = await _claim(state, lambda: actions.check_play(state, user_id))
+    if conflict:
+        return conflict
+    return await _run(card_actions.draw, state, user_id, cards, claim=False)
+
+
+@csrf_exempt
+@require_POST
+@idempotent
+@serialized
+async def play_savings_card(request, match_id: str):
+    data = _data(request)
+    amount = int(data.get("amount", 0))
+    if amount <= 0:
+        return _detail("invalid amount", 400)
+    state = await store.aget(match_id)
+    if state is None:
+        return _detail("match not found", 404)
+    cards = await catalog.acurrent()
+    card = cards.savings_card(data.get("cardId"))
+    if card is None:
+        return _detail("card not found", 404)
+    user_id = data.get("userId")
+    conflict = await _claim(state, lambda: actions.check_play(state, user_id))
+    if conflict:
+        return conflict
+    return await _run(card_actions.play_savings, state, user_id, card, amount, cards.bonus_rule(card), claim=False)
+
+
+@csrf_exempt
+@require_POST
+@idempotent
+@serialized
+async def play_spending_card(request, match_id: str):
+    data = _data(request)
+    state = await store.aget(match_id)
+    if state is None:
+        return _detail("match not found", 404)
+    card = (await catalog.acurrent()).spending_card(data.get("cardId"))
+    if card is None:
+        return _detail("card not found", 404)
+    user_id = data.get("userId")
+    conflict = await _claim(state, lambda: actions.check_play(state, user_id))
+    if conflict:
+        return conflict
+    return await _run(card_actions.play_spending, state, user_id, card, claim=False)
+
+
+# --- Dreams ---
+
+@csrf_exempt
+@require_POST
+@idempotent
+@serialized
+async def purchase_dream(request, match_id: str):
+    data = _data(request)
+    user_id = data.get("userId")
+    dream_id = data.get("dreamId")
+    if not user_id or not dream_id:
+        return _detail("userId and dreamId required", 400)
+    state = await store.aget(match_id)
+    if state is None:
+        return _detail("match not found", 404)
+    try:
+        dream = await Dreams.objects.aget(id=dream_id)
+    except Dreams.DoesNotExist:
+        return _detail("dream not found", 404)
+
+    try:
+        dream_actions.check_purchase(state, user_id, dream)
+    except ActionError as e:
+        return JsonResponse(e.body(), status=e.status)
+    try:
+        user = await Users.objects.aget(id=user_id)
+    except (Users.DoesNotExist, ValidationError):
+        return _detail("user not found", 404)
+
+    unlock, created = await UserDreams.objects.aget_or_create(user=user, dream=dream, defaults={"id": uuid.uuid4(), "unlocked_at": timezone.now()})
+    conflict = await _claim(state, lambda: dream_actions.check_purchase(state, user_id, dream))
+    if conflict is None:
+        try:
+            body, out = dream_actions.purchase(state, user_id, dream, claim=False)
+        except ActionError as e:
+            conflict = JsonResponse(e.body(), status=e.status)
+    if conflict is not None:
+        # Lost the claim or the win after the unlock was written
+        if created:
+            await unlock.adelete()
+        return conflict
+    await out.asend()
+    return JsonResponse(body)
@@ -0,0 +1,102 @@
+"""Compiled PesaMali board.
+
+Rule data (yellow spots, phases, asset return windows) is expanded once at
+import time into flat lookup tables so move resolution, legal-move checks and
+the CPU player only ever do indexed reads.
+"""
+
+BOARD_SIZE = 80
+SPOTS_PER_PHASE = 10
+MAX_ROLL = 12
+SKIP_PENALTY = 20
+MAX_RETURNS = 5
+
+# Yellow-strip indices based on docs (serpentine symmetric pairs) incl. endpoints used in UI
+YELLOW_STRIPS = frozenset([1, 80, 5, 76, 11, 70, 19, 62, 25, 56, 32, 49, 38, 43, 48, 33, 54, 27, 59, 22, 66, 15, 71, 10, 77, 4])
+
+# Asset profit constants from product spec
+ASSET_PROFIT = {
+    "a1": 320,  # Campus Printing Shop
+    "a2": 220,  # Online Tasking Platform
+    "a3": 170,  # Monetized YouTube Channel
+    "a4": 220,  # Peer to Peer Lending Fund
+    "a5": 240,  # Cryptocurrency Portfolio
+}
+
+# Tables cover every position a token can reach from the last spot in one roll.
+# Tokens are not capped there, so lookups further out fall back to arithmetic.
+TABLE_SIZE = BOARD_SIZE + MAX_ROLL + 1
+LAST = TABLE_SIZE - 1
+
+
+def _phase(idx: int) -> int:
+    # spots 1..10 => phase 1, 11..20 => phase 2, etc.
+    return (max(1, idx) - 1) // SPOTS_PER_PHASE + 1
+
+
+def _compile_return_tiles(purchase_spot: int) -> bytes:
+    # Returns pay out in the phase after purchase, on odd tiles only
+    next_phase = _phase(purchase_spot) + 1
+    return bytes(1 if (_phase(i) == next_phase and i % 2 == 1) else 0 for i in range(TABLE_SIZE))
+
+
+YELLOW = bytes(1 if i in YELLOW_STRIPS else 0 for i in range(TABLE_SIZE))
+PHASE = bytes(_phase(i) for i in range(TABLE_SIZE))
+# RETURN_TILES[purchase_spot][position] -> 1 if landing there pays the asset
+RETURN_TILES = tuple(_compile_return_tiles(s) for s in range(TABLE_SIZE))
+
+
+def _slot(idx: int) -> int:
+    if idx < 0:
+        return 0
+    return idx if idx < LAST else LAST
+
+
+def is_yellow(idx: int) -> bool:
+    return YELLOW[_slot(idx)] == 1
+
+
+def phase_of(idx: int) -> int:
+    if 0 <= idx < TABLE_SIZE:
+        return PHASE[idx]
+    return _phase(idx)
+
+
+def is_return_tile(purchase_spot: int, idx: int) -> bool:
+    if 0 <= purchase_spot < TABLE_SIZE and 0 <= idx < TABLE_SIZE:
+        return RETURN_TILES[purchase_spot][idx] == 1
+    return idx % 2 == 1 and _phase(idx) == _phase(purchase_spot) + 1
+
+
+def target_of(pos: int, steps: int) -> int:
+    target = pos + steps
+    return target if target > 0 else 0
+
+
+def can_land_yellow(tokens, steps: int) -> bool:
+    """Whether any token lands on a yellow spot with this roll."""
+    for pos in tokens:
+        if YELLOW[_slot(pos + steps)]:
+            return True
+    return False
+
+
+def legal_moves(tokens, steps: int) -> tuple:
+    """Token indices that can be moved without the skip penalty.
+
+    Yellow-strip priority: if any token can land on yellow, only those tokens
+    are penalty-free; otherwise every token is.
+    """
+    yellow = tuple(i for i, pos in enumerate(tokens) if YELLOW[_slot(pos + steps)])
+    return yellow if yellow else tuple(range(len(tokens)))
+
+
+def skips_yellow(tokens, token_index: int, steps: int) -> bool:
+    """Whether moving ``token_index`` ignores a yellow landing that was available."""
+    if YELLOW[_slot(tokens[token_index] + steps)]:
+        return False
+    return can_land_yellow(tokens, steps)
+
+
+def furthest_token(tokens) -> int:
+    return max(tokens or [0])
@@ -0,0 +1,62 @@
+import json
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.utils import timezone
+
+
+def group_name(match_id) -> str:
+    return f"match_{match_id}"
+
+
+class MatchBroadcast:
+    """Collects every event one game action produces for a match.
+
+    The events go out as a single ordered frame, so a turn costs one
+    channel-layer fan-out no matter how many events it produced. The JSON text
+    of each event is serialized once here, and the frame carries only that
+    text. The ``wire`` binary message is only built by a consumer whose client
+    negotiated it, once per frame per process (``wire.frame``)::
+
+        with MatchBroadcast(match_id) as out:
+            out.add("move_event", {...})
+            out.add("turn_change", {...})
+    """
+
+    def __init__(self, match_id):
+        self.match_id = str(match_id)
+        self.timestamp = int(timezone.now().timestamp() * 1000)
+        self.events: list[dict] = []
+
+    def add(self, type: str, data):
+        self.events.append({"type": type, "matchId": self.match_id, "data": data, "timestamp": self.timestamp})
+
+    def message(self) -> dict:
+        return {
+            "type": "game_event",
+            "frame": uuid.uuid4().hex,
+            "texts": [json.dumps(e) for e in self.events],
+            "timestamp": self.timestamp,
+        }
+
+    def send(self):
+        if not self.events:
+            return
+        async_to_sync(get_channel_layer().group_send)(group_name(self.match_id), self.message())
+        self.events = []
+
+    async def asend(self):
+        if not self.events:
+            return
+        await get_channel_layer().group_send(group_name(self.match_id), self.message())
+        self.events = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # An action that failed midway publishes nothing
+        if exc_type is None:
+            self.send()
+        return False
@@ -1,28 +1,76 @@
 import json
-import asyncio
+from django.utils import timezone
 from channels.generic.websocket import AsyncWebsocketConsumer
-from .models import GameRooms
+from .affinity import EPOCH_HEADER
+from .engine import store
+from . import wire
 
 class MatchStreamConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.match_id = self.scope['url_route']['kwargs'].get('match_id')
-        try:
-            GameRooms.objects.get(id=self.match_id)
-        except GameRooms.DoesNotExist:
+        epoch = dict(self.scope.get('headers', [])).get(EPOCH_HEADER.lower().encode())
+        if epoch is not None:
+            store.observe_ring(epoch.decode())
+        # Served from the match cache; a miss loads with the async ORM, so a
+        # connect never blocks the event loop
+        state = await store.aget(self.match_id)
+        if state is None:
             await self.close()
             return
         self.group_name = f"match_{self.match_id}"
         await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.accept()
+        # JSON text frames unless the client negotiates the binary protocol
+        self.binary = wire.SUBPROTOCOL in self.scope.get('subprotocols', [])
+        await self.accept(subprotocol=wire.SUBPROTOCOL if self.binary else None)
+        # Clients start from this snapshot instead of a separate GET /state
+        await self.send_state(state)
 
     async def disconnect(self, code):
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
     async def receive(self, text_data=None, bytes_data=None):
-        return
+        try:
+            message = json.loads(text_data or "{}")
+        except ValueError:
+            return
+        # Clients request a full snapshot when a state_update's baseVersion
+        # does not match the version they hold
+        if isinstance(message, dict) and message.get("type") == "resync":
+            await self.send_state()
+
+    async def send_state(self, state=None):
+        if state is None:
+            state = await store.aget(self.match_id)
+        if state is None:
+            return
+        with state.lock:
+            snapshot = state.to_payload()
+        timestamp = int(timezone.now().timestamp() * 1000)
+        if self.binary:
+            await self.send(bytes_data=wire.encode([{"type": "state_sync", "data": snapshot}], timestamp))
+            return
+        await self.send(text_data=json.dumps({
+            "type": "state_sync",
+            "matchId": self.match_id,
+            "data": snapshot,
+            "timestamp": timestamp,
+        }))
 
     # Handler for events sent via channel layer
     async def game_event(self, event):
-        # event['payload'] must be JSON-serializable
-        await self.send(text_data=json.dumps(event['payload']))
+        # One action's events arrive as a single frame with the JSON already
+        # serialized by the sender; JSON clients still receive one message per event
+        if 'texts' in event:
+            if self.binary:
+                await self.send(bytes_data=wire.frame(event))
+                return
+            for text in event['texts']:
+                await self.send(text_data=text)
+            return
+        payloads = event.get('events') or [event['payload']]
+        if self.binary:
+            await self.send(bytes_data=wire.encode(payloads, payloads[0].get("timestamp", 0)))
+            return
+        for payload in payloads:
+            await self.send(text_data=json.dumps(payload))
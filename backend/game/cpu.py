@@ -0,0 +1,200 @@
+"""Server-side player for ``is_cpu`` seats.
+
+Whenever a turn passes to a CPU seat the views call ``cpu_players.schedule``,
+which hands the match to a small thread pool so HTTP workers never wait on an
+AI turn. A turn is decided by an expected-value score over the compiled board
+tables: immediate asset returns and yellow landings, the skip penalty, and one
+roll of lookahead. Each decision stops at its time budget with the best move
+found so far.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import actions, board
+from .actions import ActionError
+from .board import ASSET_PROFIT
+from .engine import store, MatchState, PlayerState
+
+logger = logging.getLogger(__name__)
+
+CPU_WORKERS = getattr(settings, "CPU_PLAYER_WORKERS", 4)
+CPU_MOVE_BUDGET = getattr(settings, "CPU_MOVE_BUDGET", 0.02)  # seconds per decision
+
+YELLOW_VALUE = 40  # a card draw; yellow landings also avoid the skip penalty
+LOOKAHEAD = 0.5  # weight of the next roll's expected value
+# P(sum of two dice == s)
+DICE = tuple((s, (6 - abs(s - 7)) / 36) for s in range(2, board.MAX_ROLL + 1))
+
+
+def _payout(assets, pos: int) -> int:
+    total = 0
+    for a in assets:
+        if isinstance(a, dict) and int(a.get("returnsCollected", 0)) < board.MAX_RETURNS \
+                and board.is_return_tile(int(a.get("purchaseSpot", 0)), pos):
+            total += ASSET_PROFIT.get(a.get("assetId"), 0)
+    return total
+
+
+def _landing_value(assets, pos: int) -> float:
+    return _payout(assets, pos) + (YELLOW_VALUE if board.is_yellow(pos) else 0)
+
+
+def move_value(tokens, assets, token_index: int, steps: int) -> float:
+    target = board.target_of(tokens[token_index], steps)
+    value = _landing_value(assets, target)
+    if board.skips_yellow(tokens, token_index, steps):
+        value -= board.SKIP_PENALTY
+    after = list(tokens)
+    after[token_index] = target
+    value += LOOKAHEAD * sum(p * max(_landing_value(assets, pos + s) for pos in after) for s, p in DICE)
+    return value
+
+
+def choose_move(tokens, assets, steps: int, budget: float = CPU_MOVE_BUDGET) -> int:
+    """Best token to move; penalty-free moves are scored first."""
+    deadline = time.perf_counter() + budget
+    legal = board.legal_moves(tokens, steps)
+    order = list(legal) + [i for i in range(len(tokens)) if i not in legal]
+    best, best_value = order[0], None
+    for i in order:
+        value = move_value(tokens, assets, i, steps)
+        if best_value is None or value > best_value:
+            best, best_value = i, value
+        if time.perf_counter() > deadline:
+            break
+    return best
+
+
+def choose_asset(tokens, assets) -> str | None:
+    """Asset to buy this turn, or None to roll instead.
+
+    Mirrors the purchase rules: none before spot 10, and a second asset only
+    once the first has paid out or every token has left its return window.
+    """
+    owned = [a for a in assets if isinstance(a, dict)]
+    furthest = board.furthest_token(tokens)
+    if len(owned) >= 2 or furthest <= board.SPOTS_PER_PHASE:
+        return None
+    if owned:
+        first = owned[0]
+        window_left = board.phase_of(min(tokens)) > board.phase_of(int(first.get("purchaseSpot", 0))) + 1
+        if int(first.get("returnsCollected", 0)) < board.MAX_RETURNS and not window_left:
+            return None
+    returns = min(board.MAX_RETURNS, sum(board.RETURN_TILES[min(furthest, board.LAST)]))
+    ids = {a.get("assetId") for a in owned}
+    candidates = [(profit * returns, asset_id) for asset_id, profit in ASSET_PROFIT.items() if asset_id not in ids]
+    return max(candidates)[1] if candidates else None
+
+
+class CpuPlayers:
+    """Plays CPU seats off the request path.
+
+    With ``workers=None`` (tests) turns are played inline by ``schedule``,
+    at most one round per call.
+    """
+
+    def __init__(self, workers=CPU_WORKERS, budget=CPU_MOVE_BUDGET):
+        self.workers = workers
+        self.budget = budget
+        self.latencies: deque = deque(maxlen=10000)  # seconds from turn change to CPU move
+        self._executor = None
+        self._pending: set = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, state: MatchState):
+        with state.lock:
+            if self._cpu_seat(state) is None:
+                return
+        with self._lock:
+            if state.id in self._pending:
+                return
+            self._pending.add(state.id)
+            if self.workers is not None and self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cpu-player")
+        if self.workers is None:
+            self._play(state.id, time.perf_counter())
+        else:
+            self._executor.submit(self._play, state.id, time.perf_counter())
+
+    def _cpu_seat(self, state: MatchState) -> PlayerState | None:
+        if state.status != "active":
+            return None
+        player = state.player_at_seat(state.current_turn)
+        return player if player is not None and player.is_cpu else None
+
+    def _play(self, match_id, queued_at: float):
+        retry = self.workers is not None
+        try:
+            state = store.get(match_id)
+            turns = (state.player_count or 1) if state is not None else 0
+            for _ in range(turns):
+                if not self.take_turn(state):
+                    break
+                now = time.perf_counter()
+                self.latencies.append(now - queued_at)
+                queued_at = now
+        except ActionError as e:
+            # A conflicting write (409) is retried; anything else stalls the seat
+            if not e.retryable:
+                retry = False
+                logger.warning("cpu turn in match %s rejected: %s", match_id, e.detail)
+        except Exception:
+            retry = False
+            logger.exception("cpu turn failed for match %s", match_id)
+        finally:
+            with self._lock:
+                self._pending.discard(match_id)
+            if self.workers is not None:
+                close_old_connections()
+        if retry:
+            # Longer CPU chains go back through the pool so other matches get a
+            # turn in between
+            state = store.get(match_id)
+            if state is not None:
+                self.schedule(state)
+
+    def take_turn(self, state: MatchState, stand_in: bool = False) -> bool:
+        """Play one turn for the CPU seat to move; False if it is not a CPU's turn.
+
+        With ``stand_in`` the CPU plays whichever seat is to move, for a human
+        whose turn timed out.
+        """
+        with state.lock:
+            if stand_in:
+                player = state.player_at_seat(state.current_turn) if state.status == "active" else None
+            else:
+                player = self._cpu_seat(state)
+            if player is None:
+                return False
+            handle = player.handle
+            tokens, assets = list(player.tokens), list(player.assets)
+        asset_id = choose_asset(tokens, assets)
+        if asset_id:
+            _, out = actions.select_asset(state, handle, asset_id)
+        else:
+            body, rolled = actions.roll(state, handle)
+            token = choose_move(tokens, assets, body["sum"], self.budget)
+            _, out = actions.move(state, handle, token, body["sum"])
+            # The roll and the move go out as one frame
+            out.events[:0] = rolled.events
+        out.send()
+        return True
+
+    def stats(self) -> dict:
+        samples = sorted(self.latencies)
+        if not samples:
+            return {"turns": 0}
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2)
+
+        return {"turns": len(samples), "p50Ms": pct(0.50), "p95Ms": pct(0.95), "p99Ms": pct(0.99)}
+
+
+cpu_players = CpuPlayers()
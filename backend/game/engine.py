@@ -0,0 +1,606 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, transaction
+
+from .models import GameRooms, GamePlayers, MatchSnapshots
+from . import replay
+
+logger = logging.getLogger(__name__)
+
+# Write-behind tuning; overridable from settings
+FLUSH_INTERVAL = getattr(settings, "MATCH_FLUSH_INTERVAL", 0.5)  # seconds
+FLUSH_BATCH_SIZE = getattr(settings, "MATCH_FLUSH_BATCH_SIZE", 200)  # dirty matches per flush
+MAX_CACHED_MATCHES = getattr(settings, "MATCH_CACHE_SIZE", 10000)
+LONG_POLL_TIMEOUT = getattr(settings, "MATCH_LONG_POLL_TIMEOUT", 25.0)  # seconds a ?waitFor= poll may block
+
+PLAYER_FIELDS = ["tokens", "current_points", "savings", "liabilities", "assets"]
+
+
+class PlayerState:
+    __slots__ = ("id", "user_id", "seat", "is_cpu", "tokens", "current_points", "savings", "liabilities", "assets")
+
+    def __init__(self, id, user_id=None, seat=0, is_cpu=False, tokens=None, current_points=0, savings=0, liabilities=0, assets=None):
+        self.id = id
+        self.user_id = str(user_id) if user_id else None
+        self.seat = seat or 0
+        self.is_cpu = bool(is_cpu)
+        self.tokens = list(tokens) if tokens else [0, 0, 0, 0]
+        self.current_points = current_points or 0
+        self.savings = savings or 0
+        self.liabilities = liabilities or 0
+        self.assets = list(assets or [])
+
+    @classmethod
+    def from_model(cls, p: GamePlayers):
+        return cls(
+            id=p.id,
+            user_id=p.user_id,
+            seat=p.seat,
+            is_cpu=p.is_cpu,
+            tokens=p.tokens,
+            current_points=p.current_points,
+            savings=p.savings,
+            liabilities=p.liabilities,
+            assets=p.assets,
+        )
+
+    def to_payload(self) -> dict:
+        return {
+            "userId": self.user_id,
+            "seat": self.seat,
+            "isAi": self.is_cpu,
+            "tokens": list(self.tokens),
+            "savings": self.savings,
+            "liabilities": self.liabilities,
+            "currentPoints": self.current_points,
+            "assets": list(self.assets),
+        }
+
+    @property
+    def handle(self) -> str:
+        # CPU seats have no user; they act under a per-seat handle instead
+        return self.user_id or f"cpu:{self.seat}"
+
+
+def _resolve(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class MatchState:
+    """Authoritative state of one match. Mutate only while holding ``lock``."""
+
+    def __init__(self, id, status=None, player_count=None, current_turn=0, started_at=None, ended_at=None, players=None, row_version=0, version=0, winner_id=None, dream_id=None, event_deck=None, deck_pos=0):
+        self.id = str(id)
+        self.status = status
+        self.player_count = player_count
+        self.current_turn = current_turn or 0
+        self.started_at = started_at
+        self.ended_at = ended_at
+        # Set once, when a dream purchase ends the match
+        self.winner_id = winner_id
+        self.dream_id = dream_id
+        # Turn deadlines (see ``game.timers``)
+        self.turn_started = time.monotonic()
+        self.idle_turns = 0  # human turns in a row that timed out
+        # Shuffled event card ids and how many have been drawn (see ``cards.decks``)
+        self.event_deck: list[str] = list(event_deck or [])
+        self.deck_pos = deck_pos or 0
+        self.players: list[PlayerState] = sorted(players or [], key=lambda p: p.seat)
+        self.lock = threading.RLock()
+        self.dirty_players: set = set()
+        self.room_dirty = False
+        # GameRooms.version this state was built from or last claimed
+        self.row_version = row_version or 0
+        # Turn claims in flight or won but not yet applied in memory
+        self.claims_pending = 0
+        # state_update versioning: clients apply deltas on top of ``version``
+        self.version = version or 0
+        self.snapshot_version = self.version
+        self._published = self._fields()
+        # Long polls parked until ``version`` advances
+        self.advanced = threading.Condition(self.lock)
+        self._async_waiters: list[asyncio.Future] = []
+
+    @classmethod
+    def from_models(cls, room: GameRooms, players):
+        return cls(
+            id=room.id,
+            status=room.status,
+            player_count=room.player_count,
+            current_turn=room.current_turn,
+            started_at=room.started_at,
+            ended_at=room.ended_at,
+            players=[PlayerState.from_model(p) for p in players],
+            row_version=room.version,
+            version=room.state_version,
+            winner_id=room.winner_id,
+            dream_id=room.dream_id,
+            event_deck=room.event_deck,
+            deck_pos=room.event_deck_pos,
+        )
+
+    def add_player(self, player: PlayerState):
+        self.players.append(player)
+        self.players.sort(key=lambda p: p.seat)
+
+    def player_for_user(self, user_id):
+        if not user_id:
+            return None
+        user_id = str(user_id)
+        for p in self.players:
+            if p.handle == user_id:
+                return p
+        return None
+
+    def player_at_seat(self, seat: int):
+        for p in self.players:
+            if p.seat == seat:
+                return p
+        return None
+
+    def advance_turn(self) -> int:
+        mover = self.player_at_seat(self.current_turn)
+        if mover is not None and not mover.is_cpu:
+            self.idle_turns = 0
+        self.current_turn = (self.current_turn + 1) % (self.player_count or 1)
+        self.turn_started = time.monotonic()
+        self.room_dirty = True
+        return self.current_turn
+
+    def mark_player(self, player: PlayerState):
+        self.dirty_players.add(player.id)
+
+    @property
+    def dirty(self) -> bool:
+        return self.room_dirty or bool(self.dirty_players)
+
+    def to_payload(self) -> dict:
+        return {
+            "matchId": self.id,
+            "version": self.version,
+            "status": self.status,
+            "playerCount": self.player_count,
+            "players": [p.to_payload() for p in self.players],
+            "currentTurn": self.current_turn,
+        }
+
+    @property
+    def etag(self) -> str:
+        # Joins fill seats without publishing a version, so the seat count
+        # keeps lobby states apart
+        return f'"{self.version}.{len(self.players)}"'
+
+    def wait_for(self, version: int, timeout: float = LONG_POLL_TIMEOUT) -> bool:
+        """Block until the state reaches ``version``; False on timeout."""
+        with self.lock:
+            return self.advanced.wait_for(lambda: self.version >= version, timeout)
+
+    async def await_version(self, version: int, timeout: float = LONG_POLL_TIMEOUT) -> bool:
+        """``wait_for`` for async callers; parks a future instead of a thread."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self.lock:
+                if self.version >= version:
+                    return True
+                waiter = loop.create_future()
+                self._async_waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, max(0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                with self.lock:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+                    return self.version >= version
+
+    def _wake(self):
+        # Called with the lock held after the version moves
+        self.advanced.notify_all()
+        for waiter in self._async_waiters:
+            waiter.get_loop().call_soon_threadsafe(_resolve, waiter)
+        self._async_waiters.clear()
+
+    def restore(self, payload: dict, version: int):
+        """Overwrite fields from a replayed state (see ``game.replay``)."""
+        self.status = payload.get("status", self.status)
+        self.current_turn = payload.get("currentTurn", self.current_turn)
+        by_seat = {p["seat"]: p for p in payload.get("players", [])}
+        for p in self.players:
+            fields = by_seat.get(p.seat)
+            if not fields:
+                continue
+            p.tokens = list(fields.get("tokens", p.tokens))
+            p.savings = fields.get("savings", p.savings)
+            p.liabilities = fields.get("liabilities", p.liabilities)
+            p.current_points = fields.get("currentPoints", p.current_points)
+            p.assets = list(fields.get("assets", p.assets))
+            self.dirty_players.add(p.id)
+        self.room_dirty = True
+        self.version = version
+        self._published = self._fields()
+
+    def _fields(self) -> dict:
+        return {
+            "status": self.status,
+            "currentTurn": self.current_turn,
+            "players": {p.seat: p.to_payload() for p in self.players},
+        }
+
+    def baseline(self) -> dict:
+        """Every published field as one delta; replay can start from it alone."""
+        fields = self._fields()
+        return {
+            "status": fields["status"],
+            "currentTurn": fields["currentTurn"],
+            "players": list(fields["players"].values()),
+            "matchId": self.id,
+            "version": self.version,
+        }
+
+    def publish(self) -> dict | None:
+        """Bump the version and return only what changed since the last publish.
+
+        The result is the ``data`` of a ``state_update`` event. A client whose
+        own version differs from ``baseVersion`` has missed an update and
+        should ask for a full resync.
+        """
+        current = self._fields()
+        previous = self._published
+        delta = {}
+        for key in ("status", "currentTurn"):
+            if current[key] != previous[key]:
+                delta[key] = current[key]
+        players = []
+        for seat, fields in current["players"].items():
+            before = previous["players"].get(seat)
+            if before is None:
+                players.append(fields)
+                continue
+            changed = {k: v for k, v in fields.items() if v != before[k]}
+            if changed:
+                changed["seat"] = seat
+                players.append(changed)
+        if players:
+            delta["players"] = players
+        if not delta:
+            return None
+        self._published = current
+        self.version += 1
+        delta["matchId"] = self.id
+        delta["baseVersion"] = self.version - 1
+        delta["version"] = self.version
+        self._wake()
+        return delta
+
+
+class MatchStore:
+    """Process-local cache of active matches.
+
+    Reads are served from memory and rebuilt from the DB on a miss. Mutations
+    are recorded as dirty flags and written back in batches by a background
+    flusher thread, so the request path never waits on the database.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, batch_size=FLUSH_BATCH_SIZE, max_size=MAX_CACHED_MATCHES):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self._matches: "OrderedDict[str, MatchState]" = OrderedDict()
+        self._dirty: "OrderedDict[str, None]" = OrderedDict()
+        self._loading: dict = {}  # match_id -> in-flight aget load
+        # Router ring epoch last seen, and matches cached before it changed
+        self.ring_epoch = None
+        self._unverified: set = set()
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    # --- cache ---
+
+    def _cached(self, match_id) -> tuple[MatchState | None, bool]:
+        # Called with self._lock held; also says whether to recheck the row
+        state = self._matches.get(match_id)
+        if state is None:
+            self.misses += 1
+            return None, False
+        self._matches.move_to_end(match_id)
+        self.hits += 1
+        if match_id in self._unverified:
+            self._unverified.discard(match_id)
+            return state, True
+        return state, False
+
+    def _current(self, state: MatchState, row) -> bool:
+        """Whether ``state`` still matches its room's ``(version, state_version)``."""
+        with state.lock:
+            # A won claim moves the row before the state; we are mid-action
+            if state.claims_pending:
+                return True
+            if row is not None and row[0] == state.row_version and row[1] <= state.version:
+                return True
+        logger.warning("match %s changed in another worker; dropping cached state", state.id)
+        self.discard(state.id)
+        return False
+
+    def observe_ring(self, epoch: str):
+        """Note the router's ring epoch; on a change, recheck every cached match.
+
+        A match moves back to a worker that held it before a rebalance, and
+        meanwhile another worker may have played it. Each cached match is
+        therefore compared with its room row (one query) on its next read.
+        """
+        if epoch == self.ring_epoch:
+            return
+        with self._lock:
+            if epoch != self.ring_epoch:
+                self.ring_epoch = epoch
+                self._unverified = set(self._matches)
+
+    def get(self, match_id) -> MatchState | None:
+        match_id = str(match_id)
+        with self._lock:
+            state, recheck = self._cached(match_id)
+        if recheck:
+            row = GameRooms.objects.filter(id=match_id).values_list("version", "state_version").first()
+            if not self._current(state, row):
+                state = None
+        if state is not None:
+            return state
+        state = self._load(match_id)
+        if state is None:
+            return None
+        return self.put(state)
+
+    async def aget(self, match_id) -> MatchState | None:
+        """``get`` for async callers; a miss is rebuilt with the async ORM.
+
+        Concurrent misses for the same match on one event loop share a single
+        load, so a reconnect storm costs one query rather than one per socket.
+        """
+        match_id = str(match_id)
+        with self._lock:
+            state, recheck = self._cached(match_id)
+        if recheck:
+            row = await GameRooms.objects.filter(id=match_id).values_list("version", "state_version").afirst()
+            if not self._current(state, row):
+                state = None
+        if state is not None:
+            return state
+        loop = asyncio.get_running_loop()
+        load = self._loading.get(match_id)
+        if load is None or load.get_loop() is not loop:
+            load = loop.create_task(self._aload(match_id))
+            self._loading[match_id] = load
+            load.add_done_callback(partial(self._load_done, match_id))
+        state = await asyncio.shield(load)
+        if state is None:
+            return None
+        return self.put(state)
+
+    def _load_done(self, match_id, load):
+        if self._loading.get(match_id) is load:
+            del self._loading[match_id]
+
+    def put(self, state: MatchState) -> MatchState:
+        with self._lock:
+            # Another thread may have loaded the same match first; keep theirs
+            existing = self._matches.get(state.id)
+            if existing is not None:
+                return existing
+            self._matches[state.id] = state
+            self._trim()
+        return state
+
+    def peek(self, match_id) -> MatchState | None:
+        with self._lock:
+            return self._matches.get(str(match_id))
+
+    def evict(self, match_id):
+        state = self.peek(match_id)
+        if state is None:
+            return
+        if self._flush_states([state]):
+            return  # mid-claim; the next flush writes it
+        with self._lock:
+            self._matches.pop(state.id, None)
+            self._dirty.pop(state.id, None)
+
+    def discard(self, match_id):
+        """Drop a cached match without flushing it (its state is stale)."""
+        with self._lock:
+            self._matches.pop(str(match_id), None)
+            self._dirty.pop(str(match_id), None)
+            self._unverified.discard(str(match_id))
+
+    def clear(self):
+        """Drop every cached match without flushing."""
+        with self._lock:
+            self._matches.clear()
+            self._dirty.clear()
+            self._unverified.clear()
+            self.ring_epoch = None
+
+    def _trim(self):
+        # Called with self._lock held; only clean matches are dropped
+        if len(self._matches) <= self.max_size:
+            return
+        for match_id in list(self._matches):
+            if len(self._matches) <= self.max_size:
+                break
+            if match_id not in self._dirty:
+                del self._matches[match_id]
+
+    def _load(self, match_id) -> MatchState | None:
+        try:
+            room = GameRooms.objects.get(id=match_id)
+        except (GameRooms.DoesNotExist, ValidationError):
+            # Malformed UUIDs raise ValidationError; treat as a miss
+            return None
+        players = GamePlayers.objects.filter(room=room)
+        state = MatchState.from_models(room, players)
+        self._recover(state)
+        return state
+
+    def _recover(self, state: MatchState):
+        # Actions logged after the last write-behind flush (e.g. the worker
+        # died before flushing) are replayed on top of the latest snapshot
+        if replay.latest_logged_version(state.id) <= state.version:
+            return
+        payload, version, _ = replay.rebuild(state.id)
+        if version > state.version:
+            logger.info("match %s recovered from v%s to v%s by replay", state.id, state.version, version)
+            state.restore(payload, version)
+            self.mark_dirty(state)
+
+    async def _aload(self, match_id) -> MatchState | None:
+        try:
+            room = await GameRooms.objects.aget(id=match_id)
+        except (GameRooms.DoesNotExist, ValidationError):
+            return None
+        players = [p async for p in GamePlayers.objects.filter(room=room)]
+        state = MatchState.from_models(room, players)
+        await sync_to_async(self._recover)(state)
+        return state
+
+    # --- write-behind ---
+
+    def mark_dirty(self, state: MatchState):
+        with self._lock:
+            self._dirty[state.id] = None
+            pending = len(self._dirty)
+        self._ensure_flusher()
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write every dirty match back to the DB. Safe to call from any thread."""
+        deferred = []
+        while True:
+            with self._lock:
+                if not self._dirty:
+                    break
+                ids = []
+                while self._dirty and len(ids) < self.batch_size:
+                    ids.append(self._dirty.popitem(last=False)[0])
+                states = [self._matches[i] for i in ids if i in self._matches]
+            deferred.extend(self._flush_states(states))
+        with self._lock:
+            for state in deferred:
+                self._dirty[state.id] = None
+
+    def _flush_states(self, states) -> list:
+        """Write ``states`` back; returns those deferred to a later flush."""
+        batch, deferred = [], []
+        for state in states:
+            with state.lock:
+                if state.claims_pending:
+                    # A won turn claim is not applied yet; writing now would
+                    # pair the new row version with the old turn
+                    deferred.append(state)
+                    continue
+                room = {
+                    "status": state.status,
+                    "current_turn": state.current_turn,
+                    "started_at": state.started_at,
+                    "ended_at": state.ended_at,
+                    "winner_id": state.winner_id,
+                    "dream_id": state.dream_id,
+                    "event_deck": list(state.event_deck),
+                    "event_deck_pos": state.deck_pos,
+                    "state_version": state.version,
+                }
+                snapshot = None
+                if state.version - state.snapshot_version >= replay.SNAPSHOT_EVERY:
+                    snapshot = replay.snapshot_row(state)
+                    state.snapshot_version = state.version
+                players = [
+                    GamePlayers(
+                        id=p.id,
+                        tokens=list(p.tokens),
+                        current_points=p.current_points,
+                        savings=p.savings,
+                        liabilities=p.liabilities,
+                        assets=[dict(a) if isinstance(a, dict) else a for a in p.assets],
+                    )
+                    for p in state.players if p.id in state.dirty_players
+                ]
+                batch.append((state, state.row_version, room, players, snapshot))
+                state.room_dirty = False
+                state.dirty_players.clear()
+        if not batch:
+            return deferred
+        retry, stale = [], []
+        try:
+            with transaction.atomic():
+                rows, snapshots = [], []
+                for state, version, room, players, snapshot in batch:
+                    # Only write if no other worker has claimed a turn since we loaded
+                    if GameRooms.objects.filter(id=state.id, version=version).update(**room):
+                        rows.extend(players)
+                        if snapshot is not None:
+                            snapshots.append(snapshot)
+                    elif state.claims_pending or state.row_version != version:
+                        # Our own turn claim raced the snapshot; write on the next pass
+                        retry.append(state)
+                    else:
+                        stale.append(state)
+                if rows:
+                    GamePlayers.objects.bulk_update(rows, PLAYER_FIELDS)
+                if snapshots:
+                    MatchSnapshots.objects.bulk_create(snapshots)
+        except Exception:
+            logger.exception("match flush failed; will retry")
+            retry = [state for state, *_ in batch]
+            stale = []
+        for state in retry:
+            with state.lock:
+                state.room_dirty = True
+                state.dirty_players.update(p.id for p in state.players)
+            with self._lock:
+                self._dirty[state.id] = None
+        for state in stale:
+            logger.warning("match %s changed in another worker; dropping cached state", state.id)
+            self.discard(state.id)
+        return deferred
+
+    def _ensure_flusher(self):
+        if self.flush_interval is None:
+            # Background flushing disabled (tests); callers flush explicitly
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="match-flusher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def shutdown(self):
+        self._stopped.set()
+        self._wakeup.set()
+        self.flush()
+
+
+store = MatchStore()
+atexit.register(store.shutdown)
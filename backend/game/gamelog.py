@@ -0,0 +1,115 @@
+import atexit
+import logging
+import threading
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import GameLogs
+
+logger = logging.getLogger(__name__)
+
+LOG_BUFFER_SIZE = getattr(settings, "GAME_LOG_BUFFER_SIZE", 100000)
+LOG_BATCH_SIZE = getattr(settings, "GAME_LOG_BATCH_SIZE", 500)
+LOG_FLUSH_INTERVAL = getattr(settings, "GAME_LOG_FLUSH_INTERVAL", 1.0)  # seconds
+
+
+class GameLogBuffer:
+    """Append-only audit trail of game actions.
+
+    ``append`` only builds a row and pushes it onto a bounded ring buffer, so
+    the turn path never touches the database. A background thread drains the
+    buffer into ``game_logs`` with ``bulk_create`` whenever a batch fills up or
+    the flush interval passes, and once more at shutdown. A batch that fails to
+    write goes back to the front of the buffer and is retried on the next
+    flush. Entries are only dropped, oldest first, when the buffer overflows;
+    ``dropped`` counts them and each flush logs how many were lost since the last.
+    """
+
+    def __init__(self, capacity=LOG_BUFFER_SIZE, batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._entries: deque = deque(maxlen=capacity)
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.dropped = 0
+        self._reported = 0
+
+    def append(self, room_id, turn, user_id, action: str, payload: dict):
+        if len(self._entries) == self._entries.maxlen:
+            self.dropped += 1
+        self._entries.append(GameLogs(
+            id=uuid.uuid4(),
+            room_id=room_id,
+            turn=turn,
+            user_id=user_id,
+            action=action,
+            payload=payload,
+            timestamp=timezone.now(),
+        ))
+        self._ensure_flusher()
+        if len(self._entries) >= self.batch_size:
+            self._wakeup.set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def flush(self):
+        """Write every buffered entry. Safe to call from any thread."""
+        with self._write_lock:
+            while self._entries:
+                batch = []
+                while self._entries and len(batch) < self.batch_size:
+                    batch.append(self._entries.popleft())
+                try:
+                    GameLogs.objects.bulk_create(batch)
+                except Exception:
+                    logger.exception("writing %d game log entries failed; retrying on the next flush", len(batch))
+                    self._requeue(batch)
+                    break
+            if self.dropped > self._reported:
+                logger.warning("game log buffer overflowed: dropped %d entries", self.dropped - self._reported)
+                self._reported = self.dropped
+
+    def _requeue(self, batch):
+        # Back in front of newer entries; what no longer fits is the oldest
+        overflow = len(batch) + len(self._entries) - self._entries.maxlen
+        if overflow > 0:
+            self.dropped += overflow
+            batch = batch[overflow:]
+        self._entries.extendleft(reversed(batch))
+
+    def _ensure_flusher(self):
+        if self.flush_interval is None:
+            # Background flushing disabled (tests); callers flush explicitly
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._write_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="game-log-flusher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def shutdown(self):
+        self._stopped.set()
+        self._wakeup.set()
+        self.flush()
+
+
+game_log = GameLogBuffer()
+atexit.register(game_log.shutdown)
@@ -0,0 +1,155 @@
+"""``Idempotency-Key`` support for match and card commands.
+
+Responses are remembered per match for ``IDEMPOTENCY_TTL`` seconds, up to
+``IDEMPOTENCY_KEYS_PER_MATCH`` keys each. A key is scoped to the user
+(``userId`` in the body) and the route, so two clients that pick the same
+key never see each other's responses. A retry that carries the same key
+gets the stored response back before the view runs, so it never reaches the
+database or the match state. A retry that arrives while the first request is
+still running gets a retryable 409. Retryable errors are not stored, so
+retrying after a turn conflict does run the command again.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework.response import Response
+
+from .actions import ActionError
+
+IDEMPOTENCY_TTL = getattr(settings, "IDEMPOTENCY_TTL", 300)  # seconds
+IDEMPOTENCY_KEYS_PER_MATCH = getattr(settings, "IDEMPOTENCY_KEYS_PER_MATCH", 256)
+MAX_MATCHES = getattr(settings, "MATCH_CACHE_SIZE", 10000)
+HEADER = "Idempotency-Key"
+
+
+class _Entry:
+    __slots__ = ("command", "expires", "status", "body")
+
+    def __init__(self, command: str, expires: float):
+        self.command = command
+        self.expires = expires
+        self.status = None  # None while the first request is running
+        self.body = None
+
+
+class ResponseCache:
+    def __init__(self, ttl=IDEMPOTENCY_TTL, keys_per_match=IDEMPOTENCY_KEYS_PER_MATCH, max_matches=MAX_MATCHES):
+        self.ttl = ttl
+        self.keys_per_match = keys_per_match
+        self.max_matches = max_matches
+        self._matches: "OrderedDict[str, OrderedDict[str, _Entry]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def begin(self, match_id, key: str, command: str):
+        """Stored ``(status, body)`` for ``key``, or None after claiming it."""
+        match_id = str(match_id)
+        now = time.monotonic()
+        with self._lock:
+            entries = self._matches.get(match_id)
+            if entries is None:
+                entries = self._matches[match_id] = OrderedDict()
+                if len(self._matches) > self.max_matches:
+                    self._matches.popitem(last=False)
+            else:
+                self._matches.move_to_end(match_id)
+            entry = entries.get(key)
+            if entry is not None and entry.expires < now:
+                del entries[key]
+                entry = None
+            if entry is not None:
+                if entry.command != command:
+                    raise ActionError("Idempotency-Key already used for another command", 422)
+                if entry.status is None:
+                    raise ActionError("request in progress, retry", 409, retryable=True)
+                return entry.status, entry.body
+            entries[key] = _Entry(command, now + self.ttl)
+            while len(entries) > self.keys_per_match:
+                entries.popitem(last=False)
+        return None
+
+    def finish(self, match_id, key: str, status: int, body):
+        with self._lock:
+            entries = self._matches.get(str(match_id), {})
+            entry = entries.get(key)
+            if entry is None:
+                return
+            if body is None or status >= 500 or (isinstance(body, dict) and body.get("retryable")):
+                del entries[key]
+                return
+            entry.status, entry.body = status, body
+
+    def clear(self):
+        with self._lock:
+            self._matches.clear()
+
+
+responses = ResponseCache()
+
+
+def _scoped(request, key: str, data) -> str:
+    user_id = data.get("userId") if isinstance(data, dict) else None
+    return f"{user_id}:{request.path}:{key}"
+
+
+def _body(request) -> dict:
+    try:
+        return json.loads(request.body or b"{}")
+    except ValueError:
+        return {}
+
+
+def idempotent(view):
+    """Replay stored responses for requests carrying an ``Idempotency-Key``.
+
+    Wraps sync DRF views (place it under ``@api_view``) and async views alike.
+    """
+    command = view.__name__
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, match_id, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return await view(request, match_id, *args, **kwargs)
+            key = _scoped(request, key, _body(request))
+            try:
+                saved = responses.begin(match_id, key, command)
+            except ActionError as e:
+                return JsonResponse(e.body(), status=e.status)
+            if saved is not None:
+                return JsonResponse(saved[1], status=saved[0])
+            try:
+                response = await view(request, match_id, *args, **kwargs)
+            except Exception:
+                responses.finish(match_id, key, 500, None)
+                raise
+            responses.finish(match_id, key, response.status_code, json.loads(response.content))
+            return response
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, match_id, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(request, match_id, *args, **kwargs)
+        key = _scoped(request, key, request.data)
+        try:
+            saved = responses.begin(match_id, key, command)
+        except ActionError as e:
+            return Response(e.body(), status=e.status)
+        if saved is not None:
+            return Response(saved[1], status=saved[0])
+        try:
+            response = view(request, match_id, *args, **kwargs)
+        except Exception:
+            responses.finish(match_id, key, 500, None)
+            raise
+        responses.finish(match_id, key, response.status_code, response.data)
+        return response
+    return wrapper
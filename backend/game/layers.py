@@ -0,0 +1,446 @@
+"""Sharded channel layer for running more than one worker process.
+
+Group state lives in a set of hub processes (``manage.py run_channel_hub``).
+Each group is assigned to one hub by hashing its name (``match_<id>``), so a
+match's membership and fan-out stay on a single shard. Each worker event loop
+holds one connection to every hub and owns the channels it created
+(``specific.<worker>!<id>``). A ``group_send`` travels once to the group's
+hub, and the hub forwards it once to every worker that has members in that
+group. Messages are msgpack-encoded a single time by the sender and pass
+through the hub as opaque bytes.
+
+Hubs listen on ``unix:/path`` or ``tcp:host:port``. ``LocalHubs`` runs them on
+a background thread for tests and single-machine setups. In production the
+layer can be replaced by a networked broker such as channels_redis by changing
+``CHANNEL_LAYERS`` only.
+
+``stats()`` reports delivery latency and local queue depth for every group.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict, defaultdict, deque
+
+import msgpack
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("!I")
+HUB_MAX_BUFFER = 8 * 1024 * 1024  # bytes queued to one slow worker before dropping
+MAX_TRACKED_GROUPS = 10000
+
+
+def shard_of(name: str, shards: int) -> int:
+    return zlib.crc32(name.encode()) % shards
+
+
+def owner_of(channel: str) -> str:
+    # "specific.<worker>!<id>" -> "<worker>"
+    return channel.split("!", 1)[0].rsplit(".", 1)[-1]
+
+
+def _pack(frame) -> bytes:
+    data = msgpack.packb(frame, use_bin_type=True)
+    return HEADER.pack(len(data)) + data
+
+
+async def _read(reader):
+    (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return msgpack.unpackb(await reader.readexactly(size), raw=False)
+
+
+async def _connect(address: str):
+    if address.startswith("unix:"):
+        return await asyncio.open_unix_connection(address[len("unix:"):])
+    host, port = address.removeprefix("tcp:").rsplit(":", 1)
+    return await asyncio.open_connection(host, int(port))
+
+
+# --- Hub (one shard) ---
+
+class ChannelHub:
+    """Group membership for one shard, and forwarding to worker connections."""
+
+    def __init__(self, group_expiry=86400):
+        self.group_expiry = group_expiry
+        self.groups: dict[str, dict[str, float]] = {}
+        self.workers: dict[str, asyncio.StreamWriter] = {}
+        self.dropped = 0
+        self._clients: set = set()
+
+    async def serve(self, address: str):
+        if address.startswith("unix:"):
+            return await asyncio.start_unix_server(self._client, address[len("unix:"):])
+        host, port = address.removeprefix("tcp:").rsplit(":", 1)
+        return await asyncio.start_server(self._client, host, int(port))
+
+    async def _client(self, reader, writer):
+        worker = None
+        self._clients.add(writer)
+        try:
+            while True:
+                op, *args = await _read(reader)
+                if op == "hello":
+                    worker = args[0]
+                    self.workers[worker] = writer
+                elif op == "group_send":
+                    self._group_send(*args)
+                elif op == "send":
+                    channel, packed, sent_at = args
+                    self._forward(owner_of(channel), [channel], packed, None, sent_at)
+                elif op == "group_add":
+                    ack, group, channel = args
+                    self.groups.setdefault(group, {})[channel] = time.time()
+                    writer.write(_pack(["ack", ack]))
+                elif op == "group_discard":
+                    ack, group, channel = args
+                    self._discard(group, channel)
+                    writer.write(_pack(["ack", ack]))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if worker is not None and self.workers.get(worker) is writer:
+                del self.workers[worker]
+                # The worker's channels died with it
+                for group in list(self.groups):
+                    for channel in [c for c in self.groups[group] if owner_of(c) == worker]:
+                        self._discard(group, channel)
+            self._clients.discard(writer)
+            writer.close()
+
+    def close(self):
+        for writer in list(self._clients):
+            writer.close()
+
+    def _discard(self, group, channel):
+        members = self.groups.get(group)
+        if members is None:
+            return
+        members.pop(channel, None)
+        if not members:
+            del self.groups[group]
+
+    def _group_send(self, group, packed, sent_at):
+        members = self.groups.get(group)
+        if not members:
+            return
+        cutoff = time.time() - self.group_expiry
+        by_worker = defaultdict(list)
+        for channel, added in list(members.items()):
+            if added < cutoff:
+                self._discard(group, channel)
+                continue
+            by_worker[owner_of(channel)].append(channel)
+        for worker, channels in by_worker.items():
+            self._forward(worker, channels, packed, group, sent_at)
+
+    def _forward(self, worker, channels, packed, group, sent_at):
+        writer = self.workers.get(worker)
+        if writer is None:
+            return
+        if writer.transport.get_write_buffer_size() > HUB_MAX_BUFFER:
+            self.dropped += 1
+            return
+        writer.write(_pack(["deliver", channels, packed, group, sent_at]))
+
+
+class LocalHubs:
+    """Run ``count`` hubs on unix sockets in a background thread."""
+
+    def __init__(self, count=2, directory=None):
+        self.directory = directory or tempfile.mkdtemp(prefix="pesamali-hubs-")
+        self.hosts = [f"unix:{os.path.join(self.directory, f'hub{i}.sock')}" for i in range(count)]
+        self.hubs = [ChannelHub() for _ in range(count)]
+        self._loop = asyncio.new_event_loop()
+        self._servers = []
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="channel-hubs", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        for hub, host in zip(self.hubs, self.hosts):
+            self._servers.append(self._loop.run_until_complete(hub.serve(host)))
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._shutdown())
+        self._loop.close()
+
+    async def _shutdown(self):
+        for server in self._servers:
+            server.close()
+        for hub in self.hubs:
+            hub.close()
+        # Client handlers exit once their connection is closed
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=1)
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+# --- Worker side ---
+
+class GroupMetrics:
+    def __init__(self):
+        self.delivered = 0
+        self.latencies: deque = deque(maxlen=1000)  # seconds, most recent deliveries
+
+
+class _Link:
+    """One event loop's connections to every hub, and its channel queues."""
+
+    def __init__(self, layer, loop):
+        self.layer = layer
+        self.loop = loop
+        self.worker = "w" + uuid.uuid4().hex[:12]
+        self.writers: list[asyncio.StreamWriter] = []
+        self.queues: dict[str, asyncio.Queue] = {}
+        self.members: dict[str, set] = defaultdict(set)  # group -> local channels
+        self.receiving: dict[str, int] = {}  # channel -> pending receive calls
+        self.acks: dict[int, asyncio.Future] = {}
+        self.tasks: list[asyncio.Task] = []
+        self._ids = itertools.count()
+        self._lock = asyncio.Lock()
+
+    async def connect(self):
+        if self.writers:
+            return
+        async with self._lock:
+            if self.writers:
+                return
+            # Receivers from a dropped connection may still be reading the other hubs
+            for task in self.tasks:
+                task.cancel()
+            self.tasks = []
+            writers = []
+            for host in self.layer.hosts:
+                reader, writer = await _connect(host)
+                writer.write(_pack(["hello", self.worker]))
+                self.tasks.append(asyncio.ensure_future(self._receive(reader, writers)))
+                writers.append(writer)
+            # The hubs forgot this worker's groups when the old connections closed
+            acks = []
+            for group, channels in self.members.items():
+                shard = shard_of(group, len(writers))
+                for channel in channels:
+                    ack_id = next(self._ids)
+                    self.acks[ack_id] = self.loop.create_future()
+                    acks.append(self.acks[ack_id])
+                    writers[shard].write(_pack(["group_add", ack_id, group, channel]))
+            for writer in writers:
+                await writer.drain()
+            await asyncio.gather(*acks)
+            self.writers = writers
+
+    async def call(self, shard: int, frame: list, ack: bool = False):
+        writer = self.writers[shard]
+        if ack:
+            ack_id = next(self._ids)
+            future = self.loop.create_future()
+            self.acks[ack_id] = future
+            frame = [frame[0], ack_id, *frame[1:]]
+        writer.write(_pack(frame))
+        await writer.drain()
+        if ack:
+            await future
+
+    def queue(self, channel: str) -> asyncio.Queue:
+        queue = self.queues.get(channel)
+        if queue is None:
+            queue = self.queues[channel] = asyncio.Queue(self.layer.get_capacity(channel))
+        return queue
+
+    def release(self, channel: str):
+        """Drop ``channel``'s queue unless it is still in a group or being received on."""
+        if self.receiving.get(channel) or any(channel in channels for channels in self.members.values()):
+            return
+        self.queues.pop(channel, None)
+
+    async def _receive(self, reader, writers):
+        try:
+            while True:
+                op, *args = await _read(reader)
+                if op == "ack":
+                    future = self.acks.pop(args[0], None)
+                    if future is not None and not future.done():
+                        future.set_result(None)
+                elif op == "deliver":
+                    self._deliver(*args)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # The hub dropped this worker's memberships; the next call reconnects
+            logger.warning("channel hub connection closed (worker %s)", self.worker)
+            for future in self.acks.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("channel hub connection closed"))
+            self.acks.clear()
+            for writer in writers:
+                writer.close()
+            # A receiver from an older connection must not close a newer one
+            if self.writers is writers:
+                self.writers = []
+
+    def _deliver(self, channels, packed, group, sent_at):
+        message = msgpack.unpackb(packed, raw=False)
+        self.layer._record(group or channels[0], time.time() - sent_at)
+        for channel in channels:
+            try:
+                self.queue(channel).put_nowait((sent_at, message))
+            except asyncio.QueueFull:
+                self.layer.dropped += 1
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        for writer in self.writers:
+            writer.close()
+        self.writers = []
+
+
+class ShardedChannelLayer(BaseChannelLayer):
+    """Channel layer whose groups are sharded across ``ChannelHub`` processes.
+
+    Only process-specific channels (from ``new_channel``) can receive, which
+    covers websocket consumers; there are no shared worker channels.
+    """
+
+    extensions = ["groups", "flush"]
+
+    def __init__(self, hosts, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        if not hosts:
+            raise ValueError("ShardedChannelLayer needs at least one hub in 'hosts'")
+        self.hosts = list(hosts)
+        self.group_expiry = group_expiry
+        self.dropped = 0
+        self._links: dict = {}
+        self._metrics: "OrderedDict[str, GroupMetrics]" = OrderedDict()
+        self._metrics_lock = threading.Lock()
+
+    async def _link(self) -> _Link:
+        loop = asyncio.get_running_loop()
+        link = self._links.get(loop)
+        if link is None:
+            # Loops from async_to_sync come and go; drop the dead ones
+            for old in [l for l in self._links if l.is_closed()]:
+                self._links.pop(old).close()
+            link = self._links[loop] = _Link(self, loop)
+        await link.connect()
+        return link
+
+    def _record(self, group: str, latency: float):
+        with self._metrics_lock:
+            metrics = self._metrics.get(group)
+            if metrics is None:
+                metrics = self._metrics[group] = GroupMetrics()
+                if len(self._metrics) > MAX_TRACKED_GROUPS:
+                    self._metrics.popitem(last=False)
+            else:
+                self._metrics.move_to_end(group)
+            metrics.delivered += 1
+            metrics.latencies.append(latency)
+
+    # --- channel layer API ---
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel)
+        if "!" not in channel:
+            raise NotImplementedError("only process-specific channels are supported")
+        link = await self._link()
+        packed = msgpack.packb(message, use_bin_type=True)
+        await link.call(shard_of(owner_of(channel), len(self.hosts)), ["send", channel, packed, time.time()])
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        link = await self._link()
+        queue = link.queue(channel)
+        link.receiving[channel] = link.receiving.get(channel, 0) + 1
+        cancelled = False
+        try:
+            while True:
+                sent_at, message = await queue.get()
+                if time.time() - sent_at <= self.expiry:
+                    return message
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            link.receiving[channel] -= 1
+            if not link.receiving[channel]:
+                del link.receiving[channel]
+            if cancelled:
+                # The consumer has gone (it discards its groups before cancelling)
+                link.release(channel)
+
+    async def new_channel(self, prefix="specific"):
+        link = await self._link()
+        return f"{prefix}.{link.worker}!{uuid.uuid4().hex}"
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        link = await self._link()
+        await link.call(shard_of(group, len(self.hosts)), ["group_add", group, channel], ack=True)
+        link.members[group].add(channel)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        link = await self._link()
+        await link.call(shard_of(group, len(self.hosts)), ["group_discard", group, channel], ack=True)
+        members = link.members.get(group)
+        if members is not None:
+            members.discard(channel)
+            if not members:
+                del link.members[group]
+        link.release(channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_group_name(group), "Group name not valid"
+        link = await self._link()
+        packed = msgpack.packb(message, use_bin_type=True)
+        await link.call(shard_of(group, len(self.hosts)), ["group_send", group, packed, time.time()])
+
+    async def flush(self):
+        for link in self._links.values():
+            link.close()
+        self._links = {}
+        with self._metrics_lock:
+            self._metrics.clear()
+
+    # --- metrics ---
+
+    def stats(self) -> dict:
+        """Per-group delivery latency (ms) and local queue depth."""
+        depth = defaultdict(int)
+        for link in list(self._links.values()):
+            for group, channels in list(link.members.items()):
+                depth[group] += sum(link.queues[c].qsize() for c in channels if c in link.queues)
+        groups = {}
+        with self._metrics_lock:
+            for group, metrics in self._metrics.items():
+                samples = sorted(metrics.latencies)
+                groups[group] = {
+                    "delivered": metrics.delivered,
+                    "p50Ms": round(samples[len(samples) // 2] * 1000, 3),
+                    "p99Ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+                    "queueDepth": depth.get(group, 0),
+                }
+        return {"groups": groups, "dropped": self.dropped}
+
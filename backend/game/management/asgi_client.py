@@ -0,0 +1,55 @@
+"""In-process HTTP requests through an ASGI application, for the bench and load-test commands."""
+import asyncio
+
+
+def load_application():
+    """``backend.asgi.application`` for a benchmark running in this process.
+
+    A benchmark is not a server. It must not sweep the target database's
+    other active matches into its turn timers when the application loads.
+    """
+    from game.timers import turn_timers
+
+    turn_timers.sweep_on_start = False
+    from backend.asgi import application
+    return application
+
+
+async def asgi_request(application, method: str, path: str, body: bytes = b"", headers=None) -> tuple[int, bytes]:
+    """Drive one HTTP request through ``application`` in-process; returns (status, body)."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"host", b"bench"),
+        ] + list(headers or []),
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    sent = False
+    status, chunks = 0, []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await application(scope, receive, send)
+    return status, b"".join(chunks)
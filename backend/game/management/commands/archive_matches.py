@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from game.archive import ARCHIVE_CHUNK_SIZE, archive_ended
+
+
+class Command(BaseCommand):
+    help = "Move matches that ended before the cutoff into archived_matches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=float, default=30, help="archive matches that ended more than this many days ago")
+        parser.add_argument("--chunk-size", type=int, default=ARCHIVE_CHUNK_SIZE, help="matches per transaction")
+
+    def handle(self, *args, **opts):
+        cutoff = timezone.now() - timedelta(days=opts["days"])
+        archived = archive_ended(cutoff, opts["chunk_size"])
+        self.stdout.write(f"archived {archived} matches that ended before {cutoff:%Y-%m-%d %H:%M}")
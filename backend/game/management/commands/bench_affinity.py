@@ -0,0 +1,152 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from game.affinity import MatchRouter
+
+STATS_PATH = "/__bench/cache"
+
+
+async def worker_application(scope, receive, send):
+    """``backend.asgi.application`` plus an endpoint reporting cache hits."""
+    from backend.asgi import application
+    from game.engine import store
+
+    if scope["type"] == "http" and scope["path"] == STATS_PATH:
+        body = json.dumps({"hits": store.hits, "misses": store.misses}).encode()
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+        return
+    await application(scope, receive, send)
+
+
+class Command(BaseCommand):
+    help = "Compare MatchStore hit rates across worker processes with and without match-affinity routing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=3)
+        parser.add_argument("--matches", type=int, default=200, help="matches per phase")
+        parser.add_argument("--requests", type=int, default=3000, help="state polls per phase")
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("--port", type=int, default=8100, help="router port; workers use the ports after it")
+
+    def handle(self, *args, **opts):
+        workers = [f"127.0.0.1:{opts['port'] + 1 + i}" for i in range(opts["workers"])]
+        procs = [self._spawn(w) for w in workers]
+        try:
+            asyncio.run(self._bench(workers, procs, opts))
+        finally:
+            for proc in procs:
+                proc.terminate()
+            for proc in procs:
+                proc.wait()
+
+    def _spawn(self, worker):
+        host, port = worker.rsplit(":", 1)
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "backend.settings"))
+        return subprocess.Popen(
+            [sys.executable, "-m", "daphne", "-b", host, "-p", port, f"{__name__}:worker_application"],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+    def _create_matches(self, count):
+        from django.db import transaction
+        from game import actions
+        from game.models import GameRooms, GamePlayers
+
+        rooms = [actions.new_room(2) for _ in range(count)]
+        players = [actions.new_player(room.id, None, seat, True) for room in rooms for seat in range(2)]
+        for room in rooms:
+            room.status = "active"
+        with transaction.atomic():
+            GameRooms.objects.bulk_create(rooms)
+            GamePlayers.objects.bulk_create(players)
+        return [str(room.id) for room in rooms]
+
+    async def _bench(self, workers, procs, opts):
+        for worker in workers:
+            await self._wait_ready(worker)
+        router = MatchRouter(workers, health_interval=0.2)
+        server = await router.serve("127.0.0.1", opts["port"])
+        front = f"127.0.0.1:{opts['port']}"
+        try:
+            direct = itertools.cycle(workers)
+            spread = await self._phase(
+                "round-robin", workers, await self._matches(opts), lambda path: next(direct), opts)
+            matches = await self._matches(opts)
+            routed = await self._phase("affinity", workers, matches, lambda path: front, opts)
+
+            # One worker leaves: only its share of the matches changes owner
+            procs[0].terminate()
+            await asyncio.to_thread(procs[0].wait)
+            while workers[0] in router.ring.nodes:
+                await asyncio.sleep(0.05)
+            after = await self._phase("after leave", workers[1:], matches, lambda path: front, opts)
+        finally:
+            router.close()
+            server.close()
+        self.stdout.write(json.dumps({"roundRobin": spread, "affinity": routed, "afterLeave": after, "routed": router.routed}))
+
+    async def _matches(self, opts):
+        return await asyncio.to_thread(self._create_matches, opts["matches"])
+
+    async def _phase(self, label, workers, matches, target, opts):
+        before = [await self._stats(w) for w in workers]
+        gate = asyncio.Semaphore(opts["concurrency"])
+        errors = 0
+
+        async def poll(match_id):
+            nonlocal errors
+            path = f"/matches/{match_id}/state"
+            async with gate:
+                status, _ = await request(target(path), "GET", path)
+            if status != 200:
+                errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(poll(random.choice(matches)) for _ in range(opts["requests"])))
+        elapsed = time.perf_counter() - start
+        after = [await self._stats(w) for w in workers]
+        hits = sum(a["hits"] - b["hits"] for a, b in zip(after, before))
+        misses = sum(a["misses"] - b["misses"] for a, b in zip(after, before))
+        rate = hits / max(1, hits + misses)
+        self.stdout.write(
+            f"{label:>12}: hit rate {rate:6.1%}  ({misses} loads for {len(matches)} matches, "
+            f"{opts['requests'] / elapsed:.0f} req/s, {errors} errors)"
+        )
+        return {"hitRate": round(rate, 4), "loads": misses, "errors": errors}
+
+    async def _stats(self, worker):
+        _, body = await request(worker, "GET", STATS_PATH)
+        return json.loads(body)
+
+    async def _wait_ready(self, worker, timeout=30.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                await request(worker, "GET", STATS_PATH)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+async def request(address: str, method: str, path: str):
+    """One HTTP/1.1 request over a fresh connection; returns (status, body)."""
+    host, port = address.rsplit(":", 1)
+    reader, writer = await asyncio.open_connection(host, int(port))
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+    raw = await reader.read()
+    writer.close()
+    head, _, body = raw.partition(b"\r\n\r\n")
+    return int(head.split(b" ", 2)[1]), body
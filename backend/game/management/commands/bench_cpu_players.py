@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from game import actions
+from game.cpu import cpu_players
+from game.engine import store
+
+TARGET_P99_MS = 50  # not met on a single core; see Docs/backend_urls.md
+
+
+class Command(BaseCommand):
+    help = "Run many all-CPU matches and report CPU turn latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--matches", type=int, default=200)
+        parser.add_argument("--seats", type=int, default=2)
+        parser.add_argument("--seconds", type=float, default=10.0)
+
+    def handle(self, *args, **opts):
+        states = [self._setup_match(opts["seats"]) for _ in range(opts["matches"])]
+        cpu_players.latencies.clear()
+        for state in states:
+            cpu_players.schedule(state)
+        time.sleep(opts["seconds"])
+
+        # Stop the matches so the pool drains
+        for state in states:
+            with state.lock:
+                state.status = "ended"
+                state.room_dirty = True
+            store.mark_dirty(state)
+        store.flush()
+
+        stats = cpu_players.stats()
+        self.stdout.write(f"{opts['matches']} matches, {stats['turns']} CPU turns in {opts['seconds']:.0f}s")
+        if stats["turns"]:
+            self.stdout.write(f"turn latency p50 {stats['p50Ms']}ms  p95 {stats['p95Ms']}ms  p99 {stats['p99Ms']}ms")
+            met = "met" if stats["p99Ms"] <= TARGET_P99_MS else "NOT met"
+            self.stdout.write(f"p99 target {TARGET_P99_MS}ms: {met}")
+
+    def _setup_match(self, seats):
+        room = actions.new_room(seats)
+        room.save(force_insert=True)
+        state = actions.room_created(room)
+        for seat in range(seats):
+            player = actions.new_player(room.id, None, seat, True)
+            player.save(force_insert=True)
+            actions.player_joined(state, player)
+        actions.start(state)
+        return state
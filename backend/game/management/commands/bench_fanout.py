@@ -0,0 +1,62 @@
+import asyncio
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from game.broadcast import MatchBroadcast
+from game.consumers import MatchStreamConsumer
+
+
+class Command(BaseCommand):
+    help = "Encode CPU per event vs. subscriber count, per-consumer vs. serialize-once"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--frames", type=int, default=2000)
+        parser.add_argument("--subscribers", default="1,4,8,16,64")
+        parser.add_argument("--binary", action="store_true", help="subscribers negotiated pesamali.bin.v1")
+
+    def handle(self, *args, **opts):
+        out = self._sample_broadcast()
+        per_consumer = {"type": "game_event", "events": out.events}
+        events = len(out.events)
+        self.stdout.write(f"{events} events per frame, {opts['frames']} frames, {'binary' if opts['binary'] else 'json'} clients")
+        self.stdout.write(f"{'subs':>5} {'per-consumer us/event':>22} {'serialize-once us/event':>24}")
+        for n in [int(x) for x in opts["subscribers"].split(",")]:
+            consumers = [self._consumer(opts["binary"]) for _ in range(n)]
+            old = asyncio.run(self._fan_out(consumers, lambda: per_consumer, opts["frames"]))
+            new = asyncio.run(self._fan_out(consumers, out.message, opts["frames"]))
+            scale = 1e6 / (opts["frames"] * events)
+            self.stdout.write(f"{n:>5} {old * scale:>22.2f} {new * scale:>24.2f}")
+
+    def _sample_broadcast(self):
+        out = MatchBroadcast(uuid.uuid4())
+        user_id = str(uuid.uuid4())
+        out.add("move_event", {"userId": user_id, "tokenIndex": 2, "steps": 7, "position": 47})
+        out.add("asset_return", {"assetId": "a1", "amount": 320, "returnsCollected": 2})
+        out.add("state_update", {
+            "players": [{"tokens": [3, 12, 47, 0], "currentPoints": 1840, "seat": 1}],
+            "matchId": out.match_id, "baseVersion": 41, "version": 42,
+        })
+        out.add("turn_change", {"nextPlayerSeat": 2})
+        return out
+
+    def _consumer(self, binary):
+        consumer = MatchStreamConsumer()
+        consumer.binary = binary
+
+        async def send(text_data=None, bytes_data=None, close=False):
+            pass
+
+        consumer.send = send
+        return consumer
+
+    async def _fan_out(self, consumers, message, frames):
+        # Sender work (building the message) plus every consumer's handler;
+        # the channel layer's own copying is left out
+        start = time.perf_counter()
+        for _ in range(frames):
+            event = message()
+            for consumer in consumers:
+                await consumer.game_event(event)
+        return time.perf_counter() - start
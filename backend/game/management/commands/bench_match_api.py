@@ -0,0 +1,65 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from accounts.models import Users
+from game import actions
+from game.engine import store
+from game.management.asgi_client import asgi_request, load_application
+
+
+class Command(BaseCommand):
+    help = "Compare sync and async match endpoint throughput on the ASGI app"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--endpoint", choices=["state", "roll"], default="roll")
+
+    def handle(self, *args, **opts):
+        application = load_application()
+
+        match_id, user_id = self._setup_match()
+        body = json.dumps({"userId": user_id}).encode() if opts["endpoint"] == "roll" else b""
+        method = "POST" if opts["endpoint"] == "roll" else "GET"
+        results = {}
+        for label, prefix in (("sync", ""), ("async", "/async")):
+            path = f"{prefix}/matches/{match_id}/{opts['endpoint']}"
+            results[label] = async_to_sync(self._run)(application, method, path, body, opts["requests"], opts["concurrency"])
+            elapsed, errors = results[label]
+            self.stdout.write(
+                f"{label:>5}: {opts['requests'] / elapsed:8.0f} req/s  "
+                f"({elapsed:.2f}s, {errors} errors)"
+            )
+        speedup = results["sync"][0] / results["async"][0]
+        self.stdout.write(f"async/sync throughput: {speedup:.2f}x")
+
+    def _setup_match(self):
+        user, _ = Users.objects.get_or_create(username="bench_player", defaults={"password_hash": "!"})
+        room = actions.new_room(1)
+        room.save(force_insert=True)
+        state = actions.room_created(room)
+        player = actions.new_player(room.id, user, 0, False)
+        player.save(force_insert=True)
+        actions.player_joined(state, player)
+        actions.start(state)
+        store.flush()
+        return str(room.id), str(user.id)
+
+    async def _run(self, application, method, path, body, total, concurrency):
+        gate = asyncio.Semaphore(concurrency)
+        errors = 0
+
+        async def one():
+            nonlocal errors
+            async with gate:
+                status, _ = await asgi_request(application, method, path, body)
+                if status >= 400:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        return time.perf_counter() - start, errors
@@ -0,0 +1,62 @@
+import asyncio
+import json
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from accounts.models import Users
+from game.matchmaking import matchmaker
+from game.management.asgi_client import asgi_request, load_application
+
+
+class Command(BaseCommand):
+    help = "Load-test matchmaking queue joins through the ASGI app"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=5000)
+        parser.add_argument("--players", type=int, default=4, help="numPlayers to queue for")
+        parser.add_argument("--concurrency", type=int, default=200)
+
+    def handle(self, *args, **opts):
+        application = load_application()
+
+        users = [Users(id=uuid.uuid4(), username=f"mm_{uuid.uuid4().hex[:12]}", password_hash="!") for _ in range(opts["users"])]
+        Users.objects.bulk_create(users, batch_size=1000)
+        bodies = [json.dumps({"userId": str(u.id), "numPlayers": opts["players"]}).encode() for u in users]
+
+        # Queue everyone first, then time match formation separately
+        interval, matchmaker.interval = matchmaker.interval, None
+        try:
+            # The queue on its own, without the HTTP stack in front of it
+            start = time.perf_counter()
+            for u in users:
+                matchmaker.join(u.id, opts["players"])
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"queue: {len(users) / elapsed:8.0f} joins/s")
+            matchmaker.clear()
+
+            elapsed, errors = async_to_sync(self._join_all)(application, bodies, opts["concurrency"])
+            self.stdout.write(f"joins: {len(bodies) / elapsed:8.0f} req/s  ({elapsed:.2f}s, {errors} errors)")
+            start = time.perf_counter()
+            rooms = matchmaker.tick()
+            formed = time.perf_counter() - start
+            self.stdout.write(f"formed {rooms} rooms in {formed * 1000:.0f}ms ({rooms / formed:.0f} rooms/s)")
+        finally:
+            matchmaker.interval = interval
+
+    async def _join_all(self, application, bodies, concurrency):
+        gate = asyncio.Semaphore(concurrency)
+        errors = 0
+
+        async def one(body):
+            nonlocal errors
+            async with gate:
+                status, _ = await asgi_request(application, "POST", "/async/matchmaking", body)
+                if status != 202:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(body) for body in bodies))
+        return time.perf_counter() - start, errors
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+
+from accounts.models import Users
+from cards.catalog import catalog
+from cards.models import EventCards, SavingsCards
+from dreams.models import Dreams, UserDreams
+from game import board
+from game.cpu import choose_asset, choose_move
+from game.engine import store
+from game.gamelog import game_log
+from game.management.asgi_client import asgi_request, load_application
+from game.models import GameLogs, GamePlayers, GameRooms, MatchSnapshots
+
+
+def _percentile(samples, p):
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+class Recorder:
+    """Latency samples (seconds) and status counts per endpoint.
+
+    Rejected calls (4xx) are reported under ``"<endpoint> 4xx"``. They only
+    time validation, so they would skew the endpoint's own latency row.
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.frames = 0
+        self.delivery = []  # seconds from broadcast to websocket receipt
+
+    def add(self, endpoint, status, elapsed):
+        if 400 <= status < 500:
+            endpoint = f"{endpoint} 4xx"
+        self.latencies[endpoint].append(elapsed)
+        self.statuses[endpoint][status] += 1
+
+    def report(self, wall: float) -> dict:
+        endpoints = {}
+        for endpoint, samples in sorted(self.latencies.items()):
+            samples = sorted(samples)
+            statuses = self.statuses[endpoint]
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "rps": round(len(samples) / wall, 1),
+                "p50Ms": round(_percentile(samples, 0.50) * 1000, 2),
+                "p95Ms": round(_percentile(samples, 0.95) * 1000, 2),
+                "p99Ms": round(_percentile(samples, 0.99) * 1000, 2),
+                "maxMs": round(samples[-1] * 1000, 2),
+                "rejected": sum(n for s, n in statuses.items() if 400 <= s < 500),
+                "errors": sum(n for s, n in statuses.items() if s >= 500),
+                "statuses": {str(s): n for s, n in sorted(statuses.items())},
+            }
+        delivery = sorted(self.delivery)
+        websocket = {"frames": self.frames}
+        if delivery:
+            websocket.update(
+                p50Ms=round(_percentile(delivery, 0.50) * 1000, 2),
+                p95Ms=round(_percentile(delivery, 0.95) * 1000, 2),
+                p99Ms=round(_percentile(delivery, 0.99) * 1000, 2),
+            )
+        total = sum(len(s) for s in self.latencies.values())
+        return {"requests": total, "rps": round(total / wall, 1), "endpoints": endpoints, "websocket": websocket}
+
+
+class Command(BaseCommand):
+    help = (
+        "Play simulated matches end to end through backend.asgi.application and report per-endpoint latency. "
+        "Every row the run writes (users, cards, dream, matches) is deleted when it finishes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--matches", type=int, default=50)
+        parser.add_argument("--players", type=int, default=2, choices=[2, 3, 4])
+        parser.add_argument("--turns", type=int, default=20, help="turns played per match")
+        parser.add_argument("--concurrency", type=int, default=10, help="matches in flight at once")
+        parser.add_argument("--async", dest="use_async", action="store_true", help="use the /async/ endpoints")
+        parser.add_argument("--no-websockets", dest="websockets", action="store_false")
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument("--json", dest="json_path", help="also write the report to this file ('-' for stdout only)")
+
+    def handle(self, *args, **opts):
+        application = load_application()
+
+        random.seed(opts["seed"])
+        users, fixtures = self._setup(opts["matches"] * opts["players"])
+        recorder = Recorder()
+        match_ids = []
+        try:
+            start = time.perf_counter()
+            asyncio.run(self._run(application, users, fixtures, recorder, opts, match_ids))
+            wall = time.perf_counter() - start
+        finally:
+            self._teardown(users, fixtures, match_ids)
+
+        report = {
+            "config": {k: opts[k] for k in ("matches", "players", "turns", "concurrency", "use_async", "websockets", "seed")},
+            "database": connection.vendor,
+            "wallSeconds": round(wall, 3),
+            **recorder.report(wall),
+        }
+        if opts["json_path"] == "-":
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self._print(report)
+        if opts["json_path"]:
+            with open(opts["json_path"], "w") as f:
+                json.dump(report, f, indent=2)
+
+    @transaction.atomic
+    def _setup(self, count):
+        run = uuid.uuid4().hex[:8]
+        users = Users.objects.bulk_create([
+            Users(username=f"loadtest_{run}_{i}", password_hash="!") for i in range(count)
+        ])
+        last = Dreams.objects.aggregate(last=Max("order_index"))["last"] or 0
+        # Draws need a non-empty deck; purchases and savings plays need one card each.
+        # Names carry the run id so the teardown deletes only this run's rows.
+        event = EventCards.objects.create(id=uuid.uuid4(), title=f"Load test windfall {run}", effect_points=20, message="load test")
+        savings = SavingsCards.objects.create(
+            id=uuid.uuid4(), name=f"Load test savings {run}", save_threshold=100, bonus_condition={"type": "flat_bonus", "bonus": 10})
+        dream = Dreams.objects.create(
+            id=uuid.uuid4(), slug=f"load-test-dream-{run}", name=f"Load test dream {run}", cost=100, order_index=last + 1, image_url="")
+        return [str(u.id) for u in users], {"event": str(event.id), "savings": str(savings.id), "dream": str(dream.id)}
+
+    def _teardown(self, users, fixtures, match_ids):
+        # Write back what the run left in memory, then delete every row it wrote
+        store.flush()
+        game_log.flush()
+        for match_id in match_ids:
+            store.discard(match_id)
+        GameLogs.objects.filter(room_id__in=match_ids).delete()
+        MatchSnapshots.objects.filter(room_id__in=match_ids).delete()
+        GamePlayers.objects.filter(room_id__in=match_ids).delete()
+        GameRooms.objects.filter(id__in=match_ids).delete()
+        UserDreams.objects.filter(user_id__in=users).delete()
+        Users.objects.filter(id__in=users).delete()
+        EventCards.objects.filter(id=fixtures["event"]).delete()
+        SavingsCards.objects.filter(id=fixtures["savings"]).delete()
+        Dreams.objects.filter(id=fixtures["dream"]).delete()
+        # Workers that loaded the catalog during the run drop the cards
+        catalog.bump()
+
+    async def _run(self, application, users, fixtures, recorder, opts, match_ids):
+        gate = asyncio.Semaphore(opts["concurrency"])
+        size = opts["players"]
+
+        async def one(i):
+            async with gate:
+                await Match(application, recorder, opts, fixtures, users[i * size:(i + 1) * size], match_ids).play()
+
+        await asyncio.gather(*(one(i) for i in range(opts["matches"])))
+
+    def _print(self, report):
+        self.stdout.write(
+            f"{report['config']['matches']} matches on {report['database']}: "
+            f"{report['requests']} requests in {report['wallSeconds']}s ({report['rps']} req/s)"
+        )
+        self.stdout.write(f"{'endpoint':<22} {'n':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'4xx':>5} {'5xx':>5}")
+        for name, e in report["endpoints"].items():
+            self.stdout.write(
+                f"{name:<22} {e['requests']:>6} {e['rps']:>7} {e['p50Ms']:>8} {e['p95Ms']:>8} {e['p99Ms']:>8} "
+                f"{e['rejected']:>5} {e['errors']:>5}"
+            )
+        ws = report["websocket"]
+        if ws.get("frames"):
+            self.stdout.write(f"websocket: {ws['frames']} frames, delivery p50 {ws['p50Ms']} / p95 {ws['p95Ms']} / p99 {ws['p99Ms']} ms")
+
+
+class Match:
+    """One simulated match; each seat plays its own turns."""
+
+    def __init__(self, application, recorder, opts, fixtures, users, match_ids):
+        self.app = application
+        self.recorder = recorder
+        self.opts = opts
+        self.fixtures = fixtures
+        self.users = users
+        self.match_ids = match_ids  # for the teardown
+        self.prefix = "/async" if opts["use_async"] else ""
+        self.tokens = [[0, 0, 0, 0] for _ in users]
+        self.assets = [[] for _ in users]
+
+    async def call(self, endpoint, method, path, body=None):
+        raw = json.dumps(body).encode() if body is not None else b""
+        start = time.perf_counter()
+        status, content = await asgi_request(self.app, method, self.prefix + path, raw)
+        self.recorder.add(endpoint, status, time.perf_counter() - start)
+        try:
+            return status, json.loads(content) if content else None
+        except ValueError:
+            return status, None
+
+    async def play(self):
+        _, created = await self.call("create", "POST", "/matches", {"numPlayers": len(self.users)})
+        match_id = created["matchId"]
+        self.match_ids.append(match_id)
+        base = f"/matches/{match_id}"
+        for seat, user_id in enumerate(self.users):
+            await self.call("join", "POST", f"{base}/join", {"userId": user_id, "seatPosition": seat})
+        listeners = []
+        if self.opts["websockets"]:
+            listeners = [asyncio.ensure_future(self.listen(match_id)) for _ in self.users]
+            await asyncio.sleep(0)
+        try:
+            await self.call("start", "POST", f"{base}/start")
+            # Put savings past the dream threshold early so purchases can succeed
+            for user_id in self.users:
+                await self.call("cards/savings", "POST", f"{base}/cards/savings",
+                                {"userId": user_id, "cardId": self.fixtures["savings"], "amount": 500})
+            turn = 0
+            for _ in range(self.opts["turns"]):
+                turn = await self.take_turn(base, turn)
+            await self.call("state", "GET", f"{base}/state")
+            for user_id in self.users:
+                await self.call("dreams/purchase", "POST", f"{base}/dreams/purchase",
+                                {"userId": user_id, "dreamId": self.fixtures["dream"]})
+        finally:
+            for listener in listeners:
+                listener.cancel()
+            await asyncio.gather(*listeners, return_exceptions=True)
+
+    async def take_turn(self, base, seat):
+        user_id = self.users[seat]
+        tokens, assets = self.tokens[seat], self.assets[seat]
+        asset_id = choose_asset(tokens, assets)
+        if asset_id:
+            status, body = await self.call("select-asset", "POST", f"{base}/select-asset", {"userId": user_id, "assetId": asset_id})
+            if status == 200:
+                self.assets[seat] = body["assets"]
+                return body["currentTurn"]
+        status, rolled = await self.call("roll", "POST", f"{base}/roll", {"userId": user_id})
+        if status != 200:
+            return seat
+        token = choose_move(tokens, assets, rolled["sum"])
+        status, moved = await self.call("move", "POST", f"{base}/move", {"userId": user_id, "tokenIndex": token, "steps": rolled["sum"]})
+        if status != 200:
+            return seat
+        tokens[token] = moved["position"]
+        if board.is_yellow(moved["position"]):
+            await self.call("cards/draw", "POST", f"{base}/cards/draw", {"userId": user_id})
+        return moved["currentTurn"]
+
+    async def listen(self, match_id):
+        ws = WebsocketCommunicator(self.app, f"/matches/{match_id}/stream")
+        connected, _ = await ws.connect()
+        if not connected:
+            return
+        try:
+            while True:
+                message = await ws.receive_output(timeout=3600)
+                if message["type"] != "websocket.send" or "text" not in message:
+                    continue
+                self.recorder.frames += 1
+                sent = json.loads(message["text"]).get("timestamp")
+                if sent:
+                    self.recorder.delivery.append(max(0.0, time.time() - sent / 1000))
+        finally:
+            await ws.disconnect()
@@ -0,0 +1,21 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from game.layers import ChannelHub
+
+
+class Command(BaseCommand):
+    help = "Run one shard of the sharded channel layer (see CHANNEL_HUBS)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("address", help="unix:/path/to/hub.sock or tcp:host:port")
+
+    def handle(self, *args, **opts):
+        asyncio.run(self._serve(opts["address"]))
+
+    async def _serve(self, address):
+        server = await ChannelHub().serve(address)
+        self.stdout.write(f"channel hub listening on {address}")
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,24 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from game.affinity import MatchRouter
+
+
+class Command(BaseCommand):
+    help = "Route /matches/<id>/* traffic to the ASGI worker that owns each match"
+
+    def add_arguments(self, parser):
+        parser.add_argument("workers", nargs="+", help="worker addresses (host:port)")
+        parser.add_argument("--listen", default="0.0.0.0:8000", help="host:port to accept clients on")
+
+    def handle(self, *args, **opts):
+        asyncio.run(self._serve(opts["listen"], opts["workers"]))
+
+    async def _serve(self, listen, workers):
+        host, port = listen.rsplit(":", 1)
+        router = MatchRouter(workers)
+        server = await router.serve(host, int(port))
+        self.stdout.write(f"match router on {listen} -> {', '.join(workers)}")
+        async with server:
+            await server.serve_forever()
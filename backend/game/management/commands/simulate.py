@@ -0,0 +1,40 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Monte Carlo balance report for the current board rules"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--games", type=int, default=100000)
+        parser.add_argument("--players", type=int, default=4)
+        parser.add_argument("--batch-size", type=int, default=100000)
+        parser.add_argument("--workers", type=int, default=1)
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument("--dream-cost", type=int, default=1300)
+        parser.add_argument("--skip-yellow-rate", type=float, default=0.0)
+        parser.add_argument("--max-turns", type=int, default=400)
+        parser.add_argument("--json", action="store_true", help="print the raw report as JSON")
+
+    def handle(self, *args, **opts):
+        from game.simulator import Policy, simulate
+
+        policy = Policy(dream_cost=opts["dream_cost"], skip_yellow_rate=opts["skip_yellow_rate"], max_turns=opts["max_turns"])
+        began = time.perf_counter()
+        report = simulate(opts["games"], opts["players"], policy, seed=opts["seed"], batch_size=opts["batch_size"], workers=opts["workers"])
+        elapsed = time.perf_counter() - began
+        if opts["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"{report['games']} games, {report['players']} players in {elapsed:.2f}s")
+        for seat, rate in enumerate(report["winRateBySeat"]):
+            self.stdout.write(f"  seat {seat} win rate: {rate:.3f}")
+        self.stdout.write(f"  unfinished after {policy.max_turns} turns: {report['unfinishedRate']:.3f}")
+        self.stdout.write(f"  skip penalties per game: {report['skipPenaltiesPerGame']:.2f}")
+        for key in ("gameLength", "finalPoints", "finalSavings", "finalLiabilities", "assetReturnsPerPlayer"):
+            dist = report[key]
+            if dist:
+                self.stdout.write(f"  {key}: mean {dist['mean']:.1f}  p5 {dist['p5']:.0f}  p50 {dist['p50']:.0f}  p95 {dist['p95']:.0f}")
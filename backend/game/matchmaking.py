@@ -0,0 +1,219 @@
+"""Matchmaking queue.
+
+Joining only appends a ticket to an in-memory queue keyed by ``numPlayers``.
+A background thread forms matches on every tick: full groups are seated in
+queue order, and groups that have waited longer than ``BACKFILL_AFTER`` are
+topped up with CPU seats. Every room formed in a tick is written in one
+transaction, with one ``bulk_create`` for the rooms and one for their players.
+Formed rooms start straight away.
+"""
+import atexit
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from accounts.models import Users
+from cards.catalog import catalog
+from cards.decks import shuffled
+from . import actions, replay
+from .actions import ActionError
+from .engine import store, MatchState
+from .models import GameRooms, GamePlayers, MatchSnapshots
+from .timers import turn_timers
+
+logger = logging.getLogger(__name__)
+
+MATCHMAKING_INTERVAL = getattr(settings, "MATCHMAKING_INTERVAL", 0.1)  # seconds between ticks
+BACKFILL_AFTER = getattr(settings, "MATCHMAKING_BACKFILL_AFTER", 10.0)  # seconds before CPU seats fill in
+TICKET_TTL = 300  # seconds a resolved ticket stays pollable
+MIN_PLAYERS, MAX_PLAYERS = 2, 4
+
+
+class Ticket:
+    __slots__ = ("id", "user_id", "num_players", "queued_at", "status", "match_id", "seat")
+
+    def __init__(self, user_id, num_players: int):
+        self.id = str(uuid.uuid4())
+        self.user_id = str(user_id)
+        self.num_players = num_players
+        self.queued_at = time.monotonic()
+        self.status = "waiting"
+        self.match_id = None
+        self.seat = None
+
+    def to_payload(self) -> dict:
+        body = {"ticketId": self.id, "status": self.status, "numPlayers": self.num_players}
+        if self.match_id:
+            body.update(matchId=self.match_id, seat=self.seat)
+        return body
+
+
+class Matchmaker:
+    def __init__(self, interval=MATCHMAKING_INTERVAL, backfill_after=BACKFILL_AFTER):
+        self.interval = interval
+        self.backfill_after = backfill_after
+        self._queues: dict[int, deque] = {n: deque() for n in range(MIN_PLAYERS, MAX_PLAYERS + 1)}
+        self._tickets: dict[str, Ticket] = {}
+        self._by_user: dict[str, Ticket] = {}
+        self._lock = threading.Lock()
+        self._tick_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def join(self, user_id, num_players: int) -> Ticket:
+        try:
+            user_id = uuid.UUID(str(user_id))
+        except ValueError:
+            raise ActionError("user not found", 404)
+        if num_players not in self._queues:
+            raise ActionError(f"numPlayers must be between {MIN_PLAYERS} and {MAX_PLAYERS}")
+        with self._lock:
+            ticket = self._by_user.get(str(user_id))
+            if ticket is not None and ticket.status == "waiting":
+                return ticket
+            ticket = Ticket(user_id, num_players)
+            self._tickets[ticket.id] = ticket
+            self._by_user[ticket.user_id] = ticket
+            self._queues[num_players].append(ticket)
+        self._ensure_ticker()
+        return ticket
+
+    def get(self, ticket_id) -> Ticket | None:
+        return self._tickets.get(str(ticket_id))
+
+    def cancel(self, ticket_id) -> Ticket | None:
+        with self._lock:
+            ticket = self._tickets.get(str(ticket_id))
+            if ticket is not None and ticket.status == "waiting":
+                # Left in its queue; the next tick skips it
+                ticket.status = "cancelled"
+                self._release(ticket)
+            return ticket
+
+    def _release(self, ticket: Ticket):
+        # Keep resolved tickets pollable by id, but let the user queue again
+        if self._by_user.get(ticket.user_id) is ticket:
+            del self._by_user[ticket.user_id]
+
+    def clear(self):
+        with self._lock:
+            for queue in self._queues.values():
+                queue.clear()
+            self._tickets.clear()
+            self._by_user.clear()
+
+    def tick(self) -> int:
+        """Form every match that is ready; returns how many were created."""
+        with self._tick_lock:
+            groups = self._take_groups()
+            if not groups:
+                return 0
+            try:
+                return self._create(groups)
+            except Exception:
+                self._requeue(groups)
+                raise
+
+    def _requeue(self, groups: list[list[Ticket]]):
+        with self._lock:
+            for group in reversed(groups):
+                self._queues[group[0].num_players].extendleft(reversed(group))
+
+    def _take_groups(self) -> list[list[Ticket]]:
+        now = time.monotonic()
+        groups = []
+        with self._lock:
+            expired = [k for k, t in self._tickets.items() if t.status != "waiting" and now - t.queued_at > TICKET_TTL]
+            for k in expired:
+                del self._tickets[k]
+            for size, queue in self._queues.items():
+                waiting = [t for t in queue if t.status == "waiting"]
+                queue.clear()
+                while len(waiting) >= size:
+                    groups.append(waiting[:size])
+                    waiting = waiting[size:]
+                # Leftovers wait for more players unless the oldest has waited too long
+                if waiting and now - waiting[0].queued_at >= self.backfill_after:
+                    groups.append(waiting)
+                    waiting = []
+                queue.extend(waiting)
+        return groups
+
+    def _create(self, groups: list[list[Ticket]]) -> int:
+        user_ids = {t.user_id for group in groups for t in group}
+        users = Users.objects.in_bulk(list(user_ids))
+        users = {str(k): v for k, v in users.items()}
+
+        rooms, players, seated = [], [], []
+        cards = catalog.current()
+        now = timezone.now()
+        for group in groups:
+            group = [t for t in group if t.user_id in users]
+            if not group:
+                continue
+            size = group[0].num_players
+            room = actions.new_room(size)
+            room.status, room.started_at = "active", now
+            room.event_deck = shuffled(cards)
+            rooms.append(room)
+            for seat in range(size):
+                ticket = group[seat] if seat < len(group) else None
+                user = users[ticket.user_id] if ticket else None
+                players.append(actions.new_player(room.id, user, seat, ticket is None))
+            seated.append((room, group))
+
+        by_room = {}
+        for player in players:
+            by_room.setdefault(player.room_id, []).append(player)
+        states = {room.id: MatchState.from_models(room, by_room[room.id]) for room in rooms}
+        with transaction.atomic():
+            GameRooms.objects.bulk_create(rooms)
+            GamePlayers.objects.bulk_create(players)
+            # Formed rooms skip the start action, so replay starts from this baseline
+            MatchSnapshots.objects.bulk_create([replay.snapshot_row(state) for state in states.values()])
+        with self._lock:
+            for group in groups:
+                for ticket in group:
+                    if ticket.user_id not in users:
+                        ticket.status = "invalid"
+                        self._release(ticket)
+            for room, group in seated:
+                turn_timers.watch(store.put(states[room.id]))
+                for seat, ticket in enumerate(group):
+                    ticket.status, ticket.match_id, ticket.seat = "matched", str(room.id), seat
+                    self._release(ticket)
+        return len(rooms)
+
+    def _ensure_ticker(self):
+        if self.interval is None:
+            # Background ticking disabled (tests); callers tick explicitly
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="matchmaker", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("matchmaking tick failed")
+            finally:
+                close_old_connections()
+
+    def shutdown(self):
+        self._stopped.set()
+
+
+matchmaker = Matchmaker()
+atexit.register(matchmaker.shutdown)
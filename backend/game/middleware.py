@@ -0,0 +1,25 @@
+"""Passes the match router's ring epoch (``affinity``) on to the match store."""
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from .affinity import EPOCH_HEADER
+from .engine import store
+
+
+def _observe(request):
+    epoch = request.headers.get(EPOCH_HEADER)
+    if epoch is not None:
+        store.observe_ring(epoch)
+
+
+@sync_and_async_middleware
+def ring_epoch_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            _observe(request)
+            return await get_response(request)
+    else:
+        def middleware(request):
+            _observe(request)
+            return get_response(request)
+    return middleware
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamerooms',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
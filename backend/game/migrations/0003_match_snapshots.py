@@ -0,0 +1,46 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_initial'),
+        ('game', '0002_gamerooms_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchSnapshots',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, serialize=False)),
+                ('turn', models.IntegerField()),
+                ('state', models.JSONField()),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'match_snapshots',
+                'managed': True,
+            },
+        ),
+        migrations.AddField(
+            model_name='gamerooms',
+            name='state_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='gamelogs',
+            index=models.Index(fields=['room', 'turn'], name='idx_logs_room_turn'),
+        ),
+        migrations.AddField(
+            model_name='matchsnapshots',
+            name='room',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='game.gamerooms'),
+        ),
+        migrations.AddIndex(
+            model_name='matchsnapshots',
+            index=models.Index(fields=['room', 'turn'], name='idx_snapshots_room_turn'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_initial'),
+        ('dreams', '0001_initial'),
+        ('game', '0003_match_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMatches',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, serialize=False)),
+                ('dream_id', models.UUIDField(blank=True, null=True)),
+                ('winner_id', models.UUIDField(blank=True, db_index=True, null=True)),
+                ('player_count', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('ended_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('state_version', models.IntegerField(default=0)),
+                ('players', models.JSONField()),
+                ('log', models.JSONField()),
+                ('archived_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'archived_matches',
+                'managed': True,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='gamerooms',
+            index=models.Index(fields=['status', 'ended_at'], name='idx_rooms_status_ended'),
+        ),
+    ]
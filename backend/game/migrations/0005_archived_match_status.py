@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0004_archived_matches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedmatches',
+            name='status',
+            field=models.TextField(default='ended'),
+        ),
+    ]
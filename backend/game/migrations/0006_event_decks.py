@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0005_archived_match_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamerooms',
+            name='event_deck',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='gamerooms',
+            name='event_deck_pos',
+            field=models.IntegerField(default=0),
+        ),
+    ]
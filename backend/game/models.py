@@ -12,6 +12,7 @@ class GameLogs(models.Model):
     class Meta:
         managed = True
         db_table = 'game_logs'
+        indexes = [models.Index(fields=['room', 'turn'], name='idx_logs_room_turn')]
 
 
 class GamePlayers(models.Model):
@@ -46,8 +47,54 @@ class GameRooms(models.Model):
     winner = models.ForeignKey('accounts.Users', models.DO_NOTHING, blank=True, null=True)
     player_count = models.IntegerField(blank=True, null=True)
     current_turn = models.IntegerField(blank=True, null=True, default=0)
+    # Bumped by every turn change; writers compare-and-swap on it instead of locking the row
+    version = models.IntegerField(default=0)
+    # Match state version (state_update numbering) of the persisted player rows
+    state_version = models.IntegerField(default=0)
+    # Shuffled event card ids dealt at start, and how many have been drawn
+    event_deck = models.JSONField(blank=True, null=True)
+    event_deck_pos = models.IntegerField(default=0)
 
     class Meta:
         managed = True
         db_table = 'game_rooms'
+        # The archiver scans for ended rooms past a cutoff
+        indexes = [models.Index(fields=['status', 'ended_at'], name='idx_rooms_status_ended')]
 
+
+class MatchSnapshots(models.Model):
+    id = models.UUIDField(primary_key=True)
+    room = models.ForeignKey('GameRooms', models.DO_NOTHING)
+    turn = models.IntegerField()
+    state = models.JSONField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        managed = True
+        db_table = 'match_snapshots'
+        indexes = [models.Index(fields=['room', 'turn'], name='idx_snapshots_room_turn')]
+
+
+class ArchivedMatches(models.Model):
+    """A finished match moved out of the live tables (see ``game.archive``).
+
+    One row per match: the room columns, every player row packed into
+    ``players``, and the action log packed into ``log`` so the match can still
+    be replayed. References are kept as plain ids, with no foreign keys.
+    """
+    id = models.UUIDField(primary_key=True)
+    status = models.TextField(default="ended")  # "ended" or "abandoned"
+    dream_id = models.UUIDField(blank=True, null=True)
+    winner_id = models.UUIDField(blank=True, null=True, db_index=True)
+    player_count = models.IntegerField(blank=True, null=True)
+    created_at = models.DateTimeField(blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    ended_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    state_version = models.IntegerField(default=0)
+    players = models.JSONField()
+    log = models.JSONField()
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        managed = True
+        db_table = 'archived_matches'
@@ -0,0 +1,203 @@
+"""Headless Monte Carlo simulator for PesaMali balancing.
+
+Plays many matches at once with NumPy: every array is indexed by game first,
+and each step advances the seat whose turn it is in every unfinished game. The
+move rules come straight from ``game.board`` (yellow priority, skip penalty,
+asset return windows, ``ASSET_PROFIT``), so a change to the live tables is a
+change to the simulation.
+
+The parts of a match that clients decide (when to buy, save or pay down
+liabilities, what an event card is worth) are modelled by ``Policy``.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+
+import numpy as np
+
+from . import board
+
+YELLOW = np.frombuffer(board.YELLOW, dtype=np.uint8).astype(bool)
+PROFITS = np.array(sorted(board.ASSET_PROFIT.values()), dtype=np.int64)
+TOKENS = 4
+ASSET_SLOTS = 2
+NO_ASSET = -1
+
+
+@dataclass
+class Policy:
+    starting_points: int = 1200
+    dream_cost: int = 1300
+    savings_goal: int = 500
+    save_amount: int = 100  # saved on a yellow landing until the goal, once liabilities are clear
+    asset_cost: int = 0  # select_asset does not charge today
+    skip_yellow_rate: float = 0.0  # chance a player ignores a yellow landing
+    event_effects: tuple = (-100, -50, 50, 100)  # event card values, drawn uniformly
+    max_turns: int = 400  # per game, across all seats
+
+
+def _slot(pos):
+    # Only yellow spots are looked up; none lie past the table
+    return np.minimum(pos, board.LAST)
+
+
+def phase_of(pos):
+    """``board.phase_of`` over arrays; tokens are not capped, so no table is used."""
+    return (np.maximum(pos, 1) - 1) // board.SPOTS_PER_PHASE + 1
+
+
+def is_return_tile(purchase_spot, pos):
+    """``board.is_return_tile`` over arrays (odd tiles of the next phase)."""
+    return (pos % 2 == 1) & (phase_of(pos) == phase_of(purchase_spot) + 1)
+
+
+def play_batch(games: int, players: int, policy: Policy, seed=None) -> dict:
+    """Play ``games`` matches of ``players`` seats; returns raw per-game arrays."""
+    rng = np.random.default_rng(seed)
+    g = np.arange(games)
+    effects = np.array(policy.event_effects, dtype=np.int64)
+
+    tokens = np.zeros((games, players, TOKENS), dtype=np.int64)
+    points = np.full((games, players), policy.starting_points, dtype=np.int64)
+    savings = np.zeros((games, players), dtype=np.int64)
+    liabilities = np.zeros((games, players), dtype=np.int64)
+    asset_spot = np.full((games, players, ASSET_SLOTS), NO_ASSET, dtype=np.int64)
+    asset_profit = np.zeros((games, players, ASSET_SLOTS), dtype=np.int64)
+    returns = np.zeros((games, players, ASSET_SLOTS), dtype=np.int64)
+    penalties = np.zeros(games, dtype=np.int64)
+
+    winner = np.full(games, -1, dtype=np.int64)
+    length = np.full(games, policy.max_turns, dtype=np.int64)
+    live = np.ones(games, dtype=bool)
+
+    for turn in range(policy.max_turns):
+        if not live.any():
+            break
+        seat = turn % players
+        pos = tokens[:, seat]
+        furthest = pos.max(axis=1)
+        spots = asset_spot[:, seat]
+        owned = (spots != NO_ASSET).sum(axis=1)
+
+        # Buying an asset is the whole turn. First asset not before spot 10;
+        # the second once the first has paid out or all tokens left its window.
+        first_done = (returns[:, seat, 0] >= board.MAX_RETURNS) | (
+            phase_of(pos.min(axis=1)) > phase_of(spots[:, 0]) + 1
+        )
+        buy = live & (furthest > board.SPOTS_PER_PHASE) & ((owned == 0) | ((owned == 1) & first_done))
+        if buy.any():
+            slot = owned[buy]
+            asset_spot[buy, seat, slot] = furthest[buy]
+            asset_profit[buy, seat, slot] = rng.choice(PROFITS, size=int(buy.sum()))
+            points[buy, seat] -= policy.asset_cost
+
+        movers = live & ~buy
+        dice = rng.integers(1, 7, size=(games, 2)).sum(axis=1)
+        targets = pos + dice[:, None]
+        lands = YELLOW[_slot(targets)]
+        any_yellow = lands.any(axis=1)
+        # Yellow priority: take the first yellow landing, otherwise a random token
+        choice = np.where(any_yellow, lands.argmax(axis=1), rng.integers(0, TOKENS, size=games))
+        skip = any_yellow & (rng.random(games) < policy.skip_yellow_rate) & ~lands.all(axis=1)
+        if skip.any():
+            choice[skip] = (~lands[skip]).argmax(axis=1)
+        new_pos = targets[g, choice]
+        tokens[movers, seat, choice[movers]] = new_pos[movers]
+
+        skipped = movers & skip
+        liabilities[skipped, seat] += board.SKIP_PENALTY
+        penalties += skipped
+
+        # Asset returns on the landing tile
+        paying = (
+            movers[:, None]
+            & (spots != NO_ASSET)
+            & (returns[:, seat] < board.MAX_RETURNS)
+            & is_return_tile(spots, new_pos[:, None])
+        )
+        points[:, seat] += (asset_profit[:, seat] * paying).sum(axis=1)
+        returns[:, seat] += paying
+
+        # Yellow landing: event card, then pay down liabilities or save
+        yellow = movers & YELLOW[_slot(new_pos)]
+        effect = np.where(yellow, rng.choice(effects, size=games), 0)
+        points[:, seat] += np.maximum(effect, 0)
+        liabilities[:, seat] += np.maximum(-effect, 0)
+        pay = np.where(yellow, np.minimum(liabilities[:, seat], points[:, seat]), 0)
+        points[:, seat] -= pay
+        liabilities[:, seat] -= pay
+        save = (
+            yellow
+            & (liabilities[:, seat] == 0)
+            & (savings[:, seat] < policy.savings_goal)
+            & (points[:, seat] >= policy.save_amount)
+        )
+        points[save, seat] -= policy.save_amount
+        savings[save, seat] += policy.save_amount
+
+        won = (
+            live
+            & ((asset_spot[:, seat] != NO_ASSET).sum(axis=1) == ASSET_SLOTS)
+            & (liabilities[:, seat] == 0)
+            & (savings[:, seat] >= policy.savings_goal)
+            & (points[:, seat] >= policy.dream_cost)
+        )
+        winner[won] = seat
+        length[won] = turn + 1
+        live &= ~won
+
+    return {
+        "winner": winner,
+        "length": length,
+        "points": points,
+        "savings": savings,
+        "liabilities": liabilities,
+        "returns": returns.sum(axis=2),
+        "penalties": penalties,
+    }
+
+
+def _play_chunk(args):
+    games, players, policy, seed = args
+    return play_batch(games, players, policy, seed)
+
+
+def simulate(games: int, players: int = 4, policy: Policy | None = None, seed=None, batch_size: int = 100000, workers: int = 1) -> dict:
+    """Play ``games`` matches in batches, optionally across a process pool."""
+    policy = policy or Policy()
+    sizes = [batch_size] * (games // batch_size)
+    if games % batch_size:
+        sizes.append(games % batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(n, players, policy, s) for n, s in zip(sizes, seeds)]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_play_chunk, jobs))
+    else:
+        parts = [_play_chunk(job) for job in jobs]
+    raw = {key: np.concatenate([p[key] for p in parts]) for key in parts[0]}
+    return summarize(raw, players, policy)
+
+
+def _percentiles(values) -> dict:
+    if values.size == 0:
+        return {}
+    p = np.percentile(values, [5, 25, 50, 75, 95])
+    return {"mean": float(values.mean()), "p5": float(p[0]), "p25": float(p[1]), "p50": float(p[2]), "p75": float(p[3]), "p95": float(p[4])}
+
+
+def summarize(raw: dict, players: int, policy: Policy) -> dict:
+    games = raw["winner"].size
+    finished = raw["winner"] >= 0
+    return {
+        "games": games,
+        "players": players,
+        "policy": asdict(policy),
+        "winRateBySeat": [float((raw["winner"] == s).mean()) for s in range(players)],
+        "unfinishedRate": float((~finished).mean()),
+        "gameLength": _percentiles(raw["length"][finished]),
+        "finalPoints": _percentiles(raw["points"].ravel()),
+        "finalSavings": _percentiles(raw["savings"].ravel()),
+        "finalLiabilities": _percentiles(raw["liabilities"].ravel()),
+        "assetReturnsPerPlayer": _percentiles(raw["returns"].ravel()),
+        "skipPenaltiesPerGame": float(raw["penalties"].mean()),
+    }
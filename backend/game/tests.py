@@ -1,3 +1,718 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import random
+import time
+import uuid
+from datetime import timedelta
+from functools import partial
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import Users
+from cards.catalog import catalog
+from dreams.models import Dreams
+from . import actions, archive, board, replay, wire
+from .actors import actors
+from .affinity import HashRing, MatchRouter
+from .broadcast import MatchBroadcast
+from .consumers import MatchStreamConsumer
+from .cpu import cpu_players, choose_move
+from .engine import store
+from .gamelog import game_log
+from .idempotency import responses
+from .layers import LocalHubs, ShardedChannelLayer
+from .management.commands.bench_affinity import request as http_request
+from .matchmaking import matchmaker
+from .models import ArchivedMatches, GameRooms, GamePlayers, GameLogs
+from .timers import TimingWheel, turn_timers
+
+
+class MatchTestCase(TestCase):
+    def setUp(self):
+        store.clear()
+        self._interval = store.flush_interval
+        store.flush_interval = None  # flush explicitly inside the test transaction
+        self._log_interval = game_log.flush_interval
+        game_log.flush_interval = None
+        self._cpu_workers = cpu_players.workers
+        cpu_players.workers = None  # CPU seats play inline
+        self._mm_interval = matchmaker.interval
+        matchmaker.interval = None
+        self._timer_interval = turn_timers.interval
+        turn_timers.interval = None
+        turn_timers.clear()
+        catalog.clear()  # card tables are rolled back between tests
+        responses.clear()
+        actors.clear()
+        self.client = APIClient()
+        self.alice = Users.objects.create(username="alice", password_hash="x")
+        self.bob = Users.objects.create(username="bob", password_hash="x", email="bob@example.com")
+
+    def tearDown(self):
+        store.clear()
+        store.flush_interval = self._interval
+        game_log._entries.clear()
+        game_log.flush_interval = self._log_interval
+        cpu_players.workers = self._cpu_workers
+        matchmaker.interval = self._mm_interval
+        matchmaker.clear()
+        turn_timers.interval = self._timer_interval
+        turn_timers.clear()
+        responses.clear()
+
+    def start_match(self):
+        match_id = self.client.post("/matches", {"numPlayers": 2}, format="json").data["matchId"]
+        self.client.post(f"/matches/{match_id}/join", {"userId": str(self.alice.id), "seatPosition": 0}, format="json")
+        self.client.post(f"/matches/{match_id}/join", {"userId": str(self.bob.id), "seatPosition": 1}, format="json")
+        self.client.post(f"/matches/{match_id}/start")
+        return match_id
+
+
+class EngineTest(MatchTestCase):
+    def test_move_is_written_behind(self):
+        match_id = self.start_match()
+        res = self.client.post(f"/matches/{match_id}/move", {"userId": str(self.alice.id), "tokenIndex": 0, "steps": 3}, format="json")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["currentTurn"], 1)
+
+        # Player state is not persisted until the flusher runs
+        self.assertEqual(GamePlayers.objects.get(room_id=match_id, user=self.alice).tokens, [0, 0, 0, 0])
+        store.flush()
+        self.assertEqual(GamePlayers.objects.get(room_id=match_id, user=self.alice).tokens, [3, 0, 0, 0])
+
+    def test_state_rebuilt_on_cache_miss(self):
+        match_id = self.start_match()
+        self.client.post(f"/matches/{match_id}/move", {"userId": str(self.alice.id), "tokenIndex": 1, "steps": 5}, format="json")
+        store.flush()
+        store.clear()
+        state = self.client.get(f"/matches/{match_id}/state").data
+        self.assertEqual(state["currentTurn"], 1)
+        self.assertEqual(state["players"][0]["tokens"], [0, 5, 0, 0])
+
+    def test_ring_change_rechecks_cached_match(self):
+        match_id = self.start_match()
+        self.client.post(f"/matches/{match_id}/move", {"userId": str(self.alice.id), "tokenIndex": 0, "steps": 3}, format="json")
+        store.flush()
+        self.assertEqual(self.client.get(f"/matches/{match_id}/state", HTTP_X_MATCH_RING_EPOCH="1").data["currentTurn"], 1)
+
+        # While the match was routed elsewhere, another worker played bob's turn
+        GameRooms.objects.filter(id=match_id).update(current_turn=0, version=F("version") + 1, state_version=F("state_version") + 1)
+        self.assertEqual(self.client.get(f"/matches/{match_id}/state", HTTP_X_MATCH_RING_EPOCH="1").data["currentTurn"], 1)
+        self.assertEqual(self.client.get(f"/matches/{match_id}/state", HTTP_X_MATCH_RING_EPOCH="2").data["currentTurn"], 0)
+
+    def test_state_update_carries_only_changes(self):
+        match_id = self.start_match()
+        state = store.get(match_id)
+        version = state.version
+        with state.lock:
+            state.players[0].tokens[2] = 9
+            state.advance_turn()
+            delta = state.publish()
+            self.assertIsNone(state.publish())
+        self.assertEqual(delta["baseVersion"], version)
+        self.assertEqual(delta["version"], version + 1)
+        self.assertEqual(delta["currentTurn"], 1)
+        self.assertEqual(delta["players"], [{"seat": 0, "tokens": [0, 0, 9, 0]}])
+
+    def test_move_events_coalesced_into_one_frame(self):
+        match_id = self.start_match()
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f"match_{match_id}", channel)
+        self.client.post(f"/matches/{match_id}/move", {"userId": str(self.alice.id), "tokenIndex": 0, "steps": 3}, format="json")
+        message = async_to_sync(layer.receive)(channel)
+        self.assertEqual([json.loads(t)["type"] for t in message["texts"]], ["move_event", "state_update", "turn_change"])
+        self.assertEqual(wire.decode(wire.frame(message), match_id), [json.loads(t) for t in message["texts"]])
+
+    def test_turn_change_is_compare_and_swap(self):
+        match_id = self.start_match()
+        store.flush()
+        room = GameRooms.objects.get(id=match_id)
+        self.assertEqual((room.status, room.current_turn, room.version), ("active", 0, 1))
+
+        # Another worker advances the match behind this worker's cache
+        GameRooms.objects.filter(id=match_id).update(version=2)
+        move = {"userId": str(self.alice.id), "tokenIndex": 0, "steps": 3}
+        res = self.client.post(f"/matches/{match_id}/move", move, format="json")
+        self.assertEqual(res.status_code, 409)
+        self.assertTrue(res.data["retryable"])
+
+        # The retry reloads the match and wins the next version
+        res = self.client.post(f"/matches/{match_id}/move", move, format="json")
+        self.assertEqual(res.status_code, 200)
+        room.refresh_from_db()
+        self.assertEqual((room.current_turn, room.version), (1, 3))
+
+    def test_actions_are_logged_off_the_request_path(self):
+        match_id = self.start_match()
+        self.client.post(f"/matches/{match_id}/roll", {"userId": str(self.alice.id)}, format="json")
+        self.client.post(f"/matches/{match_id}/move", {"userId": str(self.alice.id), "tokenIndex": 0, "steps": 3}, format="json")
+        self.assertFalse(GameLogs.objects.exists())
+        game_log.flush()
+        logs = list(GameLogs.objects.filter(room_id=match_id).order_by("turn", "timestamp"))
+        self.assertEqual([log.action for log in logs], ["start", "roll", "move"])
+        self.assertEqual(logs[-1].payload["delta"]["players"], [{"tokens": [3, 0, 0, 0], "seat": 0}])
+
+    def test_failed_log_batch_is_retried(self):
+        match_id = self.start_match()
+        self.client.post(f"/matches/{match_id}/roll", {"userId": str(self.alice.id)}, format="json")
+        with mock.patch.object(GameLogs.objects, "bulk_create", side_effect=RuntimeError("db down")):
+            game_log.flush()
+        self.assertEqual(len(game_log), 2)
+        game_log.flush()
+        self.assertEqual(len(game_log), 0)
+        self.assertEqual([log.action for log in GameLogs.objects.filter(room_id=match_id).order_by("timestamp")], ["start", "roll"])
+
+    def test_out_of_turn_move_rejected(self):
+        match_id = self.start_match()
+        res = self.client.post(f"/matches/{match_id}/move", {"userId": str(self.bob.id), "tokenIndex": 0, "steps": 3}, format="json")
+        self.assertEqual(res.status_code, 403)
+
+    def test_flush_waits_for_a_won_claim_to_be_applied(self):
+        match_id = self.start_match()
+        store.flush()
+        state = store.get(match_id)
+        with state.lock:
+            state.claims_pending += 1  # CAS won, move not applied yet
+            state.current_turn = 1
+            state.room_dirty = True
+        store.mark_dirty(state)
+        store.flush()
+        self.assertEqual(GameRooms.objects.get(id=match_id).current_turn, 0)
+        with state.lock:
+            state.claims_pending -= 1
+        store.flush()
+        self.assertEqual(GameRooms.objects.get(id=match_id).current_turn, 1)
+
+
+class ConditionalStateTest(MatchTestCase):
+    def test_unchanged_state_is_not_modified(self):
+        match_id = self.start_match()
+        res = self.client.get(f"/matches/{match_id}/state")
+        etag = res["ETag"]
+        self.assertEqual(etag, '"%s.2"' % res.data["version"])
+        with self.assertNumQueries(0):
+            res = self.client.get(f"/matches/{match_id}/state", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+
+        self.client.post(f"/matches/{match_id}/move", {"userId": str(self.alice.id), "tokenIndex": 0, "steps": 3}, format="json")
+        res = self.client.get(f"/matches/{match_id}/state?waitFor=0", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res["ETag"], etag)
+
+    async def test_long_poll_wakes_on_next_version(self):
+        match_id = await sync_to_async(self.start_match)()
+        version = (await self.async_client.get(f"/async/matches/{match_id}/state")).json()["version"]
+        poll = asyncio.ensure_future(self.async_client.get(f"/async/matches/{match_id}/state?waitFor={version + 1}"))
+        await asyncio.sleep(0.05)
+        self.assertFalse(poll.done())
+        await self.async_client.post(
+            f"/async/matches/{match_id}/move",
+            {"userId": str(self.alice.id), "tokenIndex": 0, "steps": 3},
+            content_type="application/json",
+        )
+        res = await asyncio.wait_for(poll, 5)
+        self.assertEqual(res.json()["version"], version + 1)
+
+
+class IdempotencyTest(MatchTestCase):
+    def test_retried_move_replays_stored_response(self):
+        match_id = self.start_match()
+        body = {"userId": str(self.alice.id), "tokenIndex": 0, "steps": 3}
+        first = self.client.post(f"/matches/{match_id}/move", body, format="json", HTTP_IDEMPOTENCY_KEY="k1")
+        with self.assertNumQueries(0):
+            retry = self.client.post(f"/matches/{match_id}/move", body, format="json", HTTP_IDEMPOTENCY_KEY="k1")
+        self.assertEqual((retry.status_code, retry.data), (first.status_code, first.data))
+        self.assertEqual(self.client.get(f"/matches/{match_id}/state").data["players"][0]["tokens"], [3, 0, 0, 0])
+
+        # The key is scoped to the user and route: bob's k1 is a new command
+        res = self.client.post(f"/matches/{match_id}/move", {**body, "userId": str(self.bob.id)}, format="json", HTTP_IDEMPOTENCY_KEY="k1")
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.data, first.data)
+        self.assertEqual(self.client.get(f"/matches/{match_id}/state").data["players"][1]["tokens"], [3, 0, 0, 0])
+
+    def test_retried_join_takes_one_seat(self):
+        match_id = self.client.post("/matches", {"numPlayers": 2}, format="json").data["matchId"]
+        body = {"userId": str(self.alice.id), "seatPosition": 0}
+        for _ in range(2):
+            res = self.client.post(f"/matches/{match_id}/join", body, format="json", HTTP_IDEMPOTENCY_KEY="j1")
+            self.assertEqual(res.status_code, 200)
+        self.assertEqual(GamePlayers.objects.filter(room_id=match_id).count(), 1)
+
+
+class CpuPlayerTest(MatchTestCase):
+    def test_cpu_seat_plays_after_human_turn(self):
+        match_id = self.client.post("/matches", {"numPlayers": 2}, format="json").data["matchId"]
+        self.client.post(f"/matches/{match_id}/join", {"userId": str(self.alice.id), "seatPosition": 0}, format="json")
+        self.client.post(f"/matches/{match_id}/join", {"isAi": True, "seatPosition": 1}, format="json")
+        self.client.post(f"/matches/{match_id}/start")
+        res = self.client.post(f"/matches/{match_id}/move", {"userId": str(self.alice.id), "tokenIndex": 0, "steps": 3}, format="json")
+        self.assertEqual(res.data["currentTurn"], 1)
+
+        state = self.client.get(f"/matches/{match_id}/state").data
+        self.assertEqual(state["currentTurn"], 0)
+        self.assertGreater(sum(state["players"][1]["tokens"]), 0)
+        self.assertGreaterEqual(cpu_players.stats()["turns"], 1)
+
+    def test_cpu_prefers_penalty_free_landing(self):
+        # 3 + 2 = 5 is yellow; every other token would skip it
+        self.assertEqual(choose_move([3, 6, 12, 40], [], 2), 0)
+
+
+class MatchmakingTest(MatchTestCase):
+    def test_full_group_seated_in_queue_order(self):
+        a = self.client.post("/matchmaking", {"userId": str(self.alice.id), "numPlayers": 2}, format="json").data
+        b = self.client.post("/matchmaking", {"userId": str(self.bob.id), "numPlayers": 2}, format="json").data
+        self.assertEqual(a["status"], "waiting")
+        self.assertEqual(matchmaker.tick(), 1)
+
+        ticket = self.client.get(f"/matchmaking/{a['ticketId']}").data
+        self.assertEqual((ticket["status"], ticket["seat"]), ("matched", 0))
+        self.assertEqual(self.client.get(f"/matchmaking/{b['ticketId']}").data["seat"], 1)
+        room = GameRooms.objects.get(id=ticket["matchId"])
+        self.assertEqual(room.status, "active")
+        self.assertEqual(GamePlayers.objects.filter(room=room).count(), 2)
+
+    def test_stale_group_backfilled_with_cpu(self):
+        ticket = self.client.post("/matchmaking", {"userId": str(self.alice.id), "numPlayers": 3}, format="json").data
+        self.assertEqual(matchmaker.tick(), 0)
+        with mock.patch.object(matchmaker, "backfill_after", 0):
+            self.assertEqual(matchmaker.tick(), 1)
+        state = self.client.get(f"/matches/{matchmaker.get(ticket['ticketId']).match_id}/state").data
+        self.assertEqual([p["isAi"] for p in state["players"]], [False, True, True])
+
+
+class ReplayTest(MatchTestCase):
+    def play(self, match_id, moves):
+        users = [self.alice, self.bob]
+        for i, steps in enumerate(moves):
+            self.client.post(f"/matches/{match_id}/move", {"userId": str(users[i % 2].id), "tokenIndex": 0, "steps": steps}, format="json")
+
+    def test_replay_upto_version(self):
+        match_id = self.start_match()
+        self.play(match_id, [3, 2, 4])
+        version_after_two = store.get(match_id).version - 1
+        res = self.client.get(f"/matches/{match_id}/replay", {"upto": version_after_two})
+        self.assertEqual(res.data["version"], version_after_two)
+        self.assertEqual([p["tokens"][0] for p in res.data["state"]["players"]], [3, 2])
+
+    def test_replay_starts_from_latest_snapshot(self):
+        match_id = self.start_match()
+        state = store.get(match_id)
+        with mock.patch.object(replay, "SNAPSHOT_EVERY", 2):
+            self.play(match_id, [3, 2])
+            store.flush()
+        self.play(match_id, [4])
+        game_log.flush()
+        payload, version, entries = replay.rebuild(match_id)
+        self.assertEqual(version, state.version)
+        self.assertEqual([e.action for e in entries], ["move"])
+        self.assertEqual([p["tokens"][0] for p in payload["players"]], [7, 2])
+
+    def test_replay_has_full_players_when_started_after_a_reload(self):
+        match_id = self.client.post("/matches", {"numPlayers": 2}, format="json").data["matchId"]
+        self.client.post(f"/matches/{match_id}/join", {"userId": str(self.alice.id), "seatPosition": 0}, format="json")
+        self.client.post(f"/matches/{match_id}/join", {"userId": str(self.bob.id), "seatPosition": 1}, format="json")
+        store.clear()
+        self.client.post(f"/matches/{match_id}/start")
+        self.play(match_id, [3])
+        game_log.flush()
+        payload, _, _ = replay.rebuild(match_id)
+        self.assertEqual([(p["userId"], p["savings"]) for p in payload["players"]], [(str(self.alice.id), 0), (str(self.bob.id), 0)])
+
+    def test_matchmade_room_replays_from_its_baseline(self):
+        self.client.post("/matchmaking", {"userId": str(self.alice.id), "numPlayers": 2}, format="json")
+        ticket = self.client.post("/matchmaking", {"userId": str(self.bob.id), "numPlayers": 2}, format="json").data
+        matchmaker.tick()
+        match_id = matchmaker.get(ticket["ticketId"]).match_id
+        self.play(match_id, [3, 2])
+        game_log.flush()
+        store.clear()  # worker died before the write-behind flush
+        payload, version, _ = replay.rebuild(match_id)
+        self.assertEqual(payload["status"], "active")
+        self.assertEqual([(p["userId"], p["tokens"][0], p["currentPoints"]) for p in payload["players"]],
+                         [(str(self.alice.id), 3, 1200), (str(self.bob.id), 2, 1200)])
+        self.assertEqual([p.tokens[0] for p in store.get(match_id).players], [3, 2])
+
+    def test_unflushed_turns_recovered_from_log(self):
+        match_id = self.start_match()
+        store.flush()
+        self.play(match_id, [3, 2])
+        game_log.flush()
+        store.clear()  # worker died before the write-behind flush
+        state = store.get(match_id)
+        self.assertEqual([p.tokens[0] for p in state.players], [3, 2])
+
+
+class TurnTimerTest(MatchTestCase):
+    def test_wheel_fires_in_deadline_order_across_levels(self):
+        wheel = TimingWheel(bits=2, levels=3, now=5)
+        deadlines = {i: random.randint(6, 200) for i in range(300)}
+        for key, deadline in deadlines.items():
+            wheel.schedule(key, deadline)
+        wheel.cancel(0)
+        wheel.schedule(1, 7)
+        deadlines.pop(0)
+        deadlines[1] = 7
+        fired = []
+        for tick in range(6, 201):
+            due = wheel.advance(tick)
+            self.assertTrue(all(deadlines[k] == tick for k in due))
+            fired.extend(due)
+        self.assertEqual(sorted(fired), sorted(deadlines))
+        self.assertEqual(len(wheel), 0)
+
+    def test_idle_turns_time_out_then_abandon(self):
+        match_id = self.start_match()
+        state = store.get(match_id)
+        self.assertIn(state.id, turn_timers.wheel)
+        with mock.patch.multiple(turn_timers, action="skip", abandon_after=2):
+            now = time.monotonic() + 1
+            turn_timers.run_due(now)
+            self.assertEqual(state.current_turn, 0)  # not overdue yet
+            for expected in (1, 0):
+                now += turn_timers.timeout + 1
+                turn_timers.run_due(now)
+                self.assertEqual(state.current_turn, expected)
+            turn_timers.run_due(now + turn_timers.timeout + 1)
+        self.assertEqual(state.status, "abandoned")
+        self.assertIsNone(store.peek(match_id))
+        self.assertEqual(GameRooms.objects.get(id=match_id).status, "abandoned")
+        self.assertEqual(archive.archive_ended(timezone.now()), 1)
+        self.assertEqual(ArchivedMatches.objects.get(id=match_id).status, "abandoned")
+
+    def test_sweep_expires_matches_left_over_from_a_restart(self):
+        match_id = self.start_match()
+        store.flush()
+        game_log.flush()
+        # A new process: nothing cached or watched, and the turn began long ago
+        store.clear()
+        turn_timers.clear()
+        GameLogs.objects.filter(room_id=match_id).update(timestamp=timezone.now() - timedelta(seconds=turn_timers.timeout * 2))
+        self.assertEqual(turn_timers.sweep(), 1)
+        self.assertIsNone(store.peek(match_id))
+        with mock.patch.object(turn_timers, "action", "skip"):
+            turn_timers.run_due(time.monotonic() + 1)
+        self.assertEqual(store.peek(match_id).current_turn, 1)
+        self.assertEqual(turn_timers.sweep(), 0)
+
+
+class ArchiveTest(MatchTestCase):
+    def test_archiver_moves_ended_match(self):
+        match_id = self.start_match()
+        _, out = actions.abandon(store.get(match_id))
+        out.send()
+        store.flush()
+        game_log.flush()
+        room = GameRooms.objects.get(id=match_id)
+        self.assertEqual(room.status, "abandoned")
+
+        self.assertEqual(archive.archive_ended(room.ended_at), 0)
+        self.assertEqual(archive.archive_ended(timezone.now(), chunk_size=1), 1)
+        self.assertFalse(GameRooms.objects.filter(id=match_id).exists())
+        self.assertFalse(GamePlayers.objects.filter(room_id=match_id).exists())
+        archived = ArchivedMatches.objects.get(id=match_id)
+        self.assertEqual([p["seat"] for p in archived.players], [0, 1])
+        self.assertEqual(archived.log[-1]["action"], "abandon")
+
+
+class AsyncViewsTest(MatchTestCase):
+    async def test_async_move_matches_sync_contract(self):
+        match_id = await sync_to_async(self.start_match)()
+        res = await self.async_client.post(
+            f"/async/matches/{match_id}/move",
+            {"userId": str(self.alice.id), "tokenIndex": 0, "steps": 3},
+            content_type="application/json",
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["currentTurn"], 1)
+        res = await self.async_client.get(f"/async/matches/{match_id}/state")
+        self.assertEqual(res.json()["players"][0]["tokens"], [3, 0, 0, 0])
+
+    async def test_commands_for_one_match_run_in_order(self):
+        match_id = await sync_to_async(self.start_match)()
+        moves = [
+            self.async_client.post(
+                f"/async/matches/{match_id}/move",
+                {"userId": str(user.id), "tokenIndex": 0, "steps": 3},
+                content_type="application/json",
+            )
+            for user in (self.alice, self.bob)
+        ]
+        with mock.patch.object(actors, "idle_timeout", 0.01):
+            results = await asyncio.gather(*moves)
+            self.assertEqual([r.status_code for r in results], [200, 200])
+            self.assertEqual(results[1].json()["currentTurn"], 0)
+            await asyncio.sleep(0.05)
+        self.assertEqual(len(actors), 0)
+
+    async def test_stream_connect_pushes_state(self):
+        match_id = await sync_to_async(self.start_match)()
+        await sync_to_async(store.flush)()
+        store.clear()  # connect must load the room without the sync ORM
+        ws = WebsocketCommunicator(MatchStreamConsumer.as_asgi(), f"/matches/{match_id}/stream")
+        ws.scope["url_route"] = {"kwargs": {"match_id": match_id}}
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        frame = await ws.receive_json_from()
+        self.assertEqual(frame["type"], "state_sync")
+        self.assertEqual(frame["data"]["status"], "active")
+        await ws.disconnect()
+
+    async def test_binary_subprotocol_negotiated(self):
+        match_id = await sync_to_async(self.start_match)()
+        ws = WebsocketCommunicator(MatchStreamConsumer.as_asgi(), f"/matches/{match_id}/stream", subprotocols=[wire.SUBPROTOCOL])
+        ws.scope["url_route"] = {"kwargs": {"match_id": match_id}}
+        connected, subprotocol = await ws.connect()
+        self.assertEqual(subprotocol, wire.SUBPROTOCOL)
+        [sync] = wire.decode(await ws.receive_from(), match_id)
+        self.assertEqual(sync["data"]["players"][1]["userId"], str(self.bob.id))
+        await ws.disconnect()
+
+
+class LoadTestCommandTest(TransactionTestCase):
+    # The command's requests run on other threads, which must see its setup rows
+    def setUp(self):
+        self._timer_interval = turn_timers.interval
+        turn_timers.interval = None
+
+    def tearDown(self):
+        turn_timers.interval = self._timer_interval
+        store.flush()
+        store.clear()
+        game_log.flush()
+        turn_timers.clear()
+
+    def test_small_run_reports_every_endpoint(self):
+        out = io.StringIO()
+        call_command("loadtest", matches=1, turns=2, seed=1, json_path="-", stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["config"]["matches"], 1)
+        self.assertEqual(report["endpoints"]["create"]["statuses"], {"201": 1})
+        self.assertEqual(report["endpoints"]["start"]["statuses"], {"200": 1})
+        self.assertEqual(sum(e["errors"] for e in report["endpoints"].values()), 0)
+        # Rejections are timed in their own rows
+        for name, e in report["endpoints"].items():
+            self.assertEqual(e["rejected"] == e["requests"], name.endswith(" 4xx"), name)
+        # ...and the run deletes everything it wrote
+        self.assertFalse(Users.objects.exists())
+        self.assertFalse(GameRooms.objects.exists())
+        self.assertFalse(GameLogs.objects.exists())
+        self.assertFalse(Dreams.objects.exists())
+
+
+class WireTest(TestCase):
+    def test_binary_frame_round_trips_and_is_smaller(self):
+        out = MatchBroadcast("3f1c2a4e-0000-4000-8000-000000000001")
+        out.add("dice_result", {"die1": 3, "die2": 4, "sum": 7})
+        out.add("move_event", {"userId": "cpu:1", "tokenIndex": 2, "steps": 7, "position": 47})
+        out.add("state_update", {"players": [{"tokens": [0, 0, 47, 0], "seat": 1}], "matchId": out.match_id, "baseVersion": 4, "version": 5})
+        out.add("turn_change", {"nextPlayerSeat": 0})
+        out.add("card_draw", {"id": "x", "title": "Bonus"})
+        frame = wire.encode(out.events, out.timestamp)
+        self.assertEqual(wire.decode(frame, out.match_id), out.events)
+        self.assertLess(len(frame) * 3, sum(len(json.dumps(e)) for e in out.events))
+
+    async def test_binary_frame_built_only_for_binary_subscribers(self):
+        out = MatchBroadcast("3f1c2a4e-0000-4000-8000-000000000001")
+        out.add("turn_change", {"nextPlayerSeat": 0})
+        message = out.message()
+        sent = []
+
+        def subscriber(binary):
+            consumer = MatchStreamConsumer()
+            consumer.binary = binary
+
+            async def send(text_data=None, bytes_data=None, close=False):
+                sent.append(text_data or bytes_data)
+            consumer.send = send
+            return consumer
+
+        with mock.patch.object(wire, "encode", wraps=wire.encode) as encode:
+            await subscriber(False).game_event(message)
+            self.assertEqual(encode.call_count, 0)
+            for _ in range(2):
+                await subscriber(True).game_event(message)
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(sent[1], sent[2])
+
+
+class ShardedLayerTest(TestCase):
+    async def test_group_send_reaches_other_worker(self):
+        hubs = LocalHubs(2).start()
+        groups = ["match_1", "match_2", "match_5"]  # match_5 hashes to the other hub
+        try:
+            # Two layers stand in for two worker processes
+            sender, receiver = ShardedChannelLayer(hubs.hosts), ShardedChannelLayer(hubs.hosts)
+            channels = [await receiver.new_channel() for _ in groups]
+            for group, channel in zip(groups, channels):
+                await receiver.group_add(group, channel)
+            for i, group in enumerate(groups):
+                await sender.group_send(group, {"type": "game_event", "binary": bytes([i])})
+            for i, channel in enumerate(channels):
+                self.assertEqual((await receiver.receive(channel))["binary"], bytes([i]))
+
+            stats = receiver.stats()["groups"]
+            self.assertEqual(sorted(stats), groups)
+            self.assertEqual((stats["match_1"]["delivered"], stats["match_1"]["queueDepth"]), (1, 0))
+            self.assertEqual([len(hub.groups) for hub in hubs.hubs], [1, 2])
+            await sender.flush()
+            await receiver.flush()
+        finally:
+            hubs.stop()
+
+    async def test_reconnect_restores_group_memberships(self):
+        hubs = LocalHubs(2).start()
+        groups = ["match_1", "match_5"]
+        try:
+            sender, receiver = ShardedChannelLayer(hubs.hosts), ShardedChannelLayer(hubs.hosts)
+            channel = await receiver.new_channel()
+            for group in groups:
+                await receiver.group_add(group, channel)
+            link = await receiver._link()
+            old_tasks = list(link.tasks)
+            # The hubs drop every connection, and with it the memberships
+            for hub in hubs.hubs:
+                hubs._loop.call_soon_threadsafe(hub.close)
+            while link.writers:
+                await asyncio.sleep(0.01)
+            self.assertEqual([hub.groups for hub in hubs.hubs], [{}, {}])
+
+            await receiver._link()
+            self.assertTrue(all(task.done() for task in old_tasks))
+            self.assertEqual(len(link.tasks), len(hubs.hosts))
+            for i, group in enumerate(groups):
+                await sender.group_send(group, {"type": "game_event", "binary": bytes([i])})
+            # The groups live on different hubs, so arrival order is not fixed
+            received = {(await receiver.receive(channel))["binary"] for _ in groups}
+            self.assertEqual(received, {b"\x00", b"\x01"})
+            await sender.flush()
+            await receiver.flush()
+        finally:
+            hubs.stop()
+
+    async def test_discard_keeps_queue_in_use(self):
+        hubs = LocalHubs(1).start()
+        try:
+            layer = ShardedChannelLayer(hubs.hosts)
+            channel = await layer.new_channel()
+            for group in ["match_1", "match_2"]:
+                await layer.group_add(group, channel)
+            link = await layer._link()
+            pending = asyncio.ensure_future(layer.receive(channel))
+            await asyncio.sleep(0)
+            # Still in match_2, and still received on
+            await layer.group_discard("match_1", channel)
+            await layer.group_send("match_2", {"type": "game_event", "binary": b"\x01"})
+            self.assertEqual((await asyncio.wait_for(pending, 5))["binary"], b"\x01")
+            # Out of every group, but a receive is waiting
+            pending = asyncio.ensure_future(layer.receive(channel))
+            await asyncio.sleep(0)
+            await layer.group_discard("match_2", channel)
+            self.assertIn(channel, link.queues)
+            pending.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await pending
+            self.assertNotIn(channel, link.queues)
+            await layer.flush()
+        finally:
+            hubs.stop()
+
+
+class AffinityTest(TestCase):
+    def test_leaving_worker_moves_only_its_matches(self):
+        ring = HashRing(["w1", "w2", "w3"])
+        keys = [str(uuid.uuid4()) for _ in range(1000)]
+        before = {k: ring.owner(k) for k in keys}
+        ring.remove("w2")
+        moved = [k for k in keys if ring.owner(k) != before[k]]
+        self.assertTrue(moved)
+        self.assertTrue(all(before[k] == "w2" for k in moved))
+
+    async def test_router_forwards_to_owner(self):
+        heads = []
+
+        async def worker(name, reader, writer):
+            heads.append(await reader.readuntil(b"\r\n\r\n"))
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\n" + name)
+            await writer.drain()
+            writer.close()
+
+        servers = [await asyncio.start_server(partial(worker, name), "127.0.0.1", 0) for name in (b"w1", b"w2")]
+        workers = ["127.0.0.1:%d" % s.sockets[0].getsockname()[1] for s in servers]
+        router = MatchRouter(workers, health_interval=60)
+        front = await router.serve("127.0.0.1", 0)
+        address = "127.0.0.1:%d" % front.sockets[0].getsockname()[1]
+        try:
+            for _ in range(10):
+                match_id = str(uuid.uuid4())
+                _, body = await http_request(address, "GET", f"/matches/{match_id}/state")
+                self.assertEqual(body, b"w%d" % (workers.index(router.ring.owner(match_id)) + 1))
+            self.assertIn(b"\r\nX-Match-Ring-Epoch: 0\r\n", heads[-1])
+            router.remove_worker(workers[0])
+            # A client cannot forge the epoch
+            reader, writer = await asyncio.open_connection(*address.split(":"))
+            writer.write(f"GET /matches/{uuid.uuid4()}/state HTTP/1.1\r\nX-Match-Ring-Epoch: 7\r\n\r\n".encode())
+            await reader.read()
+            writer.close()
+            self.assertIn(b"\r\nX-Match-Ring-Epoch: 1\r\n", heads[-1])
+            self.assertNotIn(b"Epoch: 7", heads[-1])
+        finally:
+            router.close()
+            front.close()
+            for server in servers:
+                server.close()
+
+
+class BoardTest(TestCase):
+    def test_return_window_is_next_phase_odd_tiles(self):
+        # Bought at 27 (phase 3) -> returns on odd spots 31..39
+        paying = [i for i in range(board.TABLE_SIZE) if board.is_return_tile(27, i)]
+        self.assertEqual(paying, [31, 33, 35, 37, 39])
+
+    def test_return_tiles_match_phase_windows_past_the_tables(self):
+        def window(purchase_spot):
+            # The per-call computation the tables replaced
+            start = ((max(1, purchase_spot) - 1) // 10 + 1) * 10 + 1
+            return {i for i in range(start, start + 10) if i % 2 == 1}
+
+        for spot in range(-2, 200):
+            paying = window(spot)
+            for idx in range(-2, 220):
+                self.assertEqual(board.is_return_tile(spot, idx), idx in paying, (spot, idx))
+        self.assertEqual(board.phase_of(125), 13)
+
+    def test_legal_moves_prefer_yellow(self):
+        # 3 + 2 = 5 is yellow; nothing else lands on yellow
+        self.assertEqual(board.legal_moves([3, 6, 12, 40], 2), (0,))
+        self.assertTrue(board.skips_yellow([3, 6, 12, 40], 1, 2))
+        self.assertEqual(board.legal_moves([2, 6], 1), (0, 1))
+
+
+class SimulatorTest(TestCase):
+    def test_seeded_batches_are_reproducible(self):
+        from . import simulator
+
+        a = simulator.simulate(2000, players=2, seed=7, batch_size=500)
+        b = simulator.simulate(2000, players=2, seed=7, batch_size=500)
+        self.assertEqual(a, b)
+        self.assertAlmostEqual(sum(a["winRateBySeat"]) + a["unfinishedRate"], 1.0)
+        self.assertGreater(a["gameLength"]["mean"], 0)
+
+    def test_board_rules_match_live_play(self):
+        import numpy as np
+        from . import simulator
+
+        spots, positions = np.meshgrid(np.arange(-2, 200), np.arange(-2, 220), indexing="ij")
+        expected = np.vectorize(board.is_return_tile)(spots, positions)
+        self.assertTrue((simulator.is_return_tile(spots, positions) == expected).all())
+        self.assertTrue((simulator.phase_of(positions) == np.vectorize(board.phase_of)(positions)).all())
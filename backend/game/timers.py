@@ -0,0 +1,290 @@
+"""Turn deadlines for active matches.
+
+Each active match in this process has at most one pending timer in a
+hierarchical timing wheel. Scheduling, rescheduling and cancelling take O(1).
+A single thread advances the wheel every ``tick`` seconds, so no task or thread
+is kept per timer. The timer is not re-armed on every move. When it fires,
+``MatchState.turn_started`` says whether the turn is really overdue; if not,
+the timer is set again for the time that is left.
+
+An overdue human turn is played by the CPU on the player's behalf
+(``MATCH_TURN_TIMEOUT_ACTION = "cpu"``) or skipped (``"skip"``). After
+``MATCH_ABANDON_AFTER`` human turns in a row have timed out, the match is
+closed as ``abandoned`` and dropped from the match cache. A match that ended
+some other way is dropped the next time its timer fires.
+
+Matches are watched once they are played in this process. ``start`` (called
+when the ASGI/WSGI application loads) also sweeps the active rooms in the
+database. A restart would otherwise leave matches that nobody plays again
+unwatched for ever.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max
+from django.utils import timezone
+
+from . import actions
+from .actions import ActionError
+from .cpu import cpu_players
+from .engine import store, MatchState
+from .models import GameRooms
+
+logger = logging.getLogger(__name__)
+
+TURN_TIMEOUT = getattr(settings, "MATCH_TURN_TIMEOUT", 60.0)  # seconds per turn
+TIMEOUT_ACTION = getattr(settings, "MATCH_TURN_TIMEOUT_ACTION", "cpu")  # "cpu" or "skip"
+ABANDON_AFTER = getattr(settings, "MATCH_ABANDON_AFTER", 6)  # timed-out human turns in a row
+TIMER_TICK = getattr(settings, "MATCH_TIMER_TICK", 0.25)  # seconds per wheel tick
+RETRY_DELAY = 1.0  # seconds before retrying a timeout that lost a turn claim
+
+
+class TimingWheel:
+    """Keyed timers on ``levels`` wheels of ``2 ** bits`` slots each.
+
+    Deadlines are whole ticks. A timer sits on the lowest wheel whose current
+    rotation contains its deadline. It moves down a wheel each time the wheel
+    below wraps, and fires from wheel 0. With 64 slots and 4 wheels, one wheel
+    covers 16.7M ticks (about 48 days at 0.25 s).
+    """
+
+    def __init__(self, bits=6, levels=4, now=0):
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.levels = levels
+        self.now = now
+        self._wheels = [[{} for _ in range(1 << bits)] for _ in range(levels)]
+        self._where: dict = {}  # key -> (level, slot)
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def schedule(self, key, deadline: int):
+        """Set ``key`` to fire at tick ``deadline``, replacing any pending timer."""
+        self.cancel(key)
+        self._place(key, max(deadline, self.now + 1))
+
+    def cancel(self, key):
+        where = self._where.pop(key, None)
+        if where is not None:
+            level, slot = where
+            self._wheels[level][slot].pop(key, None)
+
+    def _place(self, key, deadline: int):
+        for level in range(self.levels):
+            shift = self.bits * (level + 1)
+            if deadline >> shift == self.now >> shift:
+                break
+        # Past the top wheel's rotation the timer waits on the top wheel and is
+        # placed again when that slot comes round
+        slot = (deadline >> (self.bits * level)) & self.mask
+        self._wheels[level][slot][key] = deadline
+        self._where[key] = (level, slot)
+
+    def advance(self, to: int) -> list:
+        """Move the wheel to tick ``to``; returns the keys that fired, in order."""
+        fired = []
+        while self.now < to:
+            self.now += 1
+            # Wheels whose lower neighbour just wrapped hand their slot down
+            for level in range(self.levels - 1, 0, -1):
+                if self.now & ((1 << (self.bits * level)) - 1) == 0:
+                    slot = (self.now >> (self.bits * level)) & self.mask
+                    bucket, self._wheels[level][slot] = self._wheels[level][slot], {}
+                    for key, deadline in bucket.items():
+                        self._place(key, deadline)
+            slot = self.now & self.mask
+            bucket, self._wheels[0][slot] = self._wheels[0][slot], {}
+            for key in bucket:
+                del self._where[key]
+            fired.extend(bucket)
+        return fired
+
+
+class TurnTimers:
+    """Enforces turn deadlines for the matches this process serves.
+
+    With ``interval=None`` (tests) no thread runs; call ``run_due`` instead.
+    """
+
+    def __init__(self, timeout=TURN_TIMEOUT, action=TIMEOUT_ACTION, abandon_after=ABANDON_AFTER, interval=TIMER_TICK):
+        self.timeout = timeout
+        self.action = action
+        self.abandon_after = abandon_after
+        self.interval = interval
+        self.tick = interval or TIMER_TICK
+        self.wheel = TimingWheel(now=self._ticks(time.monotonic()))
+        self.timed_out = self.abandoned = 0
+        # match id -> turn_started for matches armed by ``sweep`` and not loaded yet
+        self._idle_since: dict = {}
+        self._sweep_due = False
+        self.sweep_on_start = True  # off for in-process benchmarks (``game.management.asgi_client``)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _ticks(self, seconds: float) -> int:
+        return int(seconds / self.tick)
+
+    def watch(self, state: MatchState):
+        """Start enforcing deadlines for ``state``; cheap to call repeatedly."""
+        with self._lock:
+            # Played here, so its turn is no longer dated from the sweep
+            self._idle_since.pop(state.id, None)
+            if state.id in self.wheel:
+                return
+            self._arm(state.id, state.turn_started + self.timeout)
+        self._ensure_thread()
+
+    def start(self):
+        """Start the timer thread, which first runs ``sweep``."""
+        if self.interval is None:
+            return
+        self._sweep_due = self.sweep_on_start
+        self._ensure_thread()
+
+    def sweep(self) -> int:
+        """Arm a timer for every active room this process is not watching.
+
+        A room's turn is dated from its latest log entry (or its start), so an
+        overdue turn fires on the next tick. The match is loaded only when its
+        timer fires. Returns how many timers were armed.
+        """
+        rooms = (GameRooms.objects.filter(status="active")
+                 .annotate(last_action=Max("gamelogs__timestamp"))
+                 .values_list("id", "started_at", "last_action"))
+        wall, now = timezone.now(), time.monotonic()
+        armed = 0
+        for match_id, started_at, last_action in rooms:
+            match_id = str(match_id)
+            since = last_action or started_at
+            turn_started = now - (wall - since).total_seconds() if since else now
+            with self._lock:
+                if match_id in self.wheel:
+                    continue
+                self._idle_since[match_id] = turn_started
+                self._arm(match_id, turn_started + self.timeout)
+            armed += 1
+        return armed
+
+    def _arm(self, match_id, at: float):
+        # Called with self._lock held
+        self.wheel.schedule(match_id, self._ticks(at) + 1)
+
+    def run_due(self, now: float | None = None) -> int:
+        """Handle every timer due by ``now``; returns how many fired."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            due = self.wheel.advance(self._ticks(now))
+        for match_id in due:
+            try:
+                self._expire(match_id, now)
+            except Exception:
+                logger.exception("turn timer failed for match %s", match_id)
+        return len(due)
+
+    def _expire(self, match_id, now: float):
+        state = store.peek(match_id)
+        with self._lock:
+            idle_since = self._idle_since.pop(match_id, None)
+        if idle_since is not None:
+            # Armed by the sweep; nobody has played it in this process yet
+            state = state or store.get(match_id)
+            if state is None:
+                return
+            with state.lock:
+                state.turn_started = min(state.turn_started, idle_since)
+        if state is None:
+            # Evicted; the match is watched again if it is loaded again
+            return
+        with state.lock:
+            active = state.status == "active"
+            overdue_at = state.turn_started + self.timeout
+            player = state.player_at_seat(state.current_turn)
+            abandon = state.idle_turns >= self.abandon_after
+        if not active:
+            store.evict(match_id)
+            return
+        if overdue_at > now:
+            with self._lock:
+                self._arm(match_id, overdue_at)
+            return
+        if player is None or player.is_cpu:
+            # A CPU seat is stuck (e.g. a failed pool turn); nudge the pool
+            cpu_players.schedule(state)
+        elif abandon:
+            _, out = actions.abandon(state)
+            out.send()
+            self.abandoned += 1
+            store.evict(match_id)
+            return
+        else:
+            try:
+                self._time_out(state)
+            except ActionError as e:
+                if state.status != "active":
+                    # Ended while the turn was timing out
+                    store.evict(match_id)
+                    return
+                if not e.retryable:
+                    raise
+                with self._lock:
+                    self._arm(match_id, now + RETRY_DELAY)
+                return
+            cpu_players.schedule(state)
+        with self._lock:
+            self._arm(match_id, max(now, state.turn_started) + self.timeout)
+
+    def _time_out(self, state: MatchState):
+        with state.lock:
+            idle = state.idle_turns
+        if self.action == "cpu":
+            cpu_players.take_turn(state, stand_in=True)
+        else:
+            _, out = actions.skip_turn(state)
+            out.send()
+        with state.lock:
+            state.idle_turns = idle + 1
+        self.timed_out += 1
+
+    def _ensure_thread(self):
+        if self.interval is None:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="turn-timers", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                swept = self._sweep_due
+                if swept:
+                    self._sweep_due = False
+                    self.sweep()
+                if self.run_due() or swept:
+                    close_old_connections()
+            except Exception:
+                logger.exception("turn timers failed")
+
+    def clear(self):
+        with self._lock:
+            self.wheel = TimingWheel(now=self._ticks(time.monotonic()))
+            self._idle_since.clear()
+
+    def shutdown(self):
+        self._stopped.set()
+
+
+turn_timers = TurnTimers()
+atexit.register(turn_timers.shutdown)
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path("matches", views.create_match),
@@ -9,4 +9,21 @@ urlpatterns = [
     path("matches/<str:match_id>/roll", views.roll_dice),
     path("matches/<str:match_id>/move", views.move_token),
     path("matches/<str:match_id>/select-asset", views.select_asset),
+    path("matches/<str:match_id>/replay", views.replay_match),
+    path("matchmaking", views.join_queue),
+    path("matchmaking/<str:ticket_id>", views.queue_ticket),
+    # Async-native match API (same contract, no sync bridges under ASGI)
+    path("async/matches", async_views.create_match),
+    path("async/matches/<str:match_id>/join", async_views.join_match),
+    path("async/matches/<str:match_id>/start", async_views.start_match),
+    path("async/matches/<str:match_id>/state", async_views.get_state),
+    path("async/matches/<str:match_id>/roll", async_views.roll_dice),
+    path("async/matches/<str:match_id>/move", async_views.move_token),
+    path("async/matches/<str:match_id>/select-asset", async_views.select_asset),
+    path("async/matchmaking", async_views.join_queue),
+    path("async/matchmaking/<str:ticket_id>", async_views.queue_ticket),
+    path("async/matches/<str:match_id>/cards/draw", async_views.draw_playing_card),
+    path("async/matches/<str:match_id>/cards/savings", async_views.play_savings_card),
+    path("async/matches/<str:match_id>/cards/spending", async_views.play_spending_card),
+    path("async/matches/<str:match_id>/dreams/purchase", async_views.purchase_dream),
 ]
@@ -0,0 +1,284 @@
+"""Compact binary encoding for match streams.
+
+Clients that offer the ``pesamali.bin.v1`` websocket subprotocol receive one
+binary message per broadcast instead of one JSON text message per event::
+
+    u8    protocol version (1)
+    uvar  timestamp, ms since the epoch
+    uvar  event count
+    ...   events
+
+An event is a u8 type code followed by its fields in schema order. Integers
+are zigzag varints, so seats, dice and board positions take a single byte.
+UUIDs travel as 16 raw bytes. The match id is implied by the stream and is not
+sent. Event types without a schema use code 0 followed by the type name and the
+JSON-encoded data.
+"""
+import json
+import threading
+import uuid
+from collections import OrderedDict
+
+SUBPROTOCOL = "pesamali.bin.v1"
+VERSION = 1
+
+GENERIC = 0
+STATE_UPDATE = 6
+STATE_SYNC = 7
+
+# type -> (code, [(key, kind), ...])
+SCHEMAS = {
+    "dice_result": (1, [("die1", "int"), ("die2", "int"), ("sum", "int")]),
+    "move_event": (2, [("userId", "id"), ("tokenIndex", "int"), ("steps", "int"), ("position", "int")]),
+    "asset_return": (3, [("assetId", "str"), ("amount", "int"), ("returnsCollected", "int")]),
+    "turn_change": (4, [("nextPlayerSeat", "int")]),
+    "asset_purchase": (5, [("userId", "id"), ("assetId", "str"), ("purchaseSpot", "int")]),
+    "savings_play": (8, [("cardId", "id"), ("amount", "int"), ("bonus", "int")]),
+    "spending_play": (9, [("cardId", "id"), ("total", "int")]),
+    "dream_purchase": (10, [("userId", "id"), ("dreamId", "id"), ("cost", "int")]),
+    "game_end": (11, [("winnerId", "id"), ("dreamId", "id")]),
+}
+TYPES = {code: (type, fields) for type, (code, fields) in SCHEMAS.items()}
+
+# State flags and per-player field masks
+_STATUS, _TURN, _COUNT, _BASE = 1, 2, 4, 8
+PLAYER_FIELDS = [
+    ("userId", "id"),
+    ("isAi", "bool"),
+    ("tokens", "ints"),
+    ("savings", "int"),
+    ("liabilities", "int"),
+    ("currentPoints", "int"),
+    ("assets", "json"),
+]
+
+
+class Writer:
+    def __init__(self):
+        self.buf = bytearray()
+
+    def uvar(self, n: int):
+        while n > 0x7F:
+            self.buf.append((n & 0x7F) | 0x80)
+            n >>= 7
+        self.buf.append(n)
+
+    def int(self, n: int):
+        n = int(n)
+        self.uvar(n << 1 if n >= 0 else (-n << 1) - 1)
+
+    def bool(self, value):
+        self.buf.append(1 if value else 0)
+
+    def ints(self, values):
+        self.uvar(len(values))
+        for n in values:
+            self.int(n)
+
+    def str(self, value):
+        # Length + 1, so 0 can stand for None
+        if value is None:
+            self.uvar(0)
+            return
+        data = str(value).encode()
+        self.uvar(len(data) + 1)
+        self.buf += data
+
+    def id(self, value):
+        if value is None:
+            self.buf.append(0)
+            return
+        try:
+            raw = uuid.UUID(str(value)).bytes
+        except ValueError:
+            # Non-UUID handles such as CPU seats ("cpu:1")
+            self.buf.append(2)
+            self.str(value)
+            return
+        self.buf.append(1)
+        self.buf += raw
+
+    def json(self, value):
+        self.str(json.dumps(value, separators=(",", ":")))
+
+
+class Reader:
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def byte(self) -> int:
+        b = self.data[self.pos]
+        self.pos += 1
+        return b
+
+    def uvar(self) -> int:
+        n = shift = 0
+        while True:
+            b = self.byte()
+            n |= (b & 0x7F) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+
+    def int(self) -> int:
+        n = self.uvar()
+        return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+    def bool(self) -> bool:
+        return self.byte() == 1
+
+    def ints(self) -> list:
+        return [self.int() for _ in range(self.uvar())]
+
+    def str(self):
+        size = self.uvar()
+        if size == 0:
+            return None
+        start = self.pos
+        self.pos += size - 1
+        return bytes(self.data[start:self.pos]).decode()
+
+    def id(self):
+        tag = self.byte()
+        if tag == 0:
+            return None
+        if tag == 2:
+            return self.str()
+        start = self.pos
+        self.pos += 16
+        return str(uuid.UUID(bytes=bytes(self.data[start:self.pos])))
+
+    def json(self):
+        return json.loads(self.str())
+
+
+def _write_state(w: Writer, data: dict):
+    flags = 0
+    for key, bit in (("status", _STATUS), ("currentTurn", _TURN), ("playerCount", _COUNT), ("baseVersion", _BASE)):
+        if data.get(key) is not None:
+            flags |= bit
+    w.uvar(data["version"])
+    w.buf.append(flags)
+    if flags & _BASE:
+        w.uvar(data["baseVersion"])
+    if flags & _STATUS:
+        w.str(data["status"])
+    if flags & _TURN:
+        w.int(data["currentTurn"])
+    if flags & _COUNT:
+        w.int(data["playerCount"])
+    players = data.get("players") or []
+    w.uvar(len(players))
+    for player in players:
+        w.int(player["seat"])
+        mask = 0
+        for bit, (key, _) in enumerate(PLAYER_FIELDS):
+            if key in player:
+                mask |= 1 << bit
+        w.buf.append(mask)
+        for bit, (key, kind) in enumerate(PLAYER_FIELDS):
+            if mask & (1 << bit):
+                getattr(w, kind)(player[key])
+
+
+def _read_state(r: Reader) -> dict:
+    data = {"version": r.uvar()}
+    flags = r.byte()
+    if flags & _BASE:
+        data["baseVersion"] = r.uvar()
+    if flags & _STATUS:
+        data["status"] = r.str()
+    if flags & _TURN:
+        data["currentTurn"] = r.int()
+    if flags & _COUNT:
+        data["playerCount"] = r.int()
+    players = []
+    for _ in range(r.uvar()):
+        player = {"seat": r.int()}
+        mask = r.byte()
+        for bit, (key, kind) in enumerate(PLAYER_FIELDS):
+            if mask & (1 << bit):
+                player[key] = getattr(r, kind)()
+        players.append(player)
+    if players or flags & _COUNT:
+        data["players"] = players
+    return data
+
+
+def _write_event(w: Writer, type: str, data):
+    mark = len(w.buf)
+    try:
+        if type in ("state_update", "state_sync"):
+            w.buf.append(STATE_UPDATE if type == "state_update" else STATE_SYNC)
+            _write_state(w, data)
+            return
+        if type in SCHEMAS:
+            code, fields = SCHEMAS[type]
+            w.buf.append(code)
+            for key, kind in fields:
+                getattr(w, kind)(data[key])
+            return
+    except (KeyError, TypeError, ValueError):
+        # Data that does not fit its schema goes out generic
+        del w.buf[mark:]
+    w.buf.append(GENERIC)
+    w.str(type)
+    w.json(data)
+
+
+def encode(events: list[dict], timestamp: int) -> bytes:
+    """Encode the events of one broadcast (``MatchBroadcast.events``)."""
+    w = Writer()
+    w.buf.append(VERSION)
+    w.uvar(timestamp)
+    w.uvar(len(events))
+    for event in events:
+        _write_event(w, event["type"], event["data"])
+    return bytes(w.buf)
+
+
+FRAME_CACHE_SIZE = 256
+_frames: "OrderedDict[str, bytes]" = OrderedDict()
+_frames_lock = threading.Lock()
+
+
+def frame(message: dict) -> bytes:
+    """Binary form of a ``MatchBroadcast`` message, encoded once per process.
+
+    Every binary subscriber of the frame in this process shares the bytes;
+    frames with only JSON subscribers are never decoded or encoded.
+    """
+    key = message["frame"]
+    with _frames_lock:
+        data = _frames.get(key)
+    if data is None:
+        data = encode([json.loads(text) for text in message["texts"]], message["timestamp"])
+        with _frames_lock:
+            _frames[key] = data
+            if len(_frames) > FRAME_CACHE_SIZE:
+                _frames.popitem(last=False)
+    return data
+
+
+def decode(message: bytes, match_id=None) -> list[dict]:
+    """Inverse of ``encode``; events come back in the JSON event shape."""
+    r = Reader(message)
+    if r.byte() != VERSION:
+        raise ValueError("unsupported protocol version")
+    timestamp = r.uvar()
+    events = []
+    for _ in range(r.uvar()):
+        code = r.byte()
+        if code == GENERIC:
+            type, data = r.str(), r.json()
+        elif code in (STATE_UPDATE, STATE_SYNC):
+            type = "state_update" if code == STATE_UPDATE else "state_sync"
+            data = _read_state(r)
+            if match_id is not None:
+                data["matchId"] = match_id
+        else:
+            type, fields = TYPES[code]
+            data = {key: getattr(r, kind)() for key, kind in fields}
+        events.append({"type": type, "matchId": match_id, "data": data, "timestamp": timestamp})
+    return events